@@ -0,0 +1,57 @@
+from gpio import *
+
+# last value written to each pin, by (write function, pin)
+written = {}
+
+# display text waiting for the end of the tick, by pin
+pendingDisplays = {}
+
+writeCount = 0
+suppressedCount = 0
+
+
+def write(function, pin, value):
+    global writeCount
+    global suppressedCount
+
+    key = (function, pin)
+
+    # the device already shows this value, writing it again only costs a slow I/O call
+    if key in written and written[key] == value:
+        suppressedCount += 1
+
+        return False
+
+    function(pin, value)
+
+    written[key] = value
+
+    writeCount += 1
+
+    return True
+
+
+def writeDigital(pin, value):
+    return write(digitalWrite, pin, value)
+
+
+def writeCustom(pin, value):
+    return write(customWrite, pin, value)
+
+
+def writeDisplay(pin, message):
+    global suppressedCount
+
+    # only the last message of a tick would stay visible, so only that one is written
+    if pin in pendingDisplays:
+        suppressedCount += 1
+
+    pendingDisplays[pin] = message
+
+
+def flushDisplays():
+    # called once at the end of every loop iteration
+    for pin in list(pendingDisplays.keys()):
+        writeCustom(pin, pendingDisplays[pin])
+
+    pendingDisplays.clear()
@@ -0,0 +1,147 @@
+from typing import Sequence, Tuple, Union
+import numpy as np
+
+# scales the median absolute deviation of normally distributed data to its standard deviation
+MAD_SCALE = 1.4826
+
+# average group size above which grouped medians partition every group instead of sorting them all
+GROUPED_SORT_LIMIT = 4096
+
+
+def as_float_array(data: Union[Sequence[float], np.ndarray]) -> np.ndarray:
+    return np.ascontiguousarray(data, dtype=np.float64)
+
+
+def mean_variance(data: Union[Sequence[float], np.ndarray]) -> Tuple[float, float]:
+    values = as_float_array(data)
+
+    if not len(values):
+        raise ValueError('Statistics of empty data')
+
+    # shifting by the first reading keeps the sum of squares from cancelling for values far from zero
+    shifted = values - values[0]
+
+    mean = shifted.sum() / len(values)
+
+    variance = np.dot(shifted, shifted) / len(values) - mean * mean
+
+    return float(values[0] + mean), float(max(variance, 0.0))
+
+
+def median_sigma(data: Union[Sequence[float], np.ndarray]) -> Tuple[float, float]:
+    values = as_float_array(data)
+
+    if not len(values):
+        raise ValueError('Statistics of empty data')
+
+    median = np.median(values)
+
+    return float(median), float(np.median(np.abs(values - median)) * MAD_SCALE)
+
+
+def rolling_mean_sigma(data: Union[Sequence[float], np.ndarray], window: int) -> Tuple[np.ndarray, np.ndarray]:
+    # statistics of the up to `window` readings before each position, nan where there are none
+    values = as_float_array(data)
+
+    shifted = values - (values[0] if len(values) else 0.0)
+
+    sums = np.concatenate(([0.0], np.cumsum(shifted)))
+
+    squares = np.concatenate(([0.0], np.cumsum(shifted * shifted)))
+
+    ends = np.arange(len(values))
+
+    starts = np.maximum(ends - window, 0)
+
+    counts = (ends - starts).astype(np.float64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (sums[ends] - sums[starts]) / counts
+
+        variances = (squares[ends] - squares[starts]) / counts - means * means
+
+    return means + (values[0] if len(values) else 0.0), np.sqrt(np.maximum(variances, 0.0))
+
+
+def group_order(groups: np.ndarray, group_count: int) -> np.ndarray:
+    # stable order by group; small group numbers are narrowed so numpy can use its radix sort
+    if group_count <= np.iinfo(np.uint16).max + 1:
+        groups = groups.astype(np.uint16)
+
+    return np.argsort(groups, kind='stable')
+
+
+def group_ranks(groups: np.ndarray, group_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    # position of every value within its group (in input order) and the size of each group
+    sizes = np.bincount(groups, minlength=group_count)
+
+    order = group_order(groups, group_count)
+
+    ranks = np.empty(len(groups), dtype=np.int64)
+
+    ranks[order] = np.arange(len(groups)) - \
+        np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    return ranks, sizes
+
+
+def grouped_moments(data: Union[Sequence[float], np.ndarray], groups: np.ndarray, group_count: int,
+                    weights: Union[np.ndarray, None] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # total weight, weighted mean and weighted sum of squared deviations of every group in one pass per moment
+    values = as_float_array(data)
+
+    weights = np.ones(len(values)) if weights is None else weights
+
+    totals = np.bincount(groups, weights, minlength=group_count)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.bincount(groups, weights * values,
+                            minlength=group_count) / totals
+
+    deviations = values - means[groups]
+
+    return totals, means, np.bincount(groups, weights * deviations * deviations, minlength=group_count)
+
+
+def grouped_median_sigma(data: Union[Sequence[float], np.ndarray], groups: np.ndarray, group_count: int) -> Tuple[np.ndarray, np.ndarray]:
+    values = as_float_array(data)
+
+    sizes = np.bincount(groups, minlength=group_count)
+
+    medians, sigmas = np.full(group_count, np.nan), np.full(group_count, np.nan)
+
+    # large groups are cheaper to partition one by one than to sort; small ones share a single sort
+    if len(values) > GROUPED_SORT_LIMIT * max(group_count, 1):
+        group_values = np.split(
+            values[group_order(groups, group_count)], np.cumsum(sizes)[:-1])
+
+        for group in np.flatnonzero(sizes):
+            medians[group], sigmas[group] = median_sigma(group_values[group])
+
+        return medians, sigmas
+
+    present = sizes > 0
+
+    medians[present] = sorted_group_medians(values, groups, group_count, sizes)
+
+    sigmas[present] = sorted_group_medians(np.abs(
+        values - medians[groups]), groups, group_count, sizes) * MAD_SCALE
+
+    return medians, sigmas
+
+
+def sorted_group_medians(values: np.ndarray, groups: np.ndarray, group_count: int, sizes: np.ndarray) -> np.ndarray:
+    # one sort by value, then a stable sort by group, leaves every group's values sorted in place
+    by_value = np.argsort(values)
+
+    order = by_value[group_order(groups[by_value], group_count)]
+
+    starts = np.cumsum(sizes) - sizes
+
+    present = sizes > 0
+
+    low = order[starts[present] + (sizes[present] - 1) // 2]
+
+    high = order[starts[present] + sizes[present] // 2]
+
+    return (values[low] + values[high]) / 2
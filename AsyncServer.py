@@ -0,0 +1,295 @@
+import asyncio
+import json
+import os
+from functools import wraps
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, Tuple, Union
+from urllib.parse import parse_qsl
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+from BatchFormat import BATCH_MIMETYPE
+from Compression import MAX_COMPRESSED_SIZE, CompressionError, choose_encoding, compress_stream, decompress_body
+from Metrics import METRICS_CONTENT_TYPE, METRICS_ENABLED, finish_request, render_metrics, stage_timer, start_request
+from Server import JSON_MIMETYPE, NDJSON_MIMETYPE, HttpError, commit_queue, filter_temperature_batch, filter_temperatures, get_cache_statistics, \
+    get_sensor_argument, get_version_headers, is_not_modified, list_sensors, query_aggregates, query_temperature_chunks, stream_temperature_data
+from Validation import get_validator, temperatureDataBatchSchema, temperatureDataRequestSchema
+
+HOST = os.environ.get('TEMPERATURE_SERVER_HOST', '127.0.0.1')
+PORT = int(os.environ.get('TEMPERATURE_SERVER_PORT', 8000))
+
+# devices post every few seconds, so idle connections are kept long enough to be reused
+KEEP_ALIVE_TIMEOUT = 75
+BACKLOG = 4096
+
+
+class AsyncRequest:
+    def __init__(self, scope: dict, receive: Callable[[], Awaitable[dict]]):
+        self.scope = scope
+
+        self.receive = receive
+
+        self.args = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope['headers']}
+
+        self.mimetype = self.headers.get(
+            'content-type', '').split(';')[0].strip().lower()
+
+        self._body = None
+
+    async def body(self) -> bytes:
+        if self._body is None:
+            chunks, size = [], 0
+
+            while True:
+                message = await self.receive()
+
+                chunks.append(message.get('body', b''))
+
+                size += len(chunks[-1])
+
+                if self.headers.get('content-encoding') and size > MAX_COMPRESSED_SIZE:
+                    raise HttpError(413, f'Compressed body is larger than {MAX_COMPRESSED_SIZE} bytes')
+
+                if not message.get('more_body'):
+                    break
+
+            try:
+                self._body = await asyncio.to_thread(decompress_body, b''.join(chunks), self.headers.get('content-encoding'))
+            except CompressionError as e:
+                raise HttpError(e.error_code, str(e))
+
+        return self._body
+
+    async def json(self):
+        body = await self.body()
+
+        return json.loads(body) if body else None
+
+
+class AsyncResponse:
+    def __init__(self, body: Union[bytes, AsyncIterator[bytes]], status: int = 200,
+                 headers: Union[Dict[str, str], None] = None, mimetype: str = JSON_MIMETYPE):
+        self.body = body
+
+        self.status = status
+
+        self.headers = dict(headers or {})
+
+        self.headers['content-type'] = mimetype
+
+    async def send(self, send: Callable[[dict], Awaitable[None]]):
+        headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in self.headers.items()]
+
+        if isinstance(self.body, bytes):
+            headers.append((b'content-length', str(len(self.body)).encode()))
+
+            await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+
+            await send({'type': 'http.response.body', 'body': self.body})
+
+            return
+
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+
+        async for chunk in self.body:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def json_response(data, status: int = 200, headers: Union[Dict[str, str], None] = None) -> AsyncResponse:
+    return AsyncResponse(json.dumps(data).encode(), status, headers)
+
+
+async def iterate_in_thread(iterator: Iterator[Union[str, bytes]]) -> AsyncIterator[bytes]:
+    # each chunk is read from the mapped segment, serialised and compressed off the event loop
+    while True:
+        chunk = await asyncio.to_thread(next, iterator, None)
+
+        if chunk is None:
+            return
+
+        yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+AsyncHandler = Callable[[AsyncRequest], Awaitable[AsyncResponse]]
+
+ROUTES: Dict[Tuple[str, str], AsyncHandler] = {}
+
+
+def route(path: str, method: str):
+    def decorator(handler: AsyncHandler):
+        ROUTES[(method, path)] = handler
+
+        return handler
+    return decorator
+
+
+def async_route_wrapper(schema=None):
+    validator = get_validator(schema) if schema else None
+
+    def decorator(handler: Callable):
+        @wraps(handler)
+        async def wrapper(request: AsyncRequest) -> AsyncResponse:
+            started, status = start_request(handler.__name__), 500
+
+            try:
+                if validator and request.mimetype != BATCH_MIMETYPE:
+                    with stage_timer('validate'):
+                        is_valid, error_message = validator(await request.json())
+
+                    if not is_valid:
+                        raise HttpError(
+                            422, error_message or 'Validation error')
+
+                result = await handler(request)
+
+                response = result if isinstance(result, AsyncResponse) else json_response(result)
+
+                status = response.status
+
+                return response
+            except Exception as e:
+                http_error = e if isinstance(e, HttpError) else HttpError()
+
+                message, error_code = http_error.message, http_error.error_code
+
+                print(f'Error: {e}. Code: {error_code}. Message: {message}')
+
+                status = error_code
+
+                return json_response({"error": message}, error_code)
+            finally:
+                finish_request(handler.__name__, started, status)
+        return wrapper
+    return decorator
+
+
+async def ingest_temperatures(temperature_data) -> list:
+    # opening a partition and running its statistics filter block, so they leave the event loop like the queries do
+    filtered_temperatures = await asyncio.to_thread(filter_temperatures, temperature_data)
+
+    if len(filtered_temperatures):
+        await asyncio.wrap_future(commit_queue.submit(filtered_temperatures))
+
+    return filtered_temperatures
+
+
+@route("/", "GET")
+@async_route_wrapper()
+async def get_temperatures(request: AsyncRequest):
+    accept = parse_accept_header(request.headers.get('accept'), MIMEAccept)
+
+    mimetype = accept.best_match(
+        [JSON_MIMETYPE, NDJSON_MIMETYPE]) or JSON_MIMETYPE
+
+    encoding = choose_encoding(request.headers.get('accept-encoding'))
+
+    partition = await asyncio.to_thread(get_sensor_argument, request.args)
+
+    headers = get_version_headers(partition.storage, mimetype, encoding)
+
+    if is_not_modified(request.headers.get('if-none-match'), headers['ETag']):
+        return AsyncResponse(b'', 304, headers, mimetype)
+
+    chunks, query_headers = await asyncio.to_thread(query_temperature_chunks, partition, request.args)
+
+    body = stream_temperature_data(chunks, mimetype)
+
+    if encoding:
+        body, headers['Content-Encoding'] = compress_stream(body, encoding), encoding
+
+    return AsyncResponse(iterate_in_thread(body), 200, {**headers, **query_headers}, mimetype)
+
+
+@route("/aggregate", "GET")
+@async_route_wrapper()
+async def get_aggregates(request: AsyncRequest):
+    return await asyncio.to_thread(query_aggregates, request.args)
+
+
+@route("/sensors", "GET")
+@async_route_wrapper()
+async def get_sensors(request: AsyncRequest):
+    return list_sensors()
+
+
+@route("/cache", "GET")
+@async_route_wrapper()
+async def get_cache(request: AsyncRequest):
+    return get_cache_statistics()
+
+
+@route("/metrics", "GET")
+@async_route_wrapper()
+async def get_metrics(request: AsyncRequest):
+    if not METRICS_ENABLED:
+        raise HttpError(404, 'Metrics are disabled')
+
+    return AsyncResponse(render_metrics().encode(), 200, mimetype=METRICS_CONTENT_TYPE)
+
+
+@route("/", "POST")
+@async_route_wrapper(temperatureDataRequestSchema)
+async def add_temperature(request: AsyncRequest):
+    body = await request.json()
+
+    return await ingest_temperatures([body["temperature_data"]])
+
+
+@route("/batch", "POST")
+@async_route_wrapper(temperatureDataBatchSchema)
+async def add_temperatures(request: AsyncRequest):
+    if request.mimetype == BATCH_MIMETYPE:
+        batch, rejected = await asyncio.to_thread(filter_temperature_batch, await request.body())
+
+        if len(batch.times):
+            await asyncio.wrap_future(commit_queue.submit(batch))
+
+        return {"accepted": len(batch.times), "rejected": rejected}
+
+    body = await request.json()
+
+    return await ingest_temperatures(body["temperatures_batch"])
+
+
+async def handle_lifespan(receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable[None]]):
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(commit_queue.close)
+
+            await send({'type': 'lifespan.shutdown.complete'})
+
+            return
+
+
+async def app(scope: dict, receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable[None]]):
+    if scope['type'] == 'lifespan':
+        return await handle_lifespan(receive, send)
+
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get((scope['method'], scope['path']))
+
+    if handler is not None:
+        response = await handler(AsyncRequest(scope, receive))
+    elif any(path == scope['path'] for _, path in ROUTES):
+        response = json_response({"error": "Method not allowed"}, 405)
+    else:
+        response = json_response({"error": "Not found"}, 404)
+
+    await response.send(send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=HOST, port=PORT,
+                timeout_keep_alive=KEEP_ALIVE_TIMEOUT, backlog=BACKLOG)
@@ -0,0 +1,85 @@
+import struct
+from datetime import datetime, timezone
+from typing import Tuple
+import numpy as np
+from Storage import DEFAULT_SENSOR_ID, EPOCH, MICROSECONDS_PER_SECOND
+
+BATCH_MIMETYPE = 'application/x-temperature-batch'
+
+BATCH_MAGIC = b'TBAT'
+BATCH_VERSION = 1
+
+# magic, version, sensor id length, base time in epoch seconds, reading count; followed by the sensor id,
+# the reading count int32 millisecond offsets from the base time and as many float32 temperatures
+BATCH_HEADER = struct.Struct('<4sBBxxqI')
+
+# the years an RFC 3339 date-time can name, like the times JSON clients send; this also keeps
+# base * MICROSECONDS_PER_SECOND far from int64 overflow
+MIN_BASE = int((datetime(1, 1, 1, tzinfo=timezone.utc) - EPOCH).total_seconds())
+MAX_BASE = int((datetime(9999, 12, 31, 23, 59, 59, tzinfo=timezone.utc) - EPOCH).total_seconds())
+
+DELTA_DTYPE = np.dtype('<i4')
+TEMPERATURE_DTYPE = np.dtype('<f4')
+
+
+class BatchFormatError(ValueError):
+    pass
+
+
+def encode_batch(times: np.ndarray, temperatures: np.ndarray, sensor_id: str = DEFAULT_SENSOR_ID) -> bytes:
+    encoded_sensor_id = sensor_id.encode()
+
+    times = np.asarray(times, dtype=np.int64)
+
+    base = int(times.min()) // MICROSECONDS_PER_SECOND if len(times) else 0
+
+    # microsecond times are rounded to the nearest millisecond offset
+    deltas = (times - base * MICROSECONDS_PER_SECOND + 500) // 1000
+
+    if len(deltas) and deltas.max() > np.iinfo(DELTA_DTYPE).max:
+        raise BatchFormatError('A batch can span at most 24 days')
+
+    return b''.join((BATCH_HEADER.pack(BATCH_MAGIC, BATCH_VERSION, len(encoded_sensor_id), base, len(times)),
+                     encoded_sensor_id, deltas.astype(DELTA_DTYPE).tobytes(),
+                     np.asarray(temperatures, dtype=TEMPERATURE_DTYPE).tobytes()))
+
+
+def decode_batch(body: bytes) -> Tuple[str, np.ndarray, np.ndarray]:
+    if len(body) < BATCH_HEADER.size:
+        raise BatchFormatError('Batch is shorter than its header')
+
+    magic, version, sensor_id_length, base, count = BATCH_HEADER.unpack_from(body)
+
+    if magic != BATCH_MAGIC or version != BATCH_VERSION:
+        raise BatchFormatError(
+            f'Not a version {BATCH_VERSION} temperature batch')
+
+    offset = BATCH_HEADER.size + sensor_id_length
+
+    if len(body) != offset + count * (DELTA_DTYPE.itemsize + TEMPERATURE_DTYPE.itemsize):
+        raise BatchFormatError('Batch length does not match its reading count')
+
+    try:
+        sensor_id = body[BATCH_HEADER.size:offset].decode() or DEFAULT_SENSOR_ID
+    except UnicodeDecodeError:
+        raise BatchFormatError('Sensor id is not valid UTF-8')
+
+    if not MIN_BASE <= base <= MAX_BASE:
+        raise BatchFormatError('Base time must lie between the years 1 and 9999')
+
+    # the columns are decoded straight from the request body, without a dict per reading
+    deltas = np.frombuffer(body, DELTA_DTYPE, count, offset)
+
+    temperatures = np.frombuffer(
+        body, TEMPERATURE_DTYPE, count, offset + count * DELTA_DTYPE.itemsize)
+
+    if not np.isfinite(temperatures).all():
+        raise BatchFormatError('Temperatures must be finite numbers')
+
+    times = base * MICROSECONDS_PER_SECOND + deltas.astype(np.int64) * 1000
+
+    if len(times) and (times.min() < MIN_BASE * MICROSECONDS_PER_SECOND or
+                       times.max() >= (MAX_BASE + 1) * MICROSECONDS_PER_SECOND):
+        raise BatchFormatError('Times must lie between the years 1 and 9999')
+
+    return sensor_id, times, temperatures
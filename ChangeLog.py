@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import deque
+from typing import Deque, Tuple, Union
+import numpy as np
+from Storage import TemperatureStorage, encode_generation
+
+# rows per sensor kept for `since=` delta reads, older generations have to be fetched in full
+CHANGE_LOG_ROWS = int(os.environ.get('TEMPERATURE_CHANGE_LOG_ROWS', 100000))
+
+
+class ChangeLog:
+    def __init__(self, storage: TemperatureStorage, rows: int = CHANGE_LOG_ROWS):
+        self.storage = storage
+
+        self.rows = rows
+
+        self.lock = threading.Lock()
+
+        # (generation after the batch, times, temperatures) in append order
+        self.batches: Deque[Tuple[int, np.ndarray, np.ndarray]] = deque()
+
+        self._rows = 0
+
+        # the oldest generation a delta can still be computed from, and the newest one logged
+        self.epoch = storage.epoch
+
+        self.first_generation = self.generation = storage.generation
+
+        storage.add_append_listener(self.update)
+
+        storage.add_rewrite_listener(self.reset)
+
+    def reset(self):
+        # called under the storage's notify lock after a rewrite, which starts a new epoch
+        with self.lock:
+            self.batches.clear()
+
+            self._rows = 0
+
+            self.epoch = self.storage.epoch
+
+            self.first_generation = self.generation = self.storage.generation
+
+    def update(self, times: np.ndarray, temperatures: np.ndarray):
+        with self.lock:
+            # called under the storage's notify lock, so its generation already counts exactly these rows
+            self.generation = self.storage.generation
+
+            self.batches.append(
+                (self.generation, times.copy(), temperatures.copy()))
+
+            self._rows += len(times)
+
+            while self._rows > self.rows:
+                generation, evicted, _ = self.batches.popleft()
+
+                self._rows -= len(evicted)
+
+                self.first_generation = generation
+
+    def since(self, epoch: str, generation: int) -> Union[Tuple[np.ndarray, np.ndarray, str], None]:
+        with self.lock:
+            current_generation = self.generation
+
+            current_version = encode_generation(self.epoch, current_generation)
+
+            # generations of another process or from before a rewrite are numbered differently
+            if epoch != self.epoch or generation < self.first_generation or generation > current_generation:
+                return None
+
+            times, temperatures = [], []
+
+            for batch_generation, batch_times, batch_temperatures in self.batches:
+                if batch_generation <= generation:
+                    continue
+
+                # a requested generation can fall inside a batch, then only its tail is new
+                new_rows = min(batch_generation - generation, len(batch_times))
+
+                times.append(batch_times[len(batch_times) - new_rows:])
+
+                temperatures.append(
+                    batch_temperatures[len(batch_temperatures) - new_rows:])
+
+        if not times:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), current_version
+
+        return np.concatenate(times), np.concatenate(temperatures), current_version
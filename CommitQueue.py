@@ -0,0 +1,163 @@
+import atexit
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Sequence, Set, Tuple, Union
+import numpy as np
+from Metrics import count_rows, set_commit_queue_rows, stage_timer
+from Partitions import SensorRegistry, group_by_sensor
+from Storage import TemperatureData, TemperatureStorage
+
+MAX_COMMIT_ROWS = int(os.environ.get('TEMPERATURE_MAX_COMMIT_ROWS', 5000))
+MAX_COMMIT_LATENCY = float(os.environ.get(
+    'TEMPERATURE_MAX_COMMIT_LATENCY', 0.005))
+
+# 'batch' fsyncs once per group commit before acknowledging it, 'none' leaves flushing to the OS
+FSYNC_POLICY = os.environ.get('TEMPERATURE_FSYNC_POLICY', 'batch')
+FSYNC_POLICIES = ('batch', 'none')
+
+
+class ArrayBatch(NamedTuple):
+    sensor_id: str
+    times: np.ndarray
+    temperatures: np.ndarray
+
+
+Batch = Union[Sequence[TemperatureData], ArrayBatch]
+
+
+class CommitQueue:
+    def __init__(self, storage: Union[TemperatureStorage, SensorRegistry], max_rows: int = MAX_COMMIT_ROWS,
+                 max_latency: float = MAX_COMMIT_LATENCY, fsync_policy: str = FSYNC_POLICY):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f'Unknown fsync policy: {fsync_policy}')
+
+        self.storage = storage
+
+        self.max_rows = max_rows
+
+        self.max_latency = max_latency
+
+        self.fsync_policy = fsync_policy
+
+        self.condition = threading.Condition()
+
+        self._pending: List[Tuple[Batch, Future]] = []
+
+        self._pending_rows = 0
+
+        self._closed = False
+
+        self._thread = threading.Thread(
+            target=self._run, name='commit-queue', daemon=True)
+
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    def submit(self, temperature_data: Batch) -> Future:
+        future = Future()
+
+        with self.condition:
+            if self._closed:
+                raise RuntimeError('Commit queue is closed')
+
+            self._pending.append((temperature_data, future))
+
+            self._pending_rows += len(temperature_data.times) if isinstance(
+                temperature_data, ArrayBatch) else len(temperature_data)
+
+            set_commit_queue_rows(self._pending_rows)
+
+            self.condition.notify()
+
+        return future
+
+    def append(self, temperature_data: Sequence[TemperatureData]):
+        self.submit(temperature_data).result()
+
+    def _take(self) -> List[Tuple[Batch, Future]]:
+        with self.condition:
+            while not self._pending and not self._closed:
+                self.condition.wait()
+
+            # give concurrent requests a short window to join the group
+            deadline = time.monotonic() + self.max_latency
+
+            while self._pending_rows < self.max_rows and not self._closed:
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    break
+
+                self.condition.wait(remaining)
+
+            pending, self._pending, self._pending_rows = self._pending, [], 0
+
+            set_commit_queue_rows(0)
+
+        return pending
+
+    def _commit(self, pending: List[Tuple[Batch, Future]]):
+        rows = [row for temperature_data, _ in pending if not isinstance(temperature_data, ArrayBatch)
+                for row in temperature_data]
+
+        # array batches of one sensor are concatenated so the group still costs one write per sensor
+        arrays: Dict[str, List[ArrayBatch]] = {}
+
+        for temperature_data, _ in pending:
+            if isinstance(temperature_data, ArrayBatch):
+                arrays.setdefault(temperature_data.sensor_id, []).append(temperature_data)
+
+        try:
+            with stage_timer('persist'):
+                if rows:
+                    self.storage.append(rows)
+
+                for sensor_id, batches in arrays.items():
+                    self._append_arrays(sensor_id, np.concatenate([batch.times for batch in batches]),
+                                        np.concatenate([batch.temperatures for batch in batches]))
+
+            if self.fsync_policy == 'batch':
+                with stage_timer('sync'):
+                    self._sync(set(group_by_sensor(rows)) | set(arrays))
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+
+            return
+
+        count_rows('persisted', len(rows) + sum(len(batch.times) for batches in arrays.values() for batch in batches))
+
+        for _, future in pending:
+            future.set_result(None)
+
+    def _append_arrays(self, sensor_id: str, times: np.ndarray, temperatures: np.ndarray):
+        if isinstance(self.storage, SensorRegistry):
+            self.storage.append_arrays(sensor_id, times, temperatures)
+        else:
+            self.storage.append_arrays(times, temperatures)
+
+    def _sync(self, sensor_ids: Set[str]):
+        if isinstance(self.storage, SensorRegistry):
+            self.storage.sync(sorted(sensor_ids))
+        else:
+            self.storage.sync()
+
+    def _run(self):
+        while True:
+            pending = self._take()
+
+            if pending:
+                self._commit(pending)
+            elif self._closed:
+                return
+
+    def close(self):
+        with self.condition:
+            self._closed = True
+
+            self.condition.notify()
+
+        self._thread.join()
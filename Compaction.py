@@ -0,0 +1,403 @@
+import atexit
+import calendar
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple, Union
+import numpy as np
+from Rollups import BUCKETS
+from Storage import INDEX_DTYPE, MICROSECONDS_PER_SECOND, READ_CHUNK_SIZE, RECORD_DTYPE, SECONDS_PER_DAY, BinaryTemperatureStorage, \
+    MergedTemperatureStorage, SegmentError, Source, TemperatureData, merge_source_ranges, seconds_to_microseconds
+
+ARCHIVE_SUFFIX = '.archive'
+ARCHIVE_EXTENSION = '.npz'
+ARCHIVE_DAY_FORMAT = '%Y-%m-%d'
+
+# counts the compaction runs that renumbered positions, shared by every process reading the archives
+REWRITES_FILE = 'rewrites'
+
+# one day in the microsecond unit of stored times
+DAY = SECONDS_PER_DAY * MICROSECONDS_PER_SECOND
+
+# seconds between compaction runs, 0 disables the background compactor; compaction, downsampling and
+# retention need a single writer per partition, so worker shards (MultiWorkerServer) are never compacted
+# and keep every raw reading, while the archives a single-process run wrote are still read
+COMPACTION_INTERVAL = float(os.environ.get(
+    'TEMPERATURE_COMPACTION_INTERVAL', 60 * 60))
+
+# raw readings older than this many days move from the live segment to per-day archives
+COMPACT_AFTER_DAYS = float(os.environ.get('TEMPERATURE_COMPACT_AFTER_DAYS', 1))
+
+# archived days older than this are reduced to per-bucket means, 0 keeps them raw
+DOWNSAMPLE_AFTER_DAYS = float(os.environ.get(
+    'TEMPERATURE_DOWNSAMPLE_AFTER_DAYS', 0))
+DOWNSAMPLE_BUCKET = os.environ.get('TEMPERATURE_DOWNSAMPLE_BUCKET', '1m')
+
+# readings and rollups older than this many days are deleted, 0 keeps everything
+RETENTION_DAYS = float(os.environ.get('TEMPERATURE_RETENTION_DAYS', 0))
+
+# decompressed archives kept in memory, least recently read first out; replays and full scans
+# read every day, so without a bound the whole archived history would stay resident
+ARCHIVE_CACHE_DAYS = int(os.environ.get('TEMPERATURE_ARCHIVE_CACHE_DAYS', 7))
+
+
+def get_archive_directory(filename: str) -> str:
+    return os.path.splitext(filename)[0] + ARCHIVE_SUFFIX
+
+
+def format_day(day: int) -> str:
+    return time.strftime(ARCHIVE_DAY_FORMAT, time.gmtime(day * SECONDS_PER_DAY))
+
+
+def parse_day(name: str) -> int:
+    return calendar.timegm(time.strptime(name, ARCHIVE_DAY_FORMAT)) // SECONDS_PER_DAY
+
+
+def read_archive(filename: str) -> Tuple[np.ndarray, np.ndarray, int]:
+    with np.load(filename) as archive:
+        times = archive['time']
+
+        # archives written before times became integer microseconds hold float seconds
+        if times.dtype.kind == 'f':
+            times = seconds_to_microseconds(times)
+
+        return times, archive['temperature'], int(archive['width'])
+
+
+def write_archive(filename: str, times: np.ndarray, temperatures: np.ndarray, width: int = 0):
+    # one compressed column per field; written next to the target so the caller can swap it in atomically
+    with open(filename, 'wb') as archive_file:
+        np.savez_compressed(archive_file, time=times,
+                            temperature=temperatures, width=np.int64(width))
+
+        archive_file.flush()
+
+        os.fsync(archive_file.fileno())
+
+
+def read_rewrites(directory: str) -> int:
+    try:
+        with open(os.path.join(directory, REWRITES_FILE), 'r') as rewrites_file:
+            return int(rewrites_file.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def write_rewrites(directory: str, rewrites: int):
+    filename = os.path.join(directory, REWRITES_FILE)
+
+    with open(filename + '.tmp', 'w') as rewrites_file:
+        rewrites_file.write(str(rewrites))
+
+        rewrites_file.flush()
+
+        os.fsync(rewrites_file.fileno())
+
+    os.replace(filename + '.tmp', filename)
+
+
+def merge_records(times: np.ndarray, temperatures: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    records = np.empty(len(times), dtype=RECORD_DTYPE)
+
+    records['time'] = times
+
+    records['temperature'] = temperatures
+
+    # identical readings are dropped so that re-archiving after an interrupted swap cannot duplicate them
+    records = np.unique(records)
+
+    return records['time'], records['temperature']
+
+
+def downsample(times: np.ndarray, temperatures: np.ndarray, width: int) -> Tuple[np.ndarray, np.ndarray]:
+    span = width * MICROSECONDS_PER_SECOND
+
+    keys, inverse = np.unique(np.floor_divide(times, span), return_inverse=True)
+
+    sums = np.bincount(inverse, temperatures.astype(np.float64), len(keys))
+
+    counts = np.bincount(inverse, minlength=len(keys))
+
+    return keys * span, (sums / counts).astype(np.float32)
+
+
+class ArchivedTemperatureStorage(MergedTemperatureStorage):
+    # live is the single writer's segment, which is compacted, or a worker's shards, which only read the archives
+    def __init__(self, live: Union[BinaryTemperatureStorage, MergedTemperatureStorage], directory: Union[str, None] = None):
+        super().__init__()
+
+        self.live = live
+
+        self.live.add_append_listener(self._notify_append)
+
+        self.filename = live.filename
+
+        self.directory = directory or get_archive_directory(live.filename)
+
+        # held by readers while they pick their sources and by the compactor while it swaps them
+        self.lock = threading.Lock()
+
+        self.rewrites = read_rewrites(self.directory)
+
+        self._cache: OrderedDict[str, Tuple[Tuple[int, int], Source]] = OrderedDict()
+
+    def archive_days(self) -> List[int]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        return sorted(parse_day(name[:-len(ARCHIVE_EXTENSION)]) for name in names
+                      if name.endswith(ARCHIVE_EXTENSION))
+
+    def archive_filename(self, day: int) -> str:
+        return os.path.join(self.directory, format_day(day) + ARCHIVE_EXTENSION)
+
+    def _load_archive(self, day: int) -> Source:
+        filename = self.archive_filename(day)
+
+        stat = os.stat(filename)
+
+        key = (stat.st_ino, stat.st_mtime_ns)
+
+        cached = self._cache.get(filename)
+
+        if cached is not None and cached[0] == key:
+            self._cache.move_to_end(filename)
+
+            return cached[1]
+
+        times, temperatures, _ = read_archive(filename)
+
+        records = np.empty(len(times), dtype=RECORD_DTYPE)
+
+        records['time'] = times
+
+        records['temperature'] = temperatures
+
+        # archives are stored sorted, so the index is the identity permutation
+        index = np.empty(len(times), dtype=INDEX_DTYPE)
+
+        index['time'] = times
+
+        index['position'] = np.arange(len(times))
+
+        source = (format_day(day), index, records, np.zeros(1, dtype=np.int64))
+
+        self._cache[filename] = (key, source)
+
+        self._cache.move_to_end(filename)
+
+        while len(self._cache) > ARCHIVE_CACHE_DAYS:
+            self._cache.popitem(last=False)
+
+        return source
+
+    def archive_sources(self, start: Union[int, None] = None, end: Union[int, None] = None) -> List[Source]:
+        return [self._load_archive(day) for day in self.archive_days()
+                if (start is None or (day + 1) * DAY > start) and (end is None or day * DAY < end)]
+
+    def sources(self, start: Union[int, None] = None, end: Union[int, None] = None) -> Tuple[int, List[Source]]:
+        with self.lock:
+            if isinstance(self.live, MergedTemperatureStorage):
+                live_sources = self.live.sources(start, end)[1]
+            else:
+                live_sources = [('', *self.live.snapshot())]
+
+            # cursors compare source keys, so the list has to be in key order
+            return self.rewrites, sorted(live_sources + self.archive_sources(start, end), key=lambda source: source[0])
+
+    def replay(self):
+        if not isinstance(self.live, MergedTemperatureStorage):
+            super().replay()
+
+            return
+
+        # worker shards keep track of what they have replayed, so the live part replays itself after the archives
+        with self.lock:
+            ranges = [(key, index, records, None) for key, index, records, _ in self.archive_sources()]
+
+        for times, temperatures in merge_source_ranges(ranges, READ_CHUNK_SIZE):
+            self._notify_append(times, temperatures)
+
+        self.live.replay()
+
+    def refresh(self):
+        self.live.refresh()
+
+    def append(self, temperature_data: Sequence[TemperatureData]):
+        self.live.append(temperature_data)
+
+    def append_arrays(self, times: np.ndarray, temperatures: np.ndarray):
+        self.live.append_arrays(times, temperatures)
+
+    def sync(self):
+        self.live.sync()
+
+    def compact(self, compact_before: int, retain_after: Union[int, None] = None,
+                downsample_before: Union[int, None] = None, downsample_width: int = BUCKETS[DOWNSAMPLE_BUCKET]):
+        if not isinstance(self.live, BinaryTemperatureStorage):
+            raise SegmentError(f'{self.filename} is one of several shards, only a single writer can compact')
+
+        # only whole days are archived, so a day is never split between the live segment and its archive
+        compact_day = int(compact_before // DAY)
+
+        retain_day = None if retain_after is None else int(-(-retain_after // DAY))
+
+        downsample_day = None if downsample_before is None else int(
+            downsample_before // DAY)
+
+        if retain_day is not None:
+            compact_day = max(compact_day, retain_day)
+
+        _, records, _ = self.live.snapshot()
+
+        snapshot_size = len(records)
+
+        compacted = records[records['time'] < compact_day * DAY]
+
+        days = np.floor_divide(compacted['time'], DAY)
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # the expensive part (merging, downsampling, compressing) runs against the snapshot without any lock
+        replacements: Dict[int, Union[str, None]] = {}
+
+        for day in sorted(set(days.tolist()) | set(self.archive_days())):
+            # expired raw readings need no archive, the segment rewrite below drops them
+            if retain_day is not None and day < retain_day:
+                if os.path.exists(self.archive_filename(day)):
+                    replacements[day] = None
+
+                continue
+
+            selected = compacted[days == day]
+
+            width = 0
+
+            times, temperatures = selected['time'], selected['temperature']
+
+            if os.path.exists(self.archive_filename(day)):
+                archived_times, archived_temperatures, width = read_archive(
+                    self.archive_filename(day))
+
+                if not len(selected) and (width or downsample_day is None or day >= downsample_day):
+                    continue
+
+                times = np.concatenate((archived_times, times))
+
+                temperatures = np.concatenate(
+                    (archived_temperatures, temperatures))
+
+            times, temperatures = merge_records(times, temperatures)
+
+            if downsample_day is not None and day < downsample_day:
+                times, temperatures = downsample(
+                    times, temperatures, downsample_width)
+
+                width = downsample_width
+
+            temporary_filename = self.archive_filename(day) + '.tmp'
+
+            write_archive(temporary_filename, times, temperatures, width)
+
+            replacements[day] = temporary_filename
+
+        if not len(compacted) and not replacements:
+            return
+
+        def keep_live(current: np.ndarray) -> np.ndarray:
+            # readings appended after the snapshot stay live even when they are old, the next run archives them
+            return np.concatenate((records[records['time'] >= compact_day * DAY], current[snapshot_size:]))
+
+        # a crash between the archive swap and the segment rewrite leaves readings in both places,
+        # which the next run's merge_records collapses again, so nothing is lost
+        with self.lock:
+            self.rewrites += 1
+
+            write_rewrites(self.directory, self.rewrites)
+
+            for day, temporary_filename in replacements.items():
+                self._cache.pop(self.archive_filename(day), None)
+
+                if temporary_filename is None:
+                    os.remove(self.archive_filename(day))
+                else:
+                    os.replace(temporary_filename, self.archive_filename(day))
+
+            if len(compacted):
+                self.live.rewrite(keep_live)
+
+            self._notify_rewrite()
+
+
+class Compactor:
+    def __init__(self, registry, interval: float = COMPACTION_INTERVAL, compact_after_days: float = COMPACT_AFTER_DAYS,
+                 retention_days: float = RETENTION_DAYS, downsample_after_days: float = DOWNSAMPLE_AFTER_DAYS):
+        self.registry = registry
+
+        self.interval = interval
+
+        self.compact_after_days = compact_after_days
+
+        self.retention_days = retention_days
+
+        self.downsample_after_days = downsample_after_days
+
+        self._stopped = threading.Event()
+
+        self._thread = None
+
+        self._skipped = set()
+
+        if interval > 0:
+            self._thread = threading.Thread(
+                target=self._run, name='compactor', daemon=True)
+
+            self._thread.start()
+
+            atexit.register(self.close)
+
+    def run(self, now: Union[int, None] = None):
+        now = time.time_ns() // 1000 if now is None else now
+
+        retain_after = now - round(self.retention_days * DAY) if self.retention_days else None
+
+        downsample_before = now - round(self.downsample_after_days *
+                                        DAY) if self.downsample_after_days else None
+
+        for sensor_id in self.registry.sensor_ids():
+            partition = self.registry.get(sensor_id)
+
+            if partition is None or not isinstance(partition.storage, ArchivedTemperatureStorage):
+                continue
+
+            # other workers append to their shards concurrently, and rewriting those is theirs alone to do
+            if not isinstance(partition.storage.live, BinaryTemperatureStorage):
+                if sensor_id not in self._skipped:
+                    print(f'Compaction skipped for {sensor_id}: sharded partitions are not compacted, '
+                          f'retention and downsampling do not apply to them')
+
+                    self._skipped.add(sensor_id)
+
+                continue
+
+            partition.storage.compact(
+                now - round(self.compact_after_days * DAY), retain_after, downsample_before)
+
+            if retain_after is not None:
+                partition.rollups.prune(retain_after)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.run()
+            except Exception as e:
+                print(f'Compaction failed: {e}')
+
+    def close(self):
+        self._stopped.set()
+
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,195 @@
+import io
+import os
+import zlib
+from typing import Callable, Dict, Iterator, Union
+from werkzeug.http import parse_accept_header
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# low levels: on temperature JSON they keep most of the ratio at several times the speed (benchmarks/compression.py)
+GZIP_LEVEL = int(os.environ.get('TEMPERATURE_GZIP_LEVEL', 1))
+ZSTD_LEVEL = int(os.environ.get('TEMPERATURE_ZSTD_LEVEL', 3))
+
+# decompressed request bodies are capped so that a small compressed body cannot expand without bound
+MAX_DECOMPRESSED_SIZE = int(os.environ.get(
+    'TEMPERATURE_MAX_DECOMPRESSED_SIZE', 64 * 1024 * 1024))
+
+# compressed request bodies are read into memory whole, so their size is capped too
+MAX_COMPRESSED_SIZE = int(os.environ.get(
+    'TEMPERATURE_MAX_COMPRESSED_SIZE', 16 * 1024 * 1024))
+
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+
+# wbits for zlib that select the gzip container
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class CompressionError(ValueError):
+    def __init__(self, error_code: int, message: str):
+        super().__init__(message)
+
+        self.error_code = error_code
+
+
+class Compressor:
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def flush(self) -> bytes:
+        raise NotImplementedError
+
+
+class GzipCompressor(Compressor):
+    def __init__(self, level: int = GZIP_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class ZstdCompressor(Compressor):
+    def __init__(self, level: int = ZSTD_LEVEL):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+def decompress_gzip(body: bytes, limit: int) -> bytes:
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+
+    output = io.BytesIO()
+
+    try:
+        # decompressed in bounded steps so the limit is enforced before the memory is spent
+        data = decompressor.decompress(body, DECOMPRESS_CHUNK_SIZE)
+
+        while data:
+            output.write(data)
+
+            if output.tell() > limit:
+                raise CompressionError(413, 'Decompressed body is too large')
+
+            data = decompressor.decompress(
+                decompressor.unconsumed_tail, DECOMPRESS_CHUNK_SIZE)
+
+        if not decompressor.eof:
+            raise CompressionError(400, 'Truncated gzip body')
+    except zlib.error as e:
+        raise CompressionError(400, f'Invalid gzip body: {e}')
+
+    return output.getvalue()
+
+
+def decompress_zstd(body: bytes, limit: int) -> bytes:
+    output = io.BytesIO()
+
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+            while True:
+                data = reader.read(DECOMPRESS_CHUNK_SIZE)
+
+                if not data:
+                    break
+
+                output.write(data)
+
+                if output.tell() > limit:
+                    raise CompressionError(
+                        413, 'Decompressed body is too large')
+    except zstandard.ZstdError as e:
+        raise CompressionError(400, f'Invalid zstd body: {e}')
+
+    return output.getvalue()
+
+
+COMPRESSORS: Dict[str, Callable[[], Compressor]] = {'gzip': GzipCompressor}
+
+DECOMPRESSORS: Dict[str, Callable[[bytes, int], bytes]] = {
+    'gzip': decompress_gzip}
+
+if zstandard is not None:
+    COMPRESSORS['zstd'] = ZstdCompressor
+
+    DECOMPRESSORS['zstd'] = decompress_zstd
+
+# server preference when the client accepts several encodings equally
+ENCODING_PREFERENCE = ('zstd', 'gzip')
+
+
+def decompress_body(body: bytes, content_encoding: Union[str, None], limit: int = MAX_DECOMPRESSED_SIZE) -> bytes:
+    encoding = (content_encoding or 'identity').strip().lower()
+
+    if encoding == 'identity':
+        return body
+
+    if encoding not in DECOMPRESSORS:
+        raise CompressionError(
+            415, f'Unsupported Content-Encoding: {encoding}')
+
+    return DECOMPRESSORS[encoding](body, limit)
+
+
+def read_compressed_body(stream, content_length: Union[int, None], limit: int = MAX_COMPRESSED_SIZE) -> bytes:
+    # without a Content-Length (a chunked request) the body runs to the end of the stream
+    if content_length is not None and content_length > limit:
+        raise CompressionError(413, f'Compressed body is larger than {limit} bytes')
+
+    remaining = limit + 1 if content_length is None else content_length
+
+    chunks = []
+
+    while remaining > 0:
+        chunk = stream.read(min(remaining, DECOMPRESS_CHUNK_SIZE))
+
+        if not chunk:
+            break
+
+        chunks.append(chunk)
+
+        remaining -= len(chunk)
+
+    body = b''.join(chunks)
+
+    if len(body) > limit:
+        raise CompressionError(413, f'Compressed body is larger than {limit} bytes')
+
+    return body
+
+
+def choose_encoding(accept_encoding: Union[str, None]) -> Union[str, None]:
+    if not accept_encoding:
+        return None
+
+    accepted = parse_accept_header(accept_encoding)
+
+    candidates = [encoding for encoding in ENCODING_PREFERENCE
+                  if encoding in COMPRESSORS and accepted.quality(encoding) > 0]
+
+    if not candidates:
+        return None
+
+    return max(candidates, key=lambda encoding: accepted.quality(encoding))
+
+
+def compress_stream(chunks: Iterator[Union[str, bytes]], encoding: str) -> Iterator[bytes]:
+    compressor = COMPRESSORS[encoding]()
+
+    for chunk in chunks:
+        compressed = compressor.compress(
+            chunk.encode() if isinstance(chunk, str) else chunk)
+
+        # compressors buffer small inputs, only non-empty output is worth a write
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
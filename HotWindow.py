@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from typing import Dict, Tuple, Union
+import numpy as np
+from Storage import MICROSECONDS_PER_SECOND
+
+# per sensor, the window keeps at most this many readings and none older than this many seconds; 0 disables it
+HOT_WINDOW_SIZE = int(os.environ.get('TEMPERATURE_HOT_WINDOW_SIZE', 10000))
+HOT_WINDOW_SECONDS = float(os.environ.get(
+    'TEMPERATURE_HOT_WINDOW_SECONDS', 15 * 60))
+
+# covered_from before anything has been evicted or expired
+UNCOVERED = np.iinfo(np.int64).min
+
+
+class HotWindow:
+    def __init__(self, size: int = HOT_WINDOW_SIZE, seconds: float = HOT_WINDOW_SECONDS):
+        self.size = size
+
+        self.seconds = seconds
+
+        self.lock = threading.Lock()
+
+        # ring buffer in arrival order, _next is the slot the next reading goes to
+        self.times = np.empty(size, dtype=np.int64)
+
+        self.temperatures = np.empty(size, dtype=np.float32)
+
+        self._next = 0
+
+        self._count = 0
+
+        # every reading at or after this time is in the window; evictions only ever move it forward
+        self.covered_from = UNCOVERED
+
+        self.hits = 0
+
+        self.misses = 0
+
+    def _expire(self):
+        now = time.time_ns() // 1000
+
+        self.covered_from = max(self.covered_from, now - round(self.seconds * MICROSECONDS_PER_SECOND))
+
+    def update(self, times: np.ndarray, temperatures: np.ndarray):
+        if not self.size:
+            return
+
+        with self.lock:
+            self._expire()
+
+            # late readings from before the covered range could not be served consistently anyway
+            kept = times >= self.covered_from
+
+            times, temperatures = times[kept], temperatures[kept]
+
+            overflow = self._count + len(times) - self.size
+
+            if overflow > 0:
+                evicted = np.concatenate((self._ordered(self.times)[:min(overflow, self._count)],
+                                          times[:max(overflow - self._count, 0)]))
+
+                self.covered_from = max(
+                    self.covered_from, int(evicted.max()) + 1)
+
+            times, temperatures = times[-self.size:], temperatures[-self.size:]
+
+            slots = (self._next + np.arange(len(times))) % self.size
+
+            self.times[slots] = times
+
+            self.temperatures[slots] = temperatures
+
+            self._next = (self._next + len(times)) % self.size
+
+            self._count = min(self._count + len(times), self.size)
+
+    def _ordered(self, column: np.ndarray) -> np.ndarray:
+        start = (self._next - self._count) % self.size
+
+        return np.roll(column, -start)[:self._count]
+
+    def query(self, start: int, end: Union[int, None] = None) -> Union[Tuple[np.ndarray, np.ndarray], None]:
+        with self.lock:
+            if self.size:
+                self._expire()
+
+            if not self.size or start < self.covered_from:
+                self.misses += 1
+
+                return None
+
+            self.hits += 1
+
+            times, temperatures = self._ordered(
+                self.times), self._ordered(self.temperatures)
+
+        selected = times >= start
+
+        if end is not None:
+            selected &= times < end
+
+        # a stable sort keeps arrival order among equal times, which is the order the segment index uses
+        order = np.argsort(times[selected], kind='stable')
+
+        return times[selected][order], temperatures[selected][order]
+
+    def statistics(self) -> Dict[str, Union[int, None]]:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'readings': self._count,
+                'covered_from': None if self.covered_from == UNCOVERED else self.covered_from
+            }
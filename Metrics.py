@@ -0,0 +1,237 @@
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Union
+
+# '0' turns every measurement into a no-op and removes the /metrics output
+METRICS_ENABLED = os.environ.get('TEMPERATURE_METRICS', '1') == '1'
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds in seconds; finer than the Prometheus defaults at the low end, where most requests fall
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        self.name = name
+
+        self.description = description
+
+        self.label_names = tuple(label_names)
+
+        self.lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}'] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = ()):
+        super().__init__(name, description, label_names)
+
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self.lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self.lock:
+            values = sorted(self._values.items())
+
+        return [f'{self.name}{format_labels(self.label_names, labels)} {value}' for labels, value in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, *labels: str):
+        with self.lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, description, label_names)
+
+        self.buckets = tuple(buckets)
+
+        # per label set: a count for every bucket plus the overflow bucket, then the sum
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        bucket = bisect_left(self.buckets, value)
+
+        with self.lock:
+            series = self._series.get(labels)
+
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+
+            series[bucket] += 1
+
+            series[-1] += value
+
+    def _samples(self) -> List[str]:
+        with self.lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+
+        samples = []
+
+        for labels, values in series:
+            cumulative = 0
+
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+
+                bucket_labels = format_labels(self.label_names + ('le',), labels + ('+Inf' if bound == float('inf') else repr(bound),))
+
+                samples.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+
+            formatted_labels = format_labels(self.label_names, labels)
+
+            samples.append(f'{self.name}_sum{formatted_labels} {values[-1]!r}')
+
+            samples.append(f'{self.name}_count{formatted_labels} {cumulative}')
+
+        return samples
+
+
+REQUEST_DURATION = Histogram('temperature_request_duration_seconds',
+                             'Time spent in route handlers, excluding streamed response bodies', ('handler',))
+
+REQUESTS = Counter('temperature_requests_total',
+                   'Handled requests by response status', ('handler', 'status'))
+
+REQUESTS_IN_FLIGHT = Gauge('temperature_requests_in_flight',
+                           'Requests currently inside a route handler', ('handler',))
+
+STAGE_DURATION = Histogram('temperature_stage_duration_seconds',
+                           'Time spent per processing stage (validate, filter, persist, sync, query, serialise, ...)', ('stage',))
+
+ROWS = Counter('temperature_rows_total',
+               'Readings by outcome (accepted, rejected, persisted, served); rate() gives rows per second', ('outcome',))
+
+COMMIT_QUEUE_ROWS = Gauge('temperature_commit_queue_pending_rows',
+                          'Readings waiting for the next group commit')
+
+METRICS: List[Metric] = [REQUEST_DURATION, REQUESTS, REQUESTS_IN_FLIGHT,
+                         STAGE_DURATION, ROWS, COMMIT_QUEUE_ROWS]
+
+
+def render_metrics() -> str:
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+class StageTimer:
+    def __init__(self, stage: str):
+        self.stage = stage
+
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        STAGE_DURATION.observe(time.perf_counter() - self.started, self.stage)
+
+
+def stage_timer(stage: str) -> Union[StageTimer, nullcontext]:
+    return StageTimer(stage) if METRICS_ENABLED else nullcontext()
+
+
+def timed_iterator(iterator: Iterator, stage: str) -> Iterator:
+    # lazily produced bodies are timed while they are consumed and recorded once, when they are done
+    elapsed = 0.0
+
+    try:
+        while True:
+            started = time.perf_counter()
+
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+
+            yield item
+    finally:
+        STAGE_DURATION.observe(elapsed, stage)
+
+
+def timed(stage: str) -> Callable[[Callable], Callable]:
+    def decorator(function: Callable) -> Callable:
+        if not METRICS_ENABLED:
+            return function
+
+        if inspect.isgeneratorfunction(function):
+            @wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                return timed_iterator(function(*args, **kwargs), stage)
+            return generator_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with StageTimer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_rows(outcome: str, rows: int):
+    if METRICS_ENABLED and rows:
+        ROWS.inc(rows, outcome)
+
+
+def set_commit_queue_rows(rows: int):
+    if METRICS_ENABLED:
+        COMMIT_QUEUE_ROWS.set(rows)
+
+
+def start_request(handler: str) -> Union[float, None]:
+    if not METRICS_ENABLED:
+        return None
+
+    REQUESTS_IN_FLIGHT.inc(1, handler)
+
+    return time.perf_counter()
+
+
+def finish_request(handler: str, started: Union[float, None], status: int):
+    if started is None:
+        return
+
+    REQUEST_DURATION.observe(time.perf_counter() - started, handler)
+
+    REQUESTS.inc(1, handler, str(status))
+
+    REQUESTS_IN_FLIGHT.inc(-1, handler)
@@ -0,0 +1,56 @@
+import multiprocessing
+import os
+import signal
+import socket
+
+HOST = os.environ.get('TEMPERATURE_SERVER_HOST', '127.0.0.1')
+PORT = int(os.environ.get('TEMPERATURE_SERVER_PORT', 8000))
+
+# every worker appends to its own shard of each partition; shards are not compacted, so
+# TEMPERATURE_RETENTION_DAYS and TEMPERATURE_DOWNSAMPLE_AFTER_DAYS have no effect here (see Compaction.py)
+WORKERS = int(os.environ.get('TEMPERATURE_WORKERS', os.cpu_count() or 1))
+
+
+def run_worker(worker_id: int, fd: int):
+    # the worker id has to be in place before Server builds its sensor registry on import
+    os.environ['TEMPERATURE_WORKER_ID'] = str(worker_id)
+
+    import uvicorn
+    from AsyncServer import BACKLOG, KEEP_ALIVE_TIMEOUT, app
+
+    uvicorn.run(app, fd=fd, timeout_keep_alive=KEEP_ALIVE_TIMEOUT,
+                backlog=BACKLOG)
+
+
+def main():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    listener.bind((HOST, PORT))
+
+    listener.set_inheritable(True)
+
+    context = multiprocessing.get_context('fork')
+
+    workers = [context.Process(target=run_worker, args=(worker_id, listener.fileno()))
+               for worker_id in range(WORKERS)]
+
+    for worker in workers:
+        worker.start()
+
+    def stop(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    signal.signal(signal.SIGINT, stop)
+
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
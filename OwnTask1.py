@@ -1,6 +1,9 @@
 from gpio import *
 from time import *
 from ioeclient import IoEClient
+from StatePublisher import setupStatePublisher, publishStates
+from SensorSampler import startTick, sampleAnalog
+from Actuators import writeDigital, writeDisplay, flushDisplays
 
 TIMEOUT = 4
 
@@ -54,6 +57,11 @@ ROOM_OPTION_CODE = dict(zip(ROOMS.keys(), [str(k) for k in range(len(ROOMS))]))
 
 chosenRoom = [key for key in ROOMS.keys()][0]
 
+# temperature changes smaller than this are not reported to the IoE server
+TEMPERATURE_DEADBAND = 0.1
+# one deadband per reported state, in the order of CONFIG's states
+STATE_DEADBANDS = [0, 0, TEMPERATURE_DEADBAND, 0, 0]
+
 # IOeClient
 CONFIG = {
 	"type": "Thermostat",
@@ -152,16 +160,17 @@ def onIoEStateSet(stateName, value):
 def IoEUpdateState():
 	room = ROOMS[chosenRoom]
 	
-	IoEClient.reportStates([ROOM_OPTION_CODE[chosenRoom],MODE_CODE[room['mode']],getTemperature(chosenRoom),room['temperature']['max'],room['temperature']['min']])
+	publishStates([ROOM_OPTION_CODE[chosenRoom],MODE_CODE[room['mode']],getTemperature(chosenRoom),room['temperature']['max'],room['temperature']['min']])
 
 
 def IoESetup():
 	IoEClient.setup(CONFIG)
 	IoEClient.onStateSet(onIoEStateSet)
+	setupStatePublisher(STATE_DEADBANDS)
 	IoEUpdateState()
 	
 def displayMessage(message, pin):
-	customWrite(pin, str(message))
+	writeDisplay(pin, str(message))
 
 def displayRoomMessage(message, room):
 	roomDisplayPin = ROOMS[room]['pins']['display']
@@ -177,21 +186,21 @@ def temperatureToCelsius(t):
 def getTemperature(room):
 	roomTemperaturePin = ROOMS[room]['pins']['temperature']
 	
-	t = analogRead(roomTemperaturePin)
+	t = sampleAnalog(roomTemperaturePin)
 	
 	return temperatureToCelsius(t)
 
 def turnOnHeating(room):
 	roomHeatingPin = ROOMS[room]['pins']['heating']
 	
-	digitalWrite(roomHeatingPin, HIGH)
+	writeDigital(roomHeatingPin, HIGH)
 	
 	ROOMS[room]['isHeating'] = True
 
 def turnOffHeating(room):
 	roomHeatingPin = ROOMS[room]['pins']['heating']
 	
-	digitalWrite(roomHeatingPin, LOW)
+	writeDigital(roomHeatingPin, LOW)
 	
 	ROOMS[room]['isHeating'] = False
 	
@@ -212,14 +221,14 @@ def heatingControl(t, room):
 def turnOnCooling(room):
 	roomCoolingPin = ROOMS[room]['pins']['cooling']
 	
-	digitalWrite(roomCoolingPin, HIGH)
+	writeDigital(roomCoolingPin, HIGH)
 	
 	ROOMS[room]['isCooling'] = True
 
 def turnOffCooling(room):
 	roomCoolingPin = ROOMS[room]['pins']['cooling']
 	
-	digitalWrite(roomCoolingPin, LOW)
+	writeDigital(roomCoolingPin, LOW)
 	
 	ROOMS[room]['isCooling'] = False
 	
@@ -252,6 +261,8 @@ def init():
 
 def main():
 	while True:
+		startTick()
+		
 		for room in ROOMS:
 			t = getTemperature(room)
 			
@@ -262,6 +273,8 @@ def main():
 			
 		IoEUpdateState()
 		
+		flushDisplays()
+		
 		sleep(TIMEOUT)
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
 from gpio import *
 from time import *
 from ioeclient import IoEClient
+from StatePublisher import setupStatePublisher, publishStates
+from SensorSampler import startTick, sampleDigital, sampleCustom
+from Actuators import writeCustom
 
 LIGHT = 0
 MOTION_SENSOR = 1
@@ -98,22 +101,23 @@ def onIoEStateSet(stateName, value):
 
 
 def IoEUpdateState():
-    IoEClient.reportStates(
+    publishStates(
         [MODE_CODE[currentMode], getCurrentHour(), MIN_HOUR, MAX_HOUR, DURATION])
 
 
 def IoESetup():
     IoEClient.setup(CONFIG)
     IoEClient.onStateSet(onIoEStateSet)
+    setupStatePublisher([])
     IoEUpdateState()
 
 
 def lightOff():
-    customWrite(LIGHT, '0')
+    writeCustom(LIGHT, '0')
 
 
 def lightOn():
-    customWrite(LIGHT, '2')
+    writeCustom(LIGHT, '2')
 
 
 def getCurrentHour():
@@ -131,11 +135,11 @@ def checkHourCondition():
 
 
 def getMotionSensorInfo():
-    return int(digitalRead(MOTION_SENSOR))
+    return int(sampleDigital(MOTION_SENSOR))
 
 
 def getDoorInfo():
-    return int(customRead(DOOR)[0])
+    return int(sampleCustom(DOOR)[0])
 
 
 def lightAlgorithm():
@@ -167,6 +171,8 @@ def init():
 
 def main():
     while True:
+        startTick()
+
         if currentMode == 'Auto':
             lightAlgorithm()
 
@@ -1,6 +1,9 @@
 from gpio import *
 from time import *
 from ioeclient import IoEClient
+from StatePublisher import setupStatePublisher, publishStates
+from SensorSampler import startTick, sampleAnalog
+from Actuators import writeDigital, writeCustom
 
 COFFEE_PIN = 0
 LIGHT_PIN = 1
@@ -49,6 +52,11 @@ heatingModeOption = 'Auto'
 coffeeModeOption = 'Auto'
 lightModeOption = 'Auto'
 
+# temperature changes smaller than this are not reported to the IoE server
+TEMPERATURE_DEADBAND = 0.1
+# one deadband per reported state, in the order of CONFIG's states
+STATE_DEADBANDS = [0, 0, 0, TEMPERATURE_DEADBAND, 0, 0, 0]
+
 # IOeClient
 CONFIG = {
     "type": "Morning Routine",
@@ -166,13 +174,14 @@ def onIoEStateSet(stateName, value):
 
 
 def IoEUpdateState():
-    IoEClient.reportStates([MORNING_HOUR, getCurrentTimeInfo()[
+    publishStates([MORNING_HOUR, getCurrentTimeInfo()[
                            0], ON_OFF_MODE_CODE[heatingModeOption], getTemperature(), T_MIN, ON_OFF_MODE_CODE[coffeeModeOption], LIGHT_MODE_CODE[lightModeOption]])
 
 
 def IoESetup():
     IoEClient.setup(CONFIG)
     IoEClient.onStateSet(onIoEStateSet)
+    setupStatePublisher(STATE_DEADBANDS)
     IoEUpdateState()
 
 
@@ -193,19 +202,19 @@ def checkTimeCondition():
 
 
 def lightOff():
-    customWrite(LIGHT_PIN, '0')
+    writeCustom(LIGHT_PIN, '0')
 
     print('Light off')
 
 
 def lightDim():
-    customWrite(LIGHT_PIN, '1')
+    writeCustom(LIGHT_PIN, '1')
 
     print('Light dim')
 
 
 def lightOn():
-    customWrite(LIGHT_PIN, '2')
+    writeCustom(LIGHT_PIN, '2')
 
     print('Light on')
 
@@ -234,7 +243,7 @@ def temperatureToCelsius(t):
 
 
 def getTemperature():
-    t = analogRead(TEMPERATURE_PIN)
+    t = sampleAnalog(TEMPERATURE_PIN)
 
     return temperatureToCelsius(t)
 
@@ -242,7 +251,7 @@ def getTemperature():
 def turnOnHeating():
     global isHeating
 
-    digitalWrite(HEATING_PIN, HIGH)
+    writeDigital(HEATING_PIN, HIGH)
 
     isHeating = True
 
@@ -252,7 +261,7 @@ def turnOnHeating():
 def turnOffHeating():
     global isHeating, heatedAlready
 
-    digitalWrite(HEATING_PIN, LOW)
+    writeDigital(HEATING_PIN, LOW)
 
     isHeating = False
 
@@ -279,13 +288,13 @@ def climateControl():
 
 
 def coffeeMachineOff():
-    customWrite(COFFEE_PIN, '0')
+    writeCustom(COFFEE_PIN, '0')
 
     print('Coffee off')
 
 
 def coffeeMachineOn():
-    customWrite(COFFEE_PIN, '1')
+    writeCustom(COFFEE_PIN, '1')
 
     print('Coffee on')
 
@@ -328,6 +337,8 @@ def init():
 def taskAlgorithm():
     global heatedAlready, lightMode
 
+    startTick()
+
     if checkTimeCondition():
         if heatingModeOption == 'Auto':
             climateControl()
@@ -0,0 +1,189 @@
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Sequence, Union
+import numpy as np
+from ChangeLog import ChangeLog
+from Compaction import ArchivedTemperatureStorage, get_archive_directory
+from HotWindow import HotWindow
+from Rollups import Rollups
+from Statistics import STATISTICS_SUFFIX, StatisticsFilter, get_statistics_filename
+from Storage import DATA_CSV, DATA_DIRECTORY, DATA_SEGMENT, DEFAULT_SENSOR_ID, INDEX_SUFFIX, SENSOR_ID_PATTERN, SHARD_SEPARATOR, \
+    STORAGE_BACKEND, BinaryTemperatureStorage, ShardedTemperatureStorage, TemperatureData, TemperatureStorage, create_storage, find_shards, get_shard_filename
+
+STORAGE_EXTENSIONS = {
+    'binary': '.seg',
+    'csv': '.csv'
+}
+
+SENSORS_FILE = 'sensors.json'
+
+# set per process when several workers share the data directory, each one then appends to its own shard
+WORKER_ID = os.environ.get('TEMPERATURE_WORKER_ID')
+
+sensor_id_matcher = re.compile(SENSOR_ID_PATTERN)
+
+
+class SensorPartition:
+    def __init__(self, sensor_id: str, storage: TemperatureStorage):
+        self.sensor_id = sensor_id
+
+        self.storage = storage
+
+        self.statistics_filter = StatisticsFilter(
+            get_statistics_filename(storage.filename))
+
+        self.rollups = Rollups()
+
+        self.hot_window = HotWindow()
+
+        storage.add_append_listener(self.rollups.update)
+
+        storage.add_append_listener(self.hot_window.update)
+
+        storage.replay()
+
+        # registered after the replay, so only rows appended while this process runs are logged
+        self.change_log = ChangeLog(storage)
+
+
+def get_sensor_id(temperature_data: TemperatureData) -> str:
+    return temperature_data.get('sensor_id', DEFAULT_SENSOR_ID)
+
+
+def group_by_sensor(temperature_data: Sequence[TemperatureData]) -> Dict[str, List[TemperatureData]]:
+    groups: Dict[str, List[TemperatureData]] = {}
+
+    for el in temperature_data:
+        groups.setdefault(get_sensor_id(el), []).append(el)
+
+    return groups
+
+
+class SensorRegistry:
+    def __init__(self, directory: str = DATA_DIRECTORY, backend: str = STORAGE_BACKEND, worker_id: Union[str, None] = WORKER_ID):
+        if worker_id is not None and (backend != 'binary' or not sensor_id_matcher.match(worker_id)):
+            raise ValueError(
+                f'Worker id {worker_id!r} needs the binary backend and a sensor id-like name')
+
+        self.directory = directory
+
+        self.backend = backend
+
+        self.worker_id = worker_id
+
+        self.extension = STORAGE_EXTENSIONS[backend]
+
+        self.lock = threading.Lock()
+
+        self.partitions: Dict[str, SensorPartition] = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+        migrate_legacy_files(directory)
+
+        self.rooms: Dict[str, str] = self._load_rooms()
+
+    def _load_rooms(self) -> Dict[str, str]:
+        try:
+            with open(os.path.join(self.directory, SENSORS_FILE), 'r') as sensors_file:
+                return {sensor_id: sensor.get('room') for sensor_id, sensor in json.load(sensors_file).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_rooms(self):
+        filename = os.path.join(self.directory, SENSORS_FILE)
+
+        with open(filename + '.tmp', 'w') as sensors_file:
+            json.dump({sensor_id: {'room': room}
+                      for sensor_id, room in self.rooms.items()}, sensors_file)
+
+        os.replace(filename + '.tmp', filename)
+
+    def sensor_ids(self) -> List[str]:
+        sensor_ids = {filename[:-len(self.extension)].split(SHARD_SEPARATOR)[0] for filename in os.listdir(self.directory)
+                      if filename.endswith(self.extension)}
+
+        return sorted(sensor_ids | set(self.partitions))
+
+    def get(self, sensor_id: str, create: bool = False) -> Union[SensorPartition, None]:
+        partition = self.partitions.get(sensor_id)
+
+        if partition is not None:
+            return partition
+
+        if not sensor_id_matcher.match(sensor_id):
+            raise ValueError(f'Invalid sensor id: {sensor_id}')
+
+        with self.lock:
+            if sensor_id not in self.partitions:
+                if not create and not find_shards(self.directory, sensor_id, self.extension):
+                    return None
+
+                self.partitions[sensor_id] = SensorPartition(
+                    sensor_id, self._create_storage(sensor_id))
+
+            return self.partitions[sensor_id]
+
+    def _create_storage(self, sensor_id: str) -> TemperatureStorage:
+        filename = get_shard_filename(self.directory, sensor_id, None, self.extension)
+
+        # only a single writer may compact; workers still read what it archived, the csv backend has no archives
+        if self.worker_id is not None:
+            return ArchivedTemperatureStorage(ShardedTemperatureStorage(self.directory, sensor_id, self.worker_id),
+                                              get_archive_directory(filename))
+
+        storage = create_storage(self.backend, filename)
+
+        if isinstance(storage, BinaryTemperatureStorage):
+            return ArchivedTemperatureStorage(storage)
+
+        return storage
+
+    def update_rooms(self, temperature_data: Sequence[TemperatureData]):
+        changed = {get_sensor_id(el): el['room'] for el in temperature_data
+                   if 'room' in el and self.rooms.get(get_sensor_id(el)) != el['room']}
+
+        if changed:
+            with self.lock:
+                self.rooms.update(changed)
+
+                self._save_rooms()
+
+    def append(self, temperature_data: Sequence[TemperatureData]):
+        for sensor_id, sensor_temperature_data in group_by_sensor(temperature_data).items():
+            self.get(sensor_id, create=True).storage.append(
+                sensor_temperature_data)
+
+        self.update_rooms(temperature_data)
+
+    def append_arrays(self, sensor_id: str, times: np.ndarray, temperatures: np.ndarray):
+        self.get(sensor_id, create=True).storage.append_arrays(
+            times, temperatures)
+
+    def sync(self, sensor_ids: Union[Sequence[str], None] = None):
+        # a group commit only needs the partitions it wrote to on disk, not every open one
+        if sensor_ids is None:
+            sensor_ids = list(self.partitions)
+
+        for sensor_id in sensor_ids:
+            partition = self.partitions.get(sensor_id)
+
+            if partition is not None:
+                partition.storage.sync()
+
+
+def migrate_legacy_files(directory: str):
+    # single-file layouts from before partitioning become the default sensor's partition
+    default_name = os.path.join(directory, DEFAULT_SENSOR_ID)
+
+    for legacy_filename, extension in ((DATA_SEGMENT, '.seg'), (DATA_CSV, '.csv')):
+        if os.path.exists(legacy_filename) and not os.path.exists(default_name + extension):
+            os.replace(legacy_filename, default_name + extension)
+
+    legacy_name = os.path.splitext(DATA_SEGMENT)[0]
+
+    for suffix in (INDEX_SUFFIX, STATISTICS_SUFFIX):
+        if os.path.exists(legacy_name + suffix) and not os.path.exists(default_name + suffix):
+            os.replace(legacy_name + suffix, default_name + suffix)
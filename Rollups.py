@@ -0,0 +1,179 @@
+import threading
+from typing import Dict, Union
+import numpy as np
+from Storage import MICROSECONDS_PER_SECOND
+
+# bucket widths in seconds
+BUCKETS = {
+    '1m': 60,
+    '5m': 5 * 60,
+    '1h': 60 * 60,
+    '1d': 24 * 60 * 60
+}
+
+INITIAL_CAPACITY = 1024
+
+
+class RollupTable:
+    def __init__(self, width: int):
+        self.width = width
+
+        # bucket keys are computed on integer microsecond times
+        self.span = width * MICROSECONDS_PER_SECOND
+
+        self.size = 0
+
+        self.keys = np.empty(INITIAL_CAPACITY, dtype=np.int64)
+
+        self.columns = {
+            'count': np.zeros(INITIAL_CAPACITY, dtype=np.int64),
+            'sum': np.zeros(INITIAL_CAPACITY, dtype=np.float64),
+            'sumsq': np.zeros(INITIAL_CAPACITY, dtype=np.float64),
+            'min': np.zeros(INITIAL_CAPACITY, dtype=np.float64),
+            'max': np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        }
+
+    def _reserve(self, size: int):
+        capacity = len(self.keys)
+
+        if size <= capacity:
+            return
+
+        while capacity < size:
+            capacity *= 2
+
+        self.keys = np.resize(self.keys, capacity)
+
+        for name, column in self.columns.items():
+            self.columns[name] = np.resize(column, capacity)
+
+    def update(self, times: np.ndarray, temperatures: np.ndarray):
+        if not len(times):
+            return
+
+        values = temperatures.astype(np.float64)
+
+        keys, inverse = np.unique(
+            np.floor_divide(times, self.span), return_inverse=True)
+
+        partial = {
+            'count': np.bincount(inverse, minlength=len(keys)),
+            'sum': np.bincount(inverse, values, minlength=len(keys)),
+            'sumsq': np.bincount(inverse, values * values, minlength=len(keys)),
+            'min': np.full(len(keys), np.inf),
+            'max': np.full(len(keys), -np.inf)
+        }
+
+        np.minimum.at(partial['min'], inverse, values)
+
+        np.maximum.at(partial['max'], inverse, values)
+
+        current_keys = self.keys[:self.size]
+
+        positions = np.searchsorted(current_keys, keys)
+
+        existing = positions < self.size
+
+        existing[existing] = current_keys[positions[existing]] == keys[existing]
+
+        if existing.any():
+            self._merge(positions[existing], {name: column[existing]
+                                              for name, column in partial.items()})
+
+        new = ~existing
+
+        if new.any():
+            self._insert(keys[new], {name: column[new]
+                                     for name, column in partial.items()})
+
+    def _merge(self, positions: np.ndarray, partial: Dict[str, np.ndarray]):
+        for name in ('count', 'sum', 'sumsq'):
+            self.columns[name][positions] += partial[name]
+
+        np.minimum.at(self.columns['min'], positions, partial['min'])
+
+        np.maximum.at(self.columns['max'], positions, partial['max'])
+
+    def _insert(self, keys: np.ndarray, partial: Dict[str, np.ndarray]):
+        # readings normally arrive in time order, so new buckets go to the end without a re-sort
+        in_order = not self.size or keys[0] > self.keys[self.size - 1]
+
+        self._reserve(self.size + len(keys))
+
+        end = self.size + len(keys)
+
+        self.keys[self.size:end] = keys
+
+        for name, column in self.columns.items():
+            column[self.size:end] = partial[name]
+
+        self.size = end
+
+        if not in_order:
+            order = np.argsort(self.keys[:end], kind='stable')
+
+            self.keys[:end] = self.keys[:end][order]
+
+            for column in self.columns.values():
+                column[:end] = column[:end][order]
+
+    def prune(self, before: int):
+        # drops the buckets that end at or before the cutoff
+        removed = int(np.searchsorted(
+            self.keys[:self.size], before // self.span, 'left'))
+
+        if not removed:
+            return
+
+        self.keys[:self.size - removed] = self.keys[removed:self.size]
+
+        for column in self.columns.values():
+            column[:self.size - removed] = column[removed:self.size]
+
+        self.size -= removed
+
+    def query(self, start: Union[int, None] = None, end: Union[int, None] = None) -> Dict[str, np.ndarray]:
+        keys = self.keys[:self.size]
+
+        lo = 0 if start is None else int(np.searchsorted(
+            keys, start // self.span, 'left'))
+
+        hi = self.size if end is None else int(np.searchsorted(
+            keys, -(-end // self.span), 'left'))
+
+        count = self.columns['count'][lo:hi]
+
+        mean = self.columns['sum'][lo:hi] / count
+
+        variance = np.maximum(self.columns['sumsq'][lo:hi] / count - mean * mean, 0)
+
+        return {
+            'time': keys[lo:hi] * self.span,
+            'count': count.copy(),
+            'min': self.columns['min'][lo:hi].copy(),
+            'max': self.columns['max'][lo:hi].copy(),
+            'mean': mean,
+            'stddev': np.sqrt(variance)
+        }
+
+
+class Rollups:
+    def __init__(self, buckets: Dict[str, int] = BUCKETS):
+        self.lock = threading.Lock()
+
+        self.tables = {name: RollupTable(width)
+                       for name, width in buckets.items()}
+
+    def update(self, times: np.ndarray, temperatures: np.ndarray):
+        with self.lock:
+            for table in self.tables.values():
+                table.update(times, temperatures)
+
+    def query(self, bucket: str, start: Union[int, None] = None, end: Union[int, None] = None) -> Dict[str, np.ndarray]:
+        with self.lock:
+            return self.tables[bucket].query(start, end)
+
+    def prune(self, before: int):
+        with self.lock:
+            for table in self.tables.values():
+                table.prune(before)
@@ -0,0 +1,40 @@
+from gpio import *
+
+# pin values read during the current tick, by (read function, pin)
+samples = {}
+
+readCount = 0
+cachedCount = 0
+
+
+def startTick():
+    # called once at the top of every loop iteration, so each pin is read at most once per tick
+    samples.clear()
+
+
+def sample(read, pin):
+    global readCount
+    global cachedCount
+
+    key = (read, pin)
+
+    if key in samples:
+        cachedCount += 1
+    else:
+        samples[key] = read(pin)
+
+        readCount += 1
+
+    return samples[key]
+
+
+def sampleAnalog(pin):
+    return sample(analogRead, pin)
+
+
+def sampleDigital(pin):
+    return sample(digitalRead, pin)
+
+
+def sampleCustom(pin):
+    return sample(customRead, pin)
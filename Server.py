@@ -1,195 +1,411 @@
-import csv
+import io
+import json
 from functools import wraps
 from rfc3339_validator import validate_rfc3339
-from typing import Callable, List, Sequence, TypedDict, Union
-from flask import Flask, jsonify, request
-from jsonschema import validate, ValidationError
+from typing import Callable, Dict, Iterator, List, Mapping, Sequence, Tuple, Union
+from flask import Flask, Response, jsonify, request
+from werkzeug.http import http_date, parse_etags, quote_etag
+import numpy as np
+from ArrayStatistics import as_float_array
+from BatchFormat import BATCH_MIMETYPE, BatchFormatError, decode_batch
+from CommitQueue import ArrayBatch, CommitQueue
+from Compaction import Compactor
+from Compression import CompressionError, choose_encoding, compress_stream, decompress_body, read_compressed_body
+from Metrics import METRICS_CONTENT_TYPE, METRICS_ENABLED, count_rows, finish_request, render_metrics, stage_timer, start_request, timed
+from Partitions import SensorPartition, SensorRegistry, group_by_sensor, sensor_id_matcher
+from Rollups import BUCKETS
+from Statistics import filter_batch
+from Storage import DEFAULT_SENSOR_ID, TEMPERATURE_DECIMALS, CursorError, GenerationError, StaleCursorError, TemperatureData, TemperatureStorage, arrays_to_temperature_data, \
+    decode_generation, format_time, format_times, iter_array_chunks, parse_time
+from Validation import Validator, get_validator, temperatureDataBatchSchema, temperatureDataRequestSchema
 
-DATA_CSV = 'temperature_data.csv'
+QUERY_ARGUMENTS = ('from', 'to', 'limit', 'cursor')
+MAX_QUERY_LIMIT = 10000
 
+JSON_MIMETYPE = 'application/json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
 
-class TemperatureData(TypedDict):
-    temperature: float
-    time: str
+sensors = SensorRegistry()
 
+commit_queue = CommitQueue(sensors)
 
-def save_temperature_data_to_csv(temperature_data: Sequence[TemperatureData], filename: str = DATA_CSV):
-    with open(filename, 'w', newline='') as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=['temperature', 'time'])
+compactor = Compactor(sensors)
 
-        writer.writeheader()
 
-        writer.writerows(temperature_data)
+def get_temperature_data(sensor_id: str = DEFAULT_SENSOR_ID) -> List[TemperatureData]:
+    return sensors.get(sensor_id, create=True).storage.read()
 
 
-def append_temperature_data_to_csv(temperature_data: Sequence[TemperatureData], filename: str = DATA_CSV):
-    with open(filename, 'a', newline='') as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=['temperature', 'time'])
+def append_temperature_data(temperature_data: Sequence[TemperatureData]):
+    commit_queue.append(temperature_data)
+
 
-        writer.writerows(temperature_data)
+def get_temperature_values(temperature_data: Sequence[TemperatureData]) -> List[float]:
+    return [el['temperature'] for el in temperature_data]
 
 
-def read_temperature_data_from_csv(filename: str = DATA_CSV) -> List[TemperatureData]:
-    temperature_data = []
+@timed('filter')
+def filter_temperatures(temperature_data: Sequence[TemperatureData]) -> List[TemperatureData]:
+    groups = group_by_sensor(temperature_data)
 
-    with open(filename, 'r') as csv_file:
-        reader = csv.DictReader(csv_file)
+    statistics_filters = [sensors.get(sensor_id, create=True).statistics_filter
+                          for sensor_id in groups]
 
-        for row in reader:
-            temperature_data.append({"temperature": float(
-                row["temperature"]), "time": row["time"]})
+    items = [el for sensor_temperature_data in groups.values()
+             for el in sensor_temperature_data]
 
-    return temperature_data
+    # every sensor in the batch is filtered in one vectorised pass
+    accepted = filter_batch(statistics_filters, as_float_array(get_temperature_values(items)), np.repeat(
+        np.arange(len(groups)), [len(sensor_temperature_data) for sensor_temperature_data in groups.values()]))
 
+    count_rows('accepted', int(accepted.sum()))
 
-def read_first_temperature_data_from_csv(filename: str = DATA_CSV) -> Union[TemperatureData, None]:
-    first_temperature_data = None
+    count_rows('rejected', int(len(accepted) - accepted.sum()))
 
-    with open(filename, 'r') as csv_file:
-        reader = csv.DictReader(csv_file)
+    return [el for el, is_accepted in zip(items, accepted.tolist()) if is_accepted]
 
-        first_row = next(reader)
 
-        first_temperature_data = TemperatureData({"temperature": float(
-            first_row["temperature"]), "time": first_row["time"]})
+@timed('filter')
+def filter_temperature_batch(body: bytes) -> Tuple[ArrayBatch, int]:
+    try:
+        sensor_id, times, temperatures = decode_batch(body)
+    except BatchFormatError as e:
+        raise HttpError(422, str(e))
 
-    return first_temperature_data
+    if not sensor_id_matcher.match(sensor_id):
+        raise HttpError(422, f'Invalid sensor id: {sensor_id}')
 
+    accepted = filter_batch([sensors.get(sensor_id, create=True).statistics_filter],
+                            temperatures.astype(np.float64), np.zeros(len(temperatures), dtype=np.int64))
 
-def get_temperature_data() -> List[TemperatureData]:
-    return read_temperature_data_from_csv()
+    rejected = int(len(accepted) - accepted.sum())
 
+    count_rows('accepted', len(accepted) - rejected)
 
-def append_temperature_data(temperature_data: Sequence[TemperatureData]):
-    existing_temperature_data = read_first_temperature_data_from_csv()
+    count_rows('rejected', rejected)
 
-    if not existing_temperature_data:
-        save_temperature_data_to_csv(temperature_data)
-    else:
-        append_temperature_data_to_csv(temperature_data)
+    return ArrayBatch(sensor_id, times[accepted], temperatures[accepted]), rejected
 
 
-def get_temperature_values(temperature_data: Sequence[TemperatureData]) -> List[float]:
-    return [el['temperature'] for el in temperature_data]
+class HttpError(Exception):
+    def __init__(self, error_code: int = 500, message: str = "Something went wrong"):
+        self.error_code = error_code
 
+        self.message = message
 
-def get_data_mean(data: Sequence[float]) -> float:
-    n = len(data)
+        super().__init__(self.message)
 
-    mean = sum(data) / n
 
-    return mean
+def validate_route(validator: Union[Validator, None]):
+    # binary batches are checked while they are decoded
+    if validator and request.mimetype != BATCH_MIMETYPE:
+        with stage_timer('validate'):
+            request_data = request.json
 
+            is_valid, error_message = validator(request_data)
 
-def get_data_variance(data: Sequence[float], mean: Union[float, None] = None) -> float:
-    mean = mean or get_data_mean(data)
+        if not is_valid:
+            raise HttpError(422, error_message or 'Validation error')
 
-    n = len(data)
 
-    squared_diff = [(value - mean) ** 2 for value in data]
+def route_wrapper(schema=None):
+    validator = get_validator(schema) if schema else None
 
-    return sum(squared_diff) / n
+    def decorator(handler: Callable):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            started, status = start_request(handler.__name__), 500
 
+            try:
+                validate_route(validator)
 
-def get_data_sigma(data: Sequence[float], variance: Union[float, None] = None) -> float:
-    variance = variance or get_data_variance(data)
+                result = handler(*args, **kwargs)
 
-    return variance ** 0.5
+                status = result.status_code if isinstance(result, Response) else 200
 
+                return result
+            except Exception as e:
+                http_error = e if isinstance(e, HttpError) else HttpError()
 
-def filter_temperatures(temperature_data: Sequence[TemperatureData]):
-    values = get_temperature_values(temperature_data)
+                message, error_code = http_error.message, http_error.error_code
 
-    mean = get_data_mean(values)
+                print(f'Error: {e}. Code: {error_code}. Message: {message}')
 
-    sigma = get_data_sigma(values)
+                status = error_code
 
-    filtered_temperatures = [el for el in temperature_data if mean -
-                             3 * sigma <= el['temperature'] <= mean + 3 * sigma]
+                return jsonify({"error": message}), error_code
+            finally:
+                finish_request(handler.__name__, started, status)
+        return wrapper
+    return decorator
 
-    return filtered_temperatures
 
+@timed('serialise')
+def stream_temperature_data(chunks: Iterator[Tuple[np.ndarray, np.ndarray]], mimetype: str) -> Iterator[str]:
+    if mimetype == NDJSON_MIMETYPE:
+        for chunk in chunks:
+            temperature_data = arrays_to_temperature_data(*chunk)
 
-class HttpError(Exception):
-    def __init__(self, error_code: int = 500, message: str = "Something went wrong"):
-        self.error_code = error_code
+            count_rows('served', len(temperature_data))
 
-        self.message = message
+            if temperature_data:
+                yield '\n'.join(json.dumps(el) for el in temperature_data) + '\n'
 
-        super().__init__(self.message)
+        return
 
+    separator = '['
+
+    for chunk in chunks:
+        temperature_data = arrays_to_temperature_data(*chunk)
+
+        count_rows('served', len(temperature_data))
+
+        if temperature_data:
+            yield separator + json.dumps(temperature_data)[1:-1]
+
+            separator = ','
+
+    yield ']' if separator == ',' else '[]'
+
+
+def format_aggregates(aggregates: Dict[str, np.ndarray]) -> List[dict]:
+    columns = {name: column.round(TEMPERATURE_DECIMALS).tolist() if column.dtype.kind == 'f' else column.tolist()
+               for name, column in aggregates.items() if name != 'time'}
+
+    times = format_times(aggregates['time'])
+
+    return [dict(time=times[i], **{name: column[i] for name, column in columns.items()})
+            for i in range(len(times))]
+
+
+def get_time_argument(args: Mapping[str, str], name: str) -> Union[int, None]:
+    value = args.get(name)
+
+    if value is None:
+        return None
+
+    if not validate_rfc3339(value):
+        raise HttpError(400, f'{name} must be an RFC 3339 date-time')
+
+    return parse_time(value)
+
+
+def get_sensor_argument(args: Mapping[str, str]) -> SensorPartition:
+    sensor_id = args.get('sensor_id', DEFAULT_SENSOR_ID)
 
-temperatureDataSchema = {
-    'type': 'object',
-    'properties': {
-            'temperature': {'type': 'number'},
-            'time': {'type': 'string', 'format': 'date-time', "format_checker": validate_rfc3339}
-    },
-    'required': ['temperature', 'time']
-}
-
-temperatureDataBatchSchema = {
-    'type': 'object',
-    'properties': {
-        'temperatures_batch': {
-            'type': 'array',
-            'items': temperatureDataSchema
-        }
-    },
-    'required': ['temperatures_batch']
-}
-
-
-def validate_json(data, schema):
     try:
-        validate(data, schema)
+        partition = sensors.get(
+            sensor_id, create=sensor_id == DEFAULT_SENSOR_ID)
+    except ValueError as e:
+        raise HttpError(400, str(e))
 
-        return True, None
-    except ValidationError as e:
-        return False, e.message
+    if partition is None:
+        raise HttpError(404, f'Unknown sensor: {sensor_id}')
 
+    partition.storage.refresh()
 
-def validate_route(json_schema):
-    if json_schema:
-        request_data = request.json
+    return partition
 
-        is_valid, error_message = validate_json(request_data, json_schema)
 
-        if not is_valid:
-            raise HttpError(422, error_message or 'Validation error')
+def get_limit_argument(args: Mapping[str, str]) -> Union[int, None]:
+    value = args.get('limit')
 
+    if value is None:
+        return None
+
+    if not value.isdigit() or int(value) < 1:
+        raise HttpError(400, 'limit must be a positive integer')
+
+    return min(int(value), MAX_QUERY_LIMIT)
+
+
+def get_generation_argument(args: Mapping[str, str]) -> Tuple[str, int]:
+    try:
+        return decode_generation(args['since'])
+    except GenerationError:
+        raise HttpError(400, 'since must be a generation from X-Generation')
+
+
+def get_version_headers(storage: TemperatureStorage, mimetype: str, encoding: Union[str, None] = None) -> Dict[str, str]:
+    # read before the data, so a response never carries a generation newer than its rows
+    generation = storage.version
+
+    representation = mimetype.rsplit("/", 1)[-1] + (f'-{encoding}' if encoding else '')
+
+    return {
+        'ETag': quote_etag(f'{generation}-{representation}'),
+        'Last-Modified': http_date(storage.modified),
+        'Vary': 'Accept, Accept-Encoding',
+        'X-Generation': generation
+    }
+
+
+def is_not_modified(if_none_match: Union[str, None], etag: str) -> bool:
+    return bool(if_none_match) and parse_etags(if_none_match).contains_weak(etag.strip('"'))
+
+
+@timed('query')
+def query_temperature_chunks(partition: SensorPartition, args: Mapping[str, str]) -> Tuple[Iterator[Tuple[np.ndarray, np.ndarray]], Dict[str, str]]:
+    storage = partition.storage
+
+    if 'since' in args:
+        changes = partition.change_log.since(*get_generation_argument(args))
+
+        if changes is None:
+            raise HttpError(
+                410, f'Generation {args["since"]} is no longer available, read without since')
+
+        times, temperatures, generation = changes
+
+        return iter_array_chunks(times, temperatures), {'X-Generation': generation}
+
+    if not any(name in args for name in QUERY_ARGUMENTS):
+        return storage.read_chunks(), {}
+
+    start, end, limit = get_time_argument(
+        args, 'from'), get_time_argument(args, 'to'), get_limit_argument(args)
+
+    # unpaginated windows over recent readings are answered from memory
+    if start is not None and limit is None and 'cursor' not in args:
+        recent = partition.hot_window.query(start, end)
+
+        if recent is not None:
+            return iter_array_chunks(*recent), {}
+
+    try:
+        chunks, next_cursor = storage.query_chunks(
+            start, end, limit, args.get('cursor'))
+    except StaleCursorError as e:
+        raise HttpError(410, str(e))
+    except CursorError as e:
+        raise HttpError(400, str(e))
+
+    return chunks, {'X-Next-Cursor': next_cursor} if next_cursor else {}
+
+
+@timed('aggregate')
+def query_aggregates(args: Mapping[str, str]) -> List[dict]:
+    bucket = args.get('bucket')
+
+    if bucket not in BUCKETS:
+        raise HttpError(
+            400, f'bucket must be one of: {", ".join(BUCKETS)}')
+
+    rollups = get_sensor_argument(args).rollups
+
+    return format_aggregates(rollups.query(bucket, get_time_argument(args, 'from'), get_time_argument(args, 'to')))
+
+
+def list_sensors() -> List[dict]:
+    return [{"sensor_id": sensor_id, "room": sensors.rooms.get(sensor_id)} for sensor_id in sensors.sensor_ids()]
+
+
+def get_cache_statistics() -> dict:
+    partitions = list(sensors.partitions.items())
+
+    statistics = {sensor_id: partition.hot_window.statistics()
+                  for sensor_id, partition in partitions}
+
+    for sensor_statistics in statistics.values():
+        covered_from = sensor_statistics['covered_from']
+
+        sensor_statistics['covered_from'] = None if covered_from is None else format_time(
+            covered_from)
+
+    return {
+        "hits": sum(sensor_statistics['hits'] for sensor_statistics in statistics.values()),
+        "misses": sum(sensor_statistics['misses'] for sensor_statistics in statistics.values()),
+        "sensors": statistics
+    }
+
+
+class DecompressionMiddleware:
+    # request bodies are inflated before Flask sees them, so every route reads plain JSON or binary batches
+    def __init__(self, wsgi_app: Callable):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ: dict, start_response: Callable):
+        content_encoding = environ.pop('HTTP_CONTENT_ENCODING', None)
+
+        if content_encoding:
+            # a terminated input may be read to its end whatever Content-Length says, e.g. for chunked requests
+            content_length = None if environ.get('wsgi.input_terminated') or not environ.get(
+                'CONTENT_LENGTH') else int(environ['CONTENT_LENGTH'])
 
-def route_wrapper(schema=None):
-    def decorator(handler: Callable):
-        @wraps(handler)
-        def wrapper(*args, **kwargs):
             try:
-                validate_route(schema)
+                body = decompress_body(read_compressed_body(
+                    environ['wsgi.input'], content_length), content_encoding)
+            except CompressionError as e:
+                print(f'Error: {e}. Code: {e.error_code}. Message: {e}')
 
-                return handler(*args, **kwargs)
-            except Exception as e:
-                http_error = e if isinstance(e, HttpError) else HttpError()
+                return Response(json.dumps({"error": str(e)}), e.error_code, mimetype=JSON_MIMETYPE)(environ, start_response)
 
-                message, error_code = http_error.message, http_error.error_code
+            environ['wsgi.input'] = io.BytesIO(body)
 
-                print(f'Error: {e}. Code: {error_code}. Message: {message}')
+            environ['CONTENT_LENGTH'] = str(len(body))
 
-                return jsonify({"error": message}), error_code
-        return wrapper
-    return decorator
+        return self.wsgi_app(environ, start_response)
 
 
 app = Flask(__name__)
 
+app.wsgi_app = DecompressionMiddleware(app.wsgi_app)
+
 
 @app.route("/", methods=["GET"])
 @route_wrapper()
 def get_temperatures():
-    return get_temperature_data()
+    mimetype = request.accept_mimetypes.best_match(
+        [JSON_MIMETYPE, NDJSON_MIMETYPE]) or JSON_MIMETYPE
+
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+
+    partition = get_sensor_argument(request.args)
+
+    headers = get_version_headers(partition.storage, mimetype, encoding)
+
+    if is_not_modified(request.headers.get('If-None-Match'), headers['ETag']):
+        return Response(status=304, headers=headers)
+
+    chunks, query_headers = query_temperature_chunks(partition, request.args)
+
+    body = stream_temperature_data(chunks, mimetype)
+
+    if encoding:
+        body, headers['Content-Encoding'] = compress_stream(body, encoding), encoding
+
+    return Response(body, mimetype=mimetype, headers={**headers, **query_headers})
+
+
+@app.route("/aggregate", methods=["GET"])
+@route_wrapper()
+def get_aggregates():
+    return query_aggregates(request.args)
+
+
+@app.route("/sensors", methods=["GET"])
+@route_wrapper()
+def get_sensors():
+    return list_sensors()
+
+
+@app.route("/cache", methods=["GET"])
+@route_wrapper()
+def get_cache():
+    return get_cache_statistics()
+
+
+@app.route("/metrics", methods=["GET"])
+@route_wrapper()
+def get_metrics():
+    if not METRICS_ENABLED:
+        raise HttpError(404, 'Metrics are disabled')
+
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
 
 
 @app.route("/", methods=["POST"])
-@route_wrapper(temperatureDataSchema)
+@route_wrapper(temperatureDataRequestSchema)
 def add_temperature():
     body = request.json
 
@@ -205,6 +421,14 @@ def add_temperature():
 @app.route("/batch", methods=["POST"])
 @route_wrapper(temperatureDataBatchSchema)
 def add_temperatures():
+    if request.mimetype == BATCH_MIMETYPE:
+        batch, rejected = filter_temperature_batch(request.get_data())
+
+        if len(batch.times):
+            commit_queue.submit(batch).result()
+
+        return {"accepted": len(batch.times), "rejected": rejected}
+
     body = request.json
 
     # print(body)
@@ -0,0 +1,67 @@
+from time import *
+from ioeclient import IoEClient
+
+# seconds after which the states are reported again even when nothing changed
+HEARTBEAT = 60
+
+deadbands = []
+lastStates = None
+lastPublished = 0
+
+publishedCount = 0
+skippedCount = 0
+
+
+def setupStatePublisher(stateDeadbands):
+    # one deadband per reported state; 0 reports every change
+    global deadbands
+    global lastStates
+
+    deadbands = stateDeadbands
+
+    lastStates = None
+
+
+def stateChanged(value, last, deadband):
+    if deadband and isinstance(value, (int, float)) and isinstance(last, (int, float)):
+        return abs(value - last) >= deadband
+
+    return value != last
+
+
+def statesChanged(states):
+    if lastStates is None or len(states) != len(lastStates):
+        return True
+
+    for i in range(len(states)):
+        deadband = deadbands[i] if i < len(deadbands) else 0
+
+        if stateChanged(states[i], lastStates[i], deadband):
+            return True
+
+    return False
+
+
+def publishStates(states):
+    global lastStates
+    global lastPublished
+    global publishedCount
+    global skippedCount
+
+    now = time()
+
+    # a reading drifting inside its deadband is compared with the last reported value, not the last read one
+    if not statesChanged(states) and now - lastPublished < HEARTBEAT:
+        skippedCount += 1
+
+        return False
+
+    IoEClient.reportStates(states)
+
+    lastStates = states
+
+    lastPublished = now
+
+    publishedCount += 1
+
+    return True
@@ -0,0 +1,271 @@
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack
+from typing import Sequence, Tuple, Union
+import numpy as np
+from ArrayStatistics import as_float_array, group_ranks, grouped_median_sigma, grouped_moments, rolling_mean_sigma
+
+STATISTICS_SUFFIX = '.stats.json'
+
+SIGMA_THRESHOLD = 3
+MIN_SAMPLES = 10
+# floor for the spread a reading is compared with; SIGMA_THRESHOLD times it must stay above one step of the
+# thermostat's sensor (200 / 1023 ~ 0.2 degrees), or a real one-step change in a steady room is an outlier
+MIN_SIGMA = float(os.environ.get('TEMPERATURE_MIN_SIGMA', 0.1))
+
+# 1.0 keeps the cumulative distribution, values below 1.0 decay older readings exponentially; the default
+# remembers roughly the last 1 / (1 - DECAY) readings, so the distribution follows a sensor that moves
+DECAY = float(os.environ.get('TEMPERATURE_STATISTICS_DECAY', 0.99))
+
+# weight of a rejected reading relative to an accepted one
+REJECTED_WEIGHT = 0.25
+
+# 'sigma' compares against the running mean and sigma, 'mad' against the median and MAD of the
+# recent readings and 'rolling_z' against the mean and sigma of the recent readings before each value
+OUTLIER_FILTER = os.environ.get('TEMPERATURE_OUTLIER_FILTER', 'sigma')
+OUTLIER_FILTERS = ('sigma', 'mad', 'rolling_z')
+
+RECENT_WINDOW = 256
+
+SAVE_INTERVAL = 5
+
+
+class RunningStatistics:
+    def __init__(self, decay: float = DECAY, weight: float = 0.0, mean: float = 0.0, m2: float = 0.0, count: int = 0,
+                 recent: Union[Sequence[float], None] = None):
+        self.decay = decay
+
+        self.weight = weight
+
+        self.mean = mean
+
+        self.m2 = m2
+
+        self.count = count
+
+        # the last readings, accepted or not, for the robust filters
+        self.recent = as_float_array(recent or [])
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / self.weight if self.weight else 0.0
+
+    @property
+    def sigma(self) -> float:
+        return self.variance ** 0.5
+
+    def update_array(self, values: np.ndarray):
+        if not len(values):
+            return
+
+        # the newest reading has weight 1 and every older one decays once more
+        weights = self.decay ** np.arange(len(values) - 1, -1, -1, dtype=np.float64)
+
+        totals, means, m2s = grouped_moments(
+            values, np.zeros(len(values), dtype=np.int64), 1, weights)
+
+        self.merge(float(totals[0]), float(means[0]), float(m2s[0]), values)
+
+    def merge(self, weight: float, mean: float, m2: float, values: np.ndarray):
+        # Chan's parallel combination of the decayed state with a batch summarised by its weighted moments
+        aged = self.weight * self.decay ** len(values)
+
+        total = aged + weight
+
+        delta = mean - self.mean
+
+        self.mean += delta * weight / total
+
+        self.m2 = self.m2 * self.decay ** len(values) + m2 + \
+            delta * delta * aged * weight / total
+
+        self.weight = total
+
+        self.count += len(values)
+
+        self.recent = np.concatenate((self.recent, values))[-RECENT_WINDOW:]
+
+    def bounds(self, threshold: float = SIGMA_THRESHOLD):
+        sigma = max(self.sigma, MIN_SIGMA)
+
+        return self.mean - threshold * sigma, self.mean + threshold * sigma
+
+    def to_dict(self) -> dict:
+        return {'decay': self.decay, 'weight': self.weight, 'mean': self.mean, 'm2': self.m2, 'count': self.count,
+                'recent': self.recent.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RunningStatistics':
+        return cls(data['decay'], data['weight'], data['mean'], data['m2'], data['count'], data.get('recent'))
+
+
+class StatisticsFilter:
+    def __init__(self, filename: str, decay: float = DECAY, method: str = OUTLIER_FILTER):
+        if method not in OUTLIER_FILTERS:
+            raise ValueError(f'Unknown outlier filter: {method}')
+
+        self.filename = filename
+
+        self.method = method
+
+        self.lock = threading.Lock()
+
+        self.statistics = load_running_statistics(filename, decay)
+
+        self._saved_at = time.monotonic()
+
+        self._dirty = False
+
+        atexit.register(self.save)
+
+    def _updated(self, count: int):
+        self._dirty = self._dirty or bool(count)
+
+        if self._dirty and time.monotonic() - self._saved_at >= SAVE_INTERVAL:
+            self._save()
+
+    def _save(self):
+        save_running_statistics(self.statistics, self.filename)
+
+        self._saved_at = time.monotonic()
+
+        self._dirty = False
+
+    def save(self):
+        with self.lock:
+            if self._dirty:
+                self._save()
+
+
+def get_bounds(filters: Sequence[StatisticsFilter], values: np.ndarray, groups: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # per reading acceptance bounds; filters that have not seen MIN_SAMPLES readings accept everything
+    low, high = np.full(len(values), -np.inf), np.full(len(values), np.inf)
+
+    statistics = [statistics_filter.statistics for statistics_filter in filters]
+
+    by_method = {method: [number for number, statistics_filter in enumerate(filters) if statistics_filter.method == method]
+                 for method in OUTLIER_FILTERS}
+
+    centers, sigmas = np.full(len(filters), np.nan), np.full(len(filters), np.nan)
+
+    for number in by_method['sigma']:
+        if statistics[number].count >= MIN_SAMPLES:
+            centers[number], sigmas[number] = statistics[number].mean, statistics[number].sigma
+
+    # the median and MAD of every sensor's recent window come out of one grouped computation
+    windows = [number for number in by_method['mad']
+               if len(statistics[number].recent) >= MIN_SAMPLES]
+
+    if windows:
+        window_values = np.concatenate(
+            [statistics[number].recent for number in windows])
+
+        window_groups = np.repeat(np.arange(len(windows)), [
+                                  len(statistics[number].recent) for number in windows])
+
+        centers[windows], sigmas[windows] = grouped_median_sigma(
+            window_values, window_groups, len(windows))
+
+    selected = ~np.isnan(centers[groups])
+
+    low[selected] = centers[groups][selected] - SIGMA_THRESHOLD * \
+        np.maximum(sigmas[groups][selected], MIN_SIGMA)
+
+    high[selected] = centers[groups][selected] + SIGMA_THRESHOLD * \
+        np.maximum(sigmas[groups][selected], MIN_SIGMA)
+
+    # a rolling z-score depends on the readings right before each value, so it runs per sensor
+    for number in by_method['rolling_z']:
+        positions = np.flatnonzero(groups == number)
+
+        recent = statistics[number].recent
+
+        means, rolling_sigmas = rolling_mean_sigma(np.concatenate(
+            (recent, values[positions])), RECENT_WINDOW)
+
+        means, rolling_sigmas = means[len(recent):], rolling_sigmas[len(recent):]
+
+        counts = np.minimum(np.arange(len(recent), len(
+            recent) + len(positions)), RECENT_WINDOW)
+
+        warm = counts >= MIN_SAMPLES
+
+        low[positions[warm]] = means[warm] - SIGMA_THRESHOLD * \
+            np.maximum(rolling_sigmas[warm], MIN_SIGMA)
+
+        high[positions[warm]] = means[warm] + SIGMA_THRESHOLD * \
+            np.maximum(rolling_sigmas[warm], MIN_SIGMA)
+
+    return low, high
+
+
+def filter_batch(filters: Sequence[StatisticsFilter], values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    # decides and records the readings of many sensors at once; groups[i] is the index of values[i]'s filter
+    finite = np.isfinite(values)
+
+    # a non-finite reading is never accepted and never reaches the moments, where it would stay for good
+    if not finite.all():
+        accepted = np.zeros(len(values), dtype=bool)
+
+        accepted[finite] = filter_batch(filters, values[finite], groups[finite])
+
+        return accepted
+
+    with ExitStack() as stack:
+        # a fixed lock order keeps concurrent batches over overlapping sensors from deadlocking
+        for statistics_filter in sorted(set(filters), key=lambda statistics_filter: statistics_filter.filename):
+            stack.enter_context(statistics_filter.lock)
+
+        low, high = get_bounds(filters, values, groups)
+
+        accepted = (values >= low) & (values <= high)
+
+        ranks, sizes = group_ranks(groups, len(filters))
+
+        decays = np.array([statistics_filter.statistics.decay for statistics_filter in filters])
+
+        # rejected readings still count, at a reduced weight, so that a real level shift re-centres the distribution
+        weights = decays[groups] ** (sizes[groups] - 1 - ranks) * np.where(accepted, 1.0, REJECTED_WEIGHT)
+
+        totals, means, m2s = grouped_moments(values, groups, len(filters), weights)
+
+        order = np.argsort(groups, kind='stable')
+
+        group_values = np.split(values[order], np.cumsum(sizes)[:-1])
+
+        for number, statistics_filter in enumerate(filters):
+            if sizes[number]:
+                statistics_filter.statistics.merge(
+                    float(totals[number]), float(means[number]), float(m2s[number]), group_values[number])
+
+            statistics_filter._updated(int(sizes[number]))
+
+    return accepted
+
+
+def load_running_statistics(filename: str, decay: float = DECAY) -> RunningStatistics:
+    try:
+        with open(filename, 'r') as statistics_file:
+            statistics = RunningStatistics.from_dict(json.load(statistics_file))
+    except (FileNotFoundError, ValueError, KeyError):
+        return RunningStatistics(decay)
+
+    statistics.decay = decay
+
+    return statistics
+
+
+def save_running_statistics(statistics: RunningStatistics, filename: str):
+    temporary_filename = filename + '.tmp'
+
+    with open(temporary_filename, 'w') as statistics_file:
+        json.dump(statistics.to_dict(), statistics_file)
+
+    os.replace(temporary_filename, filename)
+
+
+def get_statistics_filename(data_filename: str) -> str:
+    return os.path.splitext(data_filename)[0] + STATISTICS_SUFFIX
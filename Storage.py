@@ -0,0 +1,1264 @@
+import csv
+import io
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, NotRequired, Sequence, Tuple, TypedDict, Union
+import numpy as np
+
+DATA_CSV = 'temperature_data.csv'
+DATA_SEGMENT = 'temperature_data.seg'
+DATA_DIRECTORY = 'temperature_data'
+
+# sensor ids double as partition file names, so they are restricted to a safe character set
+DEFAULT_SENSOR_ID = 'default'
+# \Z rather than $, which also matches before a trailing newline
+SENSOR_ID_PATTERN = r'^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}\Z'
+
+STORAGE_BACKEND = os.environ.get('TEMPERATURE_STORAGE_BACKEND', 'binary')
+
+# times are stored and compared as integer microseconds since the Unix epoch
+MICROSECONDS_PER_SECOND = 1_000_000
+SECONDS_PER_DAY = 24 * 60 * 60
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# the form getISO8601Date in Task2.py sends (%Y-%m-%dT%H:%M:%SZ), parsed without datetime
+FAST_TIME_LENGTH = 20
+FAST_TIME_SEPARATORS = {4: '-', 7: '-', 10: 'T', 13: ':', 16: ':', 19: 'Z'}
+FAST_TIME_DIGITS = [position for position in range(FAST_TIME_LENGTH)
+                    if position not in FAST_TIME_SEPARATORS]
+
+# below this many values the numpy setup costs more than parsing them one by one (benchmarks/parsing.py)
+VECTORISED_PARSE_MIN = 64
+
+# days per month, indexed by month number
+DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# segment layout: 16 byte header (magic, version, record size) followed by fixed-width records
+SEGMENT_MAGIC = b'TSEG'
+SEGMENT_VERSION = 2
+SEGMENT_HEADER = struct.Struct('<4sII')
+SEGMENT_HEADER_SIZE = 16
+
+RECORD_DTYPE = np.dtype([('time', '<i8'), ('temperature', '<f4')])
+
+# version 1 segments stored float epoch seconds, they are converted when opened for writing
+LEGACY_SEGMENT_VERSION = 1
+LEGACY_RECORD_DTYPE = np.dtype([('time', '<f8'), ('temperature', '<f4')])
+
+# sorted (time, record position) pairs kept next to the segment for range queries
+INDEX_SUFFIX = '.idx'
+INDEX_DTYPE = np.dtype([('time', '<i8'), ('position', '<i8')])
+
+# out-of-order batches are appended to the index as sorted runs of their own; past this many runs
+# they are merged into one in the background
+MAX_INDEX_RUNS = int(os.environ.get('TEMPERATURE_MAX_INDEX_RUNS', 16))
+
+TEMPERATURE_DECIMALS = 4
+
+READ_CHUNK_SIZE = 4096
+
+# a generation is '<epoch>.<rows>'; the epoch is drawn per process and again whenever stored rows are
+# rewritten, so a generation handed out by another worker or before a compaction never matches
+GENERATION_SEPARATOR = '.'
+GENERATION_EPOCH_BYTES = 6
+
+
+class TemperatureData(TypedDict):
+    temperature: float
+    time: str
+    sensor_id: NotRequired[str]
+    room: NotRequired[str]
+
+
+def days_from_civil(year, month, day):
+    # proleptic Gregorian date to days since 1970-01-01; works on ints and integer arrays alike
+    shifted_month = (month + 9) % 12
+
+    year = year - shifted_month // 10
+
+    era = year // 400
+
+    year_of_era = year - era * 400
+
+    day_of_year = (153 * shifted_month + 2) // 5 + day - 1
+
+    return era * 146097 + year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year - 719468
+
+
+def is_leap_year(year):
+    return (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+
+
+def to_microseconds(year, month, day, hour, minute, second):
+    return ((days_from_civil(year, month, day) * SECONDS_PER_DAY + hour * 3600 + minute * 60 + second)
+            * MICROSECONDS_PER_SECOND)
+
+
+def parse_time(value: str) -> int:
+    # the C datetime parser beats any per-string Python code, the fixed form is only specialised in parse_times
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    return (parsed - EPOCH) // timedelta(microseconds=1)
+
+
+def parse_times(values: Sequence[str]) -> np.ndarray:
+    if len(values) < VECTORISED_PARSE_MIN:
+        return np.fromiter((parse_time(value) for value in values), dtype=np.int64, count=len(values))
+
+    times = np.zeros(len(values), dtype=np.int64)
+
+    try:
+        encoded = np.array(values, dtype=bytes)
+    except UnicodeEncodeError:
+        encoded = None
+
+    fast = np.zeros(len(values), dtype=bool)
+
+    # the fixed-width form is decoded column by column over the whole batch
+    if encoded is not None and encoded.itemsize >= FAST_TIME_LENGTH:
+        characters = encoded.view(np.uint8).reshape(len(values), encoded.itemsize)
+
+        fast[:] = True
+
+        for position, separator in FAST_TIME_SEPARATORS.items():
+            fast &= characters[:, position] == ord(separator)
+
+        if encoded.itemsize > FAST_TIME_LENGTH:
+            fast &= characters[:, FAST_TIME_LENGTH] == 0
+
+        digits = characters[:, FAST_TIME_DIGITS].astype(np.int64) - ord('0')
+
+        fast &= ((digits >= 0) & (digits <= 9)).all(axis=1)
+
+        year, month, day, hour, minute, second = [digits[:, start:end] @ 10 ** np.arange(end - start - 1, -1, -1)
+                                                  for start, end in ((0, 4), (4, 6), (6, 8), (8, 10), (10, 12), (12, 14))]
+
+        days_in_month = np.take(DAYS_IN_MONTH, month % 13) + \
+            ((month == 2) & is_leap_year(year))
+
+        fast &= (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= days_in_month) & \
+            (hour < 24) & (minute < 60) & (second < 60)
+
+        times[fast] = to_microseconds(
+            year, month, day, hour, minute, second)[fast]
+
+    # fractional seconds, offsets and invalid dates take the general path, which also raises the errors
+    for position in np.flatnonzero(~fast).tolist():
+        times[position] = parse_time(values[position])
+
+    return times
+
+
+def format_time(timestamp: int) -> str:
+    parsed = EPOCH + timedelta(microseconds=int(timestamp))
+
+    if parsed.microsecond:
+        return parsed.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    return parsed.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def format_times(timestamps: np.ndarray) -> List[str]:
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+
+    moments = timestamps.astype('datetime64[us]')
+
+    formatted = np.datetime_as_string(moments, unit='s')
+
+    fractional = timestamps % MICROSECONDS_PER_SECOND != 0
+
+    # whole seconds (the usual case) drop the fraction, like format_time
+    if fractional.any():
+        formatted = np.where(fractional, np.datetime_as_string(
+            moments, unit='us'), formatted)
+
+    return [value + 'Z' for value in formatted.tolist()]
+
+
+def seconds_to_microseconds(times: np.ndarray) -> np.ndarray:
+    return np.round(np.asarray(times, dtype=np.float64) * MICROSECONDS_PER_SECOND).astype(np.int64)
+
+
+def temperature_data_to_arrays(temperature_data: Sequence[TemperatureData]) -> Tuple[np.ndarray, np.ndarray]:
+    times = parse_times([el['time'] for el in temperature_data])
+
+    temperatures = np.fromiter((el['temperature'] for el in temperature_data),
+                               dtype=np.float32, count=len(temperature_data))
+
+    return times, temperatures
+
+
+def arrays_to_temperature_data(times: np.ndarray, temperatures: np.ndarray) -> List[TemperatureData]:
+    rounded_temperatures = temperatures.astype(
+        np.float64).round(TEMPERATURE_DECIMALS).tolist()
+
+    return [{"temperature": temperature, "time": formatted_time}
+            for temperature, formatted_time in zip(rounded_temperatures, format_times(times))]
+
+
+def iter_array_chunks(times: np.ndarray, temperatures: np.ndarray,
+                      chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    for chunk_start in range(0, len(times), chunk_size):
+        yield times[chunk_start:chunk_start + chunk_size], temperatures[chunk_start:chunk_start + chunk_size]
+
+
+def save_temperature_data_to_csv(temperature_data: Sequence[TemperatureData], filename: str = DATA_CSV):
+    with open(filename, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=['temperature', 'time'])
+
+        writer.writeheader()
+
+        writer.writerows(temperature_data)
+
+
+def append_temperature_data_to_csv(temperature_data: Sequence[TemperatureData], filename: str = DATA_CSV):
+    with open(filename, 'a', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=['temperature', 'time'])
+
+        writer.writerows(temperature_data)
+
+
+def format_temperature_data_as_csv(temperature_data: Sequence[TemperatureData], header: bool = False) -> bytes:
+    csv_buffer = io.StringIO()
+
+    writer = csv.DictWriter(csv_buffer, fieldnames=[
+                            'temperature', 'time'], extrasaction='ignore')
+
+    if header:
+        writer.writeheader()
+
+    writer.writerows(temperature_data)
+
+    return csv_buffer.getvalue().encode()
+
+
+def read_temperature_data_from_csv(filename: str = DATA_CSV) -> List[TemperatureData]:
+    temperature_data = []
+
+    with open(filename, 'r') as csv_file:
+        reader = csv.DictReader(csv_file)
+
+        for row in reader:
+            temperature_data.append({"temperature": float(
+                row["temperature"]), "time": row["time"]})
+
+    return temperature_data
+
+
+def read_first_temperature_data_from_csv(filename: str = DATA_CSV) -> Union[TemperatureData, None]:
+    first_temperature_data = None
+
+    try:
+        with open(filename, 'r') as csv_file:
+            reader = csv.DictReader(csv_file)
+
+            first_row = next(reader, None)
+
+            if first_row:
+                first_temperature_data = TemperatureData({"temperature": float(
+                    first_row["temperature"]), "time": first_row["time"]})
+    except FileNotFoundError:
+        pass
+
+    return first_temperature_data
+
+
+class GenerationError(ValueError):
+    pass
+
+
+def new_epoch() -> str:
+    return os.urandom(GENERATION_EPOCH_BYTES).hex()
+
+
+def encode_generation(epoch: str, rows: int) -> str:
+    return f'{epoch}{GENERATION_SEPARATOR}{rows}'
+
+
+def decode_generation(value: str) -> Tuple[str, int]:
+    epoch, _, rows = value.partition(GENERATION_SEPARATOR)
+
+    if not epoch or not rows.isdigit():
+        raise GenerationError(f'Invalid generation: {value}')
+
+    return epoch, int(rows)
+
+
+AppendListener = Callable[[np.ndarray, np.ndarray], None]
+RewriteListener = Callable[[], None]
+
+
+class TemperatureStorage:
+    def __init__(self):
+        self.append_listeners: List[AppendListener] = []
+
+        self.rewrite_listeners: List[RewriteListener] = []
+
+        self.epoch = new_epoch()
+
+        # bumped by the number of rows on every append, back to 0 with every new epoch
+        self.generation = 0
+
+        self.modified = time.time()
+
+        self.notify_lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        with self.notify_lock:
+            return encode_generation(self.epoch, self.generation)
+
+    def add_append_listener(self, listener: AppendListener):
+        self.append_listeners.append(listener)
+
+    def add_rewrite_listener(self, listener: RewriteListener):
+        self.rewrite_listeners.append(listener)
+
+    def _notify_rewrite(self):
+        # rows were removed or replaced, so nothing derived from an earlier generation is valid any more
+        with self.notify_lock:
+            self.epoch = new_epoch()
+
+            self.generation = 0
+
+            self.modified = time.time()
+
+            for listener in self.rewrite_listeners:
+                listener()
+
+    def _notify_append(self, times: np.ndarray, temperatures: np.ndarray):
+        # listeners run under the lock, so they see the generation that includes their rows
+        with self.notify_lock:
+            self.generation += len(times)
+
+            self.modified = time.time()
+
+            for listener in self.append_listeners:
+                listener(times, temperatures)
+
+    def read(self) -> List[TemperatureData]:
+        raise NotImplementedError
+
+    def read_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        return temperature_data_to_arrays(self.read())
+
+    def append(self, temperature_data: Sequence[TemperatureData]):
+        raise NotImplementedError
+
+    def append_arrays(self, times: np.ndarray, temperatures: np.ndarray):
+        self.append(arrays_to_temperature_data(times, temperatures))
+
+    def sync(self):
+        pass
+
+    def refresh(self):
+        pass
+
+    def replay(self):
+        for times, temperatures in self.read_chunks():
+            self._notify_append(times, temperatures)
+
+    def query(self, start: Union[int, None] = None, end: Union[int, None] = None, limit: Union[int, None] = None,
+              cursor: Union[str, None] = None) -> Tuple[np.ndarray, np.ndarray, Union[str, None]]:
+        times, temperatures = self.read_arrays()
+
+        order = np.lexsort((np.arange(len(times)), times))
+
+        index = np.empty(len(times), dtype=INDEX_DTYPE)
+
+        index['time'] = times[order]
+
+        index['position'] = order
+
+        lo, hi, next_cursor = select_index_range(
+            index, start, end, limit, cursor)
+
+        positions = index['position'][lo:hi]
+
+        return times[positions], temperatures[positions], next_cursor
+
+    def read_chunks(self, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        return iter_array_chunks(*self.read_arrays(), chunk_size)
+
+    def query_chunks(self, start: Union[int, None] = None, end: Union[int, None] = None, limit: Union[int, None] = None,
+                     cursor: Union[str, None] = None, chunk_size: int = READ_CHUNK_SIZE) -> Tuple[Iterator[Tuple[np.ndarray, np.ndarray]], Union[str, None]]:
+        times, temperatures, next_cursor = self.query(
+            start, end, limit, cursor)
+
+        return iter_array_chunks(times, temperatures, chunk_size), next_cursor
+
+
+class CsvTemperatureStorage(TemperatureStorage):
+    def __init__(self, filename: str = DATA_CSV):
+        super().__init__()
+
+        self.filename = filename
+
+        self.lock = threading.Lock()
+
+        self.writer = AppendWriter(
+            filename, format_temperature_data_as_csv([], header=True))
+
+    def read(self) -> List[TemperatureData]:
+        try:
+            return read_temperature_data_from_csv(self.filename)
+        except FileNotFoundError:
+            return []
+
+    def append(self, temperature_data: Sequence[TemperatureData]):
+        rows = format_temperature_data_as_csv(temperature_data)
+
+        with self.lock:
+            self.writer.write(rows)
+
+            self._notify_append(*temperature_data_to_arrays(temperature_data))
+
+    def sync(self):
+        with self.lock:
+            self.writer.sync()
+
+
+class SegmentError(Exception):
+    pass
+
+
+class CursorError(ValueError):
+    pass
+
+
+class StaleCursorError(CursorError):
+    pass
+
+
+def encode_cursor(timestamp: int, position: int) -> str:
+    return f'{timestamp}:{position}'
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        timestamp, position = cursor.split(':')
+
+        return int(timestamp), int(position)
+    except ValueError:
+        raise CursorError(f'Invalid cursor: {cursor}')
+
+
+def select_index_range(index: np.ndarray, start: Union[int, None] = None, end: Union[int, None] = None,
+                       limit: Union[int, None] = None, cursor: Union[str, None] = None) -> Tuple[int, int, Union[str, None]]:
+    times = index['time']
+
+    lo = 0 if start is None else int(np.searchsorted(times, start, 'left'))
+
+    hi = len(index) if end is None else int(np.searchsorted(times, end, 'left'))
+
+    if cursor is not None:
+        cursor_time, cursor_position = decode_cursor(cursor)
+
+        # entries sharing the cursor time are ordered by position, so skip the ones already returned
+        run_start = int(np.searchsorted(times, cursor_time, 'left'))
+
+        run_end = int(np.searchsorted(times, cursor_time, 'right'))
+
+        run_offset = int(np.searchsorted(
+            index['position'][run_start:run_end], cursor_position, 'right'))
+
+        lo = max(lo, run_start + run_offset)
+
+    hi = max(lo, hi)
+
+    next_cursor = None
+
+    if limit is not None and hi - lo > limit:
+        hi = lo + limit
+
+        last = index[hi - 1]
+
+        next_cursor = encode_cursor(
+            int(last['time']), int(last['position']))
+
+    return lo, hi, next_cursor
+
+
+def select_index_runs(index: np.ndarray, runs: np.ndarray, start: Union[int, None] = None, end: Union[int, None] = None,
+                      limit: Union[int, None] = None, cursor: Union[str, None] = None) -> Tuple[np.ndarray, Union[str, None]]:
+    # the entries of an index made of sorted runs (starting at the offsets in runs) in (time, position) order
+    if len(runs) <= 1:
+        lo, hi, next_cursor = select_index_range(index, start, end, limit, cursor)
+
+        return index[lo:hi], next_cursor
+
+    selected, has_more = [], False
+
+    for run_start, run_end in zip(runs.tolist(), runs[1:].tolist() + [len(index)]):
+        lo, hi, run_next_cursor = select_index_range(
+            index[run_start:run_end], start, end, limit, cursor)
+
+        selected.append(index[run_start + lo:run_start + hi])
+
+        has_more = has_more or run_next_cursor is not None
+
+    entries = np.concatenate(selected)
+
+    # later runs hold later positions, so a stable sort by time alone leaves equal times in position order
+    entries = entries[np.argsort(entries['time'], kind='stable')]
+
+    if limit is None:
+        return entries, None
+
+    has_more = has_more or len(entries) > limit
+
+    entries = entries[:limit]
+
+    if not has_more or not len(entries):
+        return entries, None
+
+    return entries, encode_cursor(int(entries['time'][-1]), int(entries['position'][-1]))
+
+
+def find_index_runs(times: np.ndarray, runs: List[int], scanned: int) -> int:
+    # extends runs with the starts found after the first `scanned` entries; a run starts where time goes backwards
+    scan_from = max(scanned - 1, 0)
+
+    runs.extend((np.flatnonzero(times[scan_from + 1:] < times[scan_from:-1]) + scan_from + 1).tolist())
+
+    return len(times)
+
+
+def get_segment_header() -> bytes:
+    return SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, RECORD_DTYPE.itemsize).ljust(SEGMENT_HEADER_SIZE, b'\0')
+
+
+class MappedFile:
+    def __init__(self, filename: str, offset: int, dtype: np.dtype):
+        self.filename = filename
+
+        self.offset = offset
+
+        self.dtype = dtype
+
+        self._mmap = None
+
+        self._key = None
+
+    @property
+    def identity(self) -> Union[int, None]:
+        # the inode of the last mapping; a rewritten file is a new inode
+        return None if self._key is None else self._key[0]
+
+    def array(self) -> np.ndarray:
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return np.empty(0, dtype=self.dtype)
+
+        if stat.st_size <= self.offset:
+            return np.empty(0, dtype=self.dtype)
+
+        # remap when the file grew or was replaced; views into older maps stay valid until released
+        key = (stat.st_ino, stat.st_size)
+
+        if self._mmap is None or self._key != key:
+            with open(self.filename, 'rb') as mapped_file:
+                self._mmap = mmap.mmap(
+                    mapped_file.fileno(), stat.st_size, access=mmap.ACCESS_READ)
+
+            self._key = key
+
+        count = (stat.st_size - self.offset) // self.dtype.itemsize
+
+        return np.frombuffer(self._mmap, dtype=self.dtype, count=count, offset=self.offset)
+
+
+class AppendWriter:
+    def __init__(self, filename: str, header: bytes = b''):
+        self.filename = filename
+
+        self.header = header
+
+        self._file = None
+
+        self._identity = None
+
+    def ensure_open(self) -> bool:
+        # reopen when the file was removed or replaced underneath us (rotation, compaction, index rewrite)
+        if self._file is not None:
+            try:
+                stat = os.stat(self.filename)
+
+                if (stat.st_dev, stat.st_ino) == self._identity:
+                    return False
+            except FileNotFoundError:
+                pass
+
+            self._file.close()
+
+        self._file = open(self.filename, 'ab')
+
+        if not self._file.tell():
+            self._file.write(self.header)
+
+            self._file.flush()
+
+        stat = os.fstat(self._file.fileno())
+
+        self._identity = (stat.st_dev, stat.st_ino)
+
+        return True
+
+    def tell(self) -> int:
+        self.ensure_open()
+
+        return self._file.tell()
+
+    def write(self, data: bytes):
+        self.ensure_open()
+
+        self._file.write(data)
+
+        self._file.flush()
+
+    def sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+            self._file = None
+
+
+class BinaryTemperatureStorage(TemperatureStorage):
+    def __init__(self, filename: str = DATA_SEGMENT, readonly: bool = False):
+        super().__init__()
+
+        self.filename = filename
+
+        self.readonly = readonly
+
+        self.index_filename = os.path.splitext(filename)[0] + INDEX_SUFFIX
+
+        self.lock = threading.Lock()
+
+        self._records = MappedFile(
+            self.filename, SEGMENT_HEADER_SIZE, RECORD_DTYPE)
+
+        self._index = MappedFile(self.index_filename, 0, INDEX_DTYPE)
+
+        # run starts of the mapped index, found incrementally as it grows
+        self._runs: List[int] = [0]
+
+        self._runs_scanned = 0
+
+        self._runs_identity = None
+
+        self._merging = False
+
+        self.writer = self.index_writer = None
+
+        # shards owned by other processes are only ever mapped, never repaired or re-indexed
+        if readonly:
+            return
+
+        self._prepare_segment()
+
+        self.writer = AppendWriter(self.filename, get_segment_header())
+
+        self.index_writer = AppendWriter(self.index_filename)
+
+        self.writer.ensure_open()
+
+        self._prepare_index()
+
+    def _prepare_segment(self):
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename, 'r+b') as segment_file:
+            # a header-less file is what an interrupted creation leaves behind, let the writer start it over
+            if os.fstat(segment_file.fileno()).st_size < SEGMENT_HEADER_SIZE:
+                segment_file.truncate(0)
+
+                return
+
+            magic, version, record_size = SEGMENT_HEADER.unpack(
+                segment_file.read(SEGMENT_HEADER.size))
+
+            if magic == SEGMENT_MAGIC and version == LEGACY_SEGMENT_VERSION and record_size == LEGACY_RECORD_DTYPE.itemsize:
+                self._migrate_segment(segment_file)
+
+                return
+
+            if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION or record_size != RECORD_DTYPE.itemsize:
+                raise SegmentError(
+                    f'{self.filename} is not a version {SEGMENT_VERSION} temperature segment')
+
+            # drop a partially written trailing record left by an interrupted append
+            size = os.fstat(segment_file.fileno()).st_size
+
+            complete_size = SEGMENT_HEADER_SIZE + \
+                (size - SEGMENT_HEADER_SIZE) // record_size * record_size
+
+            if complete_size != size:
+                segment_file.truncate(complete_size)
+
+    def _migrate_segment(self, segment_file):
+        size = os.fstat(segment_file.fileno()).st_size
+
+        segment_file.seek(SEGMENT_HEADER_SIZE)
+
+        legacy_records = np.frombuffer(segment_file.read(), dtype=LEGACY_RECORD_DTYPE,
+                                       count=(size - SEGMENT_HEADER_SIZE) // LEGACY_RECORD_DTYPE.itemsize)
+
+        records = np.empty(len(legacy_records), dtype=RECORD_DTYPE)
+
+        records['time'] = seconds_to_microseconds(legacy_records['time'])
+
+        records['temperature'] = legacy_records['temperature']
+
+        temporary_filename = self.filename + '.tmp'
+
+        with open(temporary_filename, 'wb') as migrated_file:
+            migrated_file.write(get_segment_header())
+
+            migrated_file.write(records.tobytes())
+
+            migrated_file.flush()
+
+            os.fsync(migrated_file.fileno())
+
+        os.replace(temporary_filename, self.filename)
+
+        # the old index has the same length and entry size, so it has to go explicitly to be rebuilt
+        if os.path.exists(self.index_filename):
+            os.remove(self.index_filename)
+
+    def _prepare_index(self):
+        index = self._index.array()
+
+        # the index is derived data, so any mismatch with the segment (crash, rotation) means a rebuild
+        if len(index) != len(self._records.array()) or not os.path.exists(self.index_filename):
+            self._rebuild_index()
+
+    def _index_runs(self, index: np.ndarray) -> np.ndarray:
+        # between rewrites the index only grows, so only the entries added since the last call are scanned
+        if self._index.identity != self._runs_identity or len(index) < self._runs_scanned:
+            self._runs, self._runs_scanned, self._runs_identity = [0], 0, self._index.identity
+
+        self._runs_scanned = find_index_runs(index['time'], self._runs, self._runs_scanned)
+
+        return np.array(self._runs, dtype=np.int64)
+
+    def _rebuild_index(self) -> np.ndarray:
+        times = self._records.array()['time']
+
+        order = np.lexsort((np.arange(len(times)), times))
+
+        index = np.empty(len(times), dtype=INDEX_DTYPE)
+
+        index['time'] = times[order]
+
+        index['position'] = order
+
+        self._write_index(index)
+
+        return index
+
+    def _write_index(self, index: np.ndarray):
+        temporary_filename = self.index_filename + '.tmp'
+
+        with open(temporary_filename, 'wb') as index_file:
+            index_file.write(index.tobytes())
+
+        os.replace(temporary_filename, self.index_filename)
+
+    def _append_index(self, times: np.ndarray, first_position: int):
+        order = np.lexsort((np.arange(len(times)), times))
+
+        entries = np.empty(len(times), dtype=INDEX_DTYPE)
+
+        entries['time'] = times[order]
+
+        entries['position'] = order + first_position
+
+        # in-order batches (the normal case) extend the last run, late ones start a new run; either way it is an append
+        self.index_writer.write(entries.tobytes())
+
+        if not self._merging and len(self._index_runs(self._index.array())) > MAX_INDEX_RUNS:
+            self._merging = True
+
+            threading.Thread(target=self._merge_in_background,
+                             name='index-merge', daemon=True).start()
+
+    def _merge_in_background(self):
+        try:
+            self.merge_index_runs()
+        except Exception as e:
+            print(f'Index merge failed: {e}')
+        finally:
+            self._merging = False
+
+    def merge_index_runs(self):
+        with self.lock:
+            index = self._index.array()
+
+            identity = self._index.identity
+
+        # sorting and writing run without the lock; timsort finds the existing runs, so this is O(n log runs)
+        merged = index[np.argsort(index['time'], kind='stable')]
+
+        temporary_filename = self.index_filename + '.merge'
+
+        with open(temporary_filename, 'wb') as index_file:
+            index_file.write(merged.tobytes())
+
+        with self.lock:
+            current = self._index.array()
+
+            # a rewrite in the meantime already left a fully sorted index
+            if self._index.identity != identity or len(current) < len(index):
+                os.remove(temporary_filename)
+
+                return
+
+            # entries appended during the merge follow as runs of their own
+            with open(temporary_filename, 'ab') as index_file:
+                index_file.write(current[len(index):].tobytes())
+
+                index_file.flush()
+
+                os.fsync(index_file.fileno())
+
+            os.replace(temporary_filename, self.index_filename)
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # records are written before their index entries, so mapping the index first keeps every position in range
+        with self.lock:
+            index = self._index.array()
+
+            records = self._records.array()
+
+            runs = self._index_runs(index)
+
+        return index, records, runs
+
+    def read_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self.lock:
+            records = self._records.array()
+
+        return records['time'], records['temperature']
+
+    def append_arrays(self, times: np.ndarray, temperatures: np.ndarray):
+        if self.readonly:
+            raise SegmentError(f'{self.filename} is opened read-only')
+
+        records = np.empty(len(times), dtype=RECORD_DTYPE)
+
+        records['time'] = times
+
+        records['temperature'] = temperatures
+
+        with self.lock:
+            if self.writer.ensure_open():
+                self._prepare_index()
+
+            first_position = (self.writer.tell() -
+                              SEGMENT_HEADER_SIZE) // RECORD_DTYPE.itemsize
+
+            self.writer.write(records.tobytes())
+
+            self._append_index(records['time'], first_position)
+
+            self._notify_append(records['time'], records['temperature'])
+
+    def rewrite(self, transform: Callable[[np.ndarray], np.ndarray]):
+        if self.readonly:
+            raise SegmentError(f'{self.filename} is opened read-only')
+
+        # the segment is swapped atomically; open snapshots keep mapping the old file and
+        # the writers reopen the new one on their next append
+        with self.lock:
+            records = transform(self._records.array())
+
+            temporary_filename = self.filename + '.tmp'
+
+            with open(temporary_filename, 'wb') as segment_file:
+                segment_file.write(self.writer.header)
+
+                segment_file.write(records.tobytes())
+
+                segment_file.flush()
+
+                os.fsync(segment_file.fileno())
+
+            os.replace(temporary_filename, self.filename)
+
+            self._rebuild_index()
+
+            self._notify_rewrite()
+
+    def sync(self):
+        if self.readonly:
+            return
+
+        with self.lock:
+            self.writer.sync()
+
+            self.index_writer.sync()
+
+    def query(self, start: Union[int, None] = None, end: Union[int, None] = None, limit: Union[int, None] = None,
+              cursor: Union[str, None] = None) -> Tuple[np.ndarray, np.ndarray, Union[str, None]]:
+        index, records, runs = self.snapshot()
+
+        entries, next_cursor = select_index_runs(
+            index, runs, start, end, limit, cursor)
+
+        selected = records[entries['position']]
+
+        return selected['time'], selected['temperature'], next_cursor
+
+    def query_chunks(self, start: Union[int, None] = None, end: Union[int, None] = None, limit: Union[int, None] = None,
+                     cursor: Union[str, None] = None, chunk_size: int = READ_CHUNK_SIZE) -> Tuple[Iterator[Tuple[np.ndarray, np.ndarray]], Union[str, None]]:
+        index, records, runs = self.snapshot()
+
+        entries, next_cursor = select_index_runs(
+            index, runs, start, end, limit, cursor)
+
+        # the mapped views pin a snapshot, so only one chunk of records is materialised at a time
+        positions = entries['position']
+
+        def chunks():
+            for chunk_start in range(0, len(positions), chunk_size):
+                selected = records[positions[chunk_start:chunk_start + chunk_size]]
+
+                yield selected['time'], selected['temperature']
+
+        return chunks(), next_cursor
+
+    def read(self) -> List[TemperatureData]:
+        return arrays_to_temperature_data(*self.read_arrays())
+
+    def append(self, temperature_data: Sequence[TemperatureData]):
+        self.append_arrays(*temperature_data_to_arrays(temperature_data))
+
+
+SHARD_SEPARATOR = '@'
+
+# a (time, source, position) cursor position that sorts after every entry sharing its time
+LAST_POSITION = 2 ** 62
+
+
+def get_shard_filename(directory: str, name: str, worker_id: Union[str, None], extension: str = '.seg') -> str:
+    shard_name = name if worker_id is None else f'{name}{SHARD_SEPARATOR}{worker_id}'
+
+    return os.path.join(directory, shard_name + extension)
+
+
+def find_shards(directory: str, name: str, extension: str = '.seg') -> Dict[str, str]:
+    shards = {}
+
+    for filename in os.listdir(directory):
+        if not filename.endswith(extension):
+            continue
+
+        shard_name = filename[:-len(extension)]
+
+        if shard_name == name:
+            shards[''] = os.path.join(directory, filename)
+        elif shard_name.startswith(name + SHARD_SEPARATOR):
+            shards[shard_name[len(name) + 1:]] = os.path.join(directory, filename)
+
+    return shards
+
+
+def encode_source_cursor(timestamp: int, source: str, position: int, rewrites: int) -> str:
+    return f'{timestamp}:{source}:{position}:{rewrites}'
+
+
+def decode_source_cursor(cursor: str) -> Tuple[int, str, int, int]:
+    try:
+        timestamp, source, position, rewrites = cursor.split(':')
+
+        return int(timestamp), source, int(position), int(rewrites)
+    except ValueError:
+        raise CursorError(f'Invalid cursor: {cursor}')
+
+
+def get_source_cursor(source: str, cursor: Union[Tuple[int, str, int, int], None]) -> Union[str, None]:
+    if cursor is None:
+        return None
+
+    cursor_time, cursor_source, cursor_position, _ = cursor
+
+    if source < cursor_source:
+        return encode_cursor(cursor_time, LAST_POSITION)
+
+    if source > cursor_source:
+        return encode_cursor(cursor_time, -1)
+
+    return encode_cursor(cursor_time, cursor_position)
+
+
+# (key, index, records, run starts) of one independently indexed part of a partition, keys must not contain ':'
+Source = Tuple[str, np.ndarray, np.ndarray, np.ndarray]
+
+
+class MergedTemperatureStorage(TemperatureStorage):
+    def sources(self, start: Union[int, None] = None, end: Union[int, None] = None) -> Tuple[int, List[Source]]:
+        # the sources sorted by key, with how often their positions have been renumbered by rewrites
+        raise NotImplementedError
+
+    def read(self) -> List[TemperatureData]:
+        return arrays_to_temperature_data(*self.read_arrays())
+
+    def read_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        chunks = list(self.read_chunks())
+
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        return np.concatenate([times for times, _ in chunks]), np.concatenate([temperatures for _, temperatures in chunks])
+
+    def read_chunks(self, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        return self.query_chunks(chunk_size=chunk_size)[0]
+
+    def query(self, start: Union[int, None] = None, end: Union[int, None] = None, limit: Union[int, None] = None,
+              cursor: Union[str, None] = None) -> Tuple[np.ndarray, np.ndarray, Union[str, None]]:
+        chunks, next_cursor = self.query_chunks(start, end, limit, cursor)
+
+        chunks = list(chunks)
+
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), next_cursor
+
+        return np.concatenate([times for times, _ in chunks]), np.concatenate([temperatures for _, temperatures in chunks]), next_cursor
+
+    def query_chunks(self, start: Union[int, None] = None, end: Union[int, None] = None, limit: Union[int, None] = None,
+                     cursor: Union[str, None] = None, chunk_size: int = READ_CHUNK_SIZE) -> Tuple[Iterator[Tuple[np.ndarray, np.ndarray]], Union[str, None]]:
+        decoded_cursor = None if cursor is None else decode_source_cursor(cursor)
+
+        rewrites, sources = self.sources(start, end)
+
+        # a rewrite renumbers positions, so a cursor from before it would skip or repeat rows
+        if decoded_cursor is not None and decoded_cursor[3] != rewrites:
+            raise StaleCursorError(f'Cursor {cursor} is from before a compaction, start again without cursor')
+
+        ranges = []
+
+        for source, index, records, runs in sources:
+            entries, source_next_cursor = select_index_runs(
+                index, runs, start, end, limit, get_source_cursor(source, decoded_cursor))
+
+            ranges.append((source, entries, records, source_next_cursor))
+
+        if limit is None:
+            return merge_source_ranges(ranges, chunk_size), None
+
+        # a page is bounded by limit entries per source, so it is merged eagerly to find the next cursor
+        times = np.concatenate([index['time'] for _, index, _, _ in ranges])
+
+        source_numbers = np.concatenate([np.full(len(index), number) for number, (_, index, _, _) in enumerate(ranges)])
+
+        positions = np.concatenate([index['position'] for _, index, _, _ in ranges])
+
+        order = np.lexsort((positions, source_numbers, times))[:limit]
+
+        has_more = len(times) > limit or any(
+            source_next_cursor for _, _, _, source_next_cursor in ranges)
+
+        next_cursor = None
+
+        if has_more and len(order):
+            last = order[-1]
+
+            next_cursor = encode_source_cursor(int(times[last]), ranges[source_numbers[last]][0], int(positions[last]),
+                                               rewrites)
+
+        def chunks():
+            for chunk_start in range(0, len(order), chunk_size):
+                chunk = order[chunk_start:chunk_start + chunk_size]
+
+                yield gather_source_records(ranges, source_numbers[chunk], positions[chunk])
+
+        return chunks(), next_cursor
+
+
+class ShardedTemperatureStorage(MergedTemperatureStorage):
+    def __init__(self, directory: str, name: str, worker_id: str):
+        super().__init__()
+
+        self.directory = directory
+
+        self.name = name
+
+        self.worker_id = worker_id
+
+        self.lock = threading.Lock()
+
+        self.own = BinaryTemperatureStorage(
+            get_shard_filename(directory, name, worker_id))
+
+        # own appends are forwarded as they happen, foreign ones are picked up by refresh
+        self.own.add_append_listener(self._notify_append)
+
+        self.filename = self.own.filename
+
+        self.shards: Dict[str, BinaryTemperatureStorage] = {
+            worker_id: self.own}
+
+        self._seen: Dict[str, int] = {}
+
+        self._discover_shards()
+
+    def _discover_shards(self):
+        for shard, filename in find_shards(self.directory, self.name).items():
+            if shard not in self.shards:
+                self.shards[shard] = BinaryTemperatureStorage(
+                    filename, readonly=True)
+
+                self._seen[shard] = 0
+
+    def refresh(self):
+        with self.lock:
+            self._discover_shards()
+
+            for shard, seen in self._seen.items():
+                records = self.shards[shard].read_arrays()
+
+                if len(records[0]) > seen:
+                    self._notify_append(
+                        records[0][seen:], records[1][seen:])
+
+                    self._seen[shard] = len(records[0])
+
+    def replay(self):
+        for times, temperatures in iter_array_chunks(*self.own.read_arrays()):
+            self._notify_append(times, temperatures)
+
+        self.refresh()
+
+    def append(self, temperature_data: Sequence[TemperatureData]):
+        self.own.append(temperature_data)
+
+    def append_arrays(self, times: np.ndarray, temperatures: np.ndarray):
+        self.own.append_arrays(times, temperatures)
+
+    def sync(self):
+        self.own.sync()
+
+    def sources(self, start: Union[int, None] = None, end: Union[int, None] = None) -> Tuple[int, List[Source]]:
+        with self.lock:
+            self._discover_shards()
+
+            shards = sorted(self.shards.items())
+
+        # shards are only ever appended to
+        return 0, [(shard, *storage.snapshot()) for shard, storage in shards]
+
+
+def gather_source_records(ranges: list, source_numbers: np.ndarray, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    times = np.empty(len(positions), dtype=np.int64)
+
+    temperatures = np.empty(len(positions), dtype=np.float32)
+
+    for number, (_, _, records, _) in enumerate(ranges):
+        selected = source_numbers == number
+
+        if selected.any():
+            source_records = records[positions[selected]]
+
+            times[selected] = source_records['time']
+
+            temperatures[selected] = source_records['temperature']
+
+    return times, temperatures
+
+
+def merge_source_ranges(ranges: list, chunk_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    # k-way merge in time windows: every round takes up to chunk_size entries per source,
+    # cut at the earliest source's window end so that no later round can hold an earlier time
+    pointers = [0] * len(ranges)
+
+    while True:
+        window_ends = [index['time'][min(pointer + chunk_size, len(index)) - 1]
+                       for pointer, (_, index, _, _) in zip(pointers, ranges) if pointer < len(index)]
+
+        if not window_ends:
+            return
+
+        boundary = min(window_ends)
+
+        times, source_numbers, positions = [], [], []
+
+        for number, (_, index, _, _) in enumerate(ranges):
+            pointer = pointers[number]
+
+            taken = int(np.searchsorted(
+                index['time'][pointer:], boundary, 'right'))
+
+            times.append(index['time'][pointer:pointer + taken])
+
+            source_numbers.append(np.full(taken, number))
+
+            positions.append(index['position'][pointer:pointer + taken])
+
+            pointers[number] = pointer + taken
+
+        times, source_numbers, positions = np.concatenate(
+            times), np.concatenate(source_numbers), np.concatenate(positions)
+
+        order = np.lexsort((positions, source_numbers, times))
+
+        yield gather_source_records(ranges, source_numbers[order], positions[order])
+
+
+def create_storage(backend: str = STORAGE_BACKEND, filename: Union[str, None] = None) -> TemperatureStorage:
+    if backend == 'binary':
+        return BinaryTemperatureStorage(filename or DATA_SEGMENT)
+
+    if backend == 'csv':
+        return CsvTemperatureStorage(filename or DATA_CSV)
+
+    raise ValueError(f'Unknown storage backend: {backend}')
+
+
+def import_temperature_data_from_csv(storage: TemperatureStorage, filename: str = DATA_CSV):
+    storage.append(read_temperature_data_from_csv(filename))
+
+
+def export_temperature_data_to_csv(storage: TemperatureStorage, filename: str = DATA_CSV):
+    save_temperature_data_to_csv(storage.read(), filename)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4) or sys.argv[1] not in ('import', 'export'):
+        print(f'Usage: {sys.argv[0]} import|export <csv file> [sensor id, default {DEFAULT_SENSOR_ID!r}]')
+
+        sys.exit(1)
+
+    command, csv_filename = sys.argv[1], sys.argv[2]
+
+    sensor_id = sys.argv[3] if len(sys.argv) == 4 else DEFAULT_SENSOR_ID
+
+    # the registry migrates a legacy single-file layout and includes the archives, like the server does
+    from Partitions import SensorRegistry
+
+    partition = SensorRegistry().get(sensor_id, create=command == 'import')
+
+    if partition is None:
+        print(f'Unknown sensor: {sensor_id}')
+
+        sys.exit(1)
+
+    if command == 'import':
+        import_temperature_data_from_csv(partition.storage, csv_filename)
+    else:
+        export_temperature_data_to_csv(partition.storage, csv_filename)
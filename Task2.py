@@ -2,6 +2,9 @@ from gpio import *
 from time import *
 from realhttp import RealHTTPClient
 from ioeclient import IoEClient
+from StatePublisher import setupStatePublisher, publishStates
+from SensorSampler import startTick, sampleAnalog
+from Actuators import writeDigital, writeDisplay, flushDisplays
 
 
 TIMEOUT = 1
@@ -28,9 +31,47 @@ MODE_CODE = {
 isHeating = False
 isCooling = False
 
-BATCH_LEN = 10
-temperatures_batch = []
-
+# readings wait in the outbox until the server has accepted them; beyond
+# OUTBOX_MAX_LEN the oldest are dropped and counted
+OUTBOX_MAX_LEN = 1000
+# a batch goes out once the outbox holds sendLen readings or its oldest reading is
+# sendAge seconds old, whichever comes first; it then takes up to MAX_SEND_LEN readings,
+# so a backlog after an outage is merged into few requests
+# both follow the round-trip time, so that a slow link gets fewer, larger requests;
+# the floors are the old fixed batch of 10 readings every 10 s, so no link sends more often than that
+MIN_SEND_LEN = 10
+MAX_SEND_LEN = 200
+MIN_SEND_AGE = 10
+MAX_SEND_AGE = 30
+# share of the time the link may spend waiting for answers
+LINK_BUSY_SHARE = 0.1
+# weight of the latest round trip in the running average
+RTT_SMOOTHING = 0.2
+# seconds between retries, doubled after every failure
+RETRY_MIN_DELAY = 1
+RETRY_MAX_DELAY = 60
+# a request without an answer after this many seconds counts as failed
+SEND_TIMEOUT = 30
+
+outbox = []
+outboxSince = 0
+inFlight = []
+inFlightSince = 0
+inFlightClient = None
+sendSequence = 0
+sentAt = 0
+roundTripTime = 0
+sendLen = MIN_SEND_LEN
+sendAge = MIN_SEND_AGE
+retryDelay = 0
+nextSendTime = 0
+droppedCount = 0
+
+
+# temperature changes smaller than this are not reported to the IoE server
+TEMPERATURE_DEADBAND = 0.1
+# one deadband per reported state, in the order of CONFIG's states
+STATE_DEADBANDS = [0, TEMPERATURE_DEADBAND, 0, 0]
 
 # IOeClient
 CONFIG = {
@@ -112,18 +153,23 @@ def onIoEStateSet(stateName, value):
 
 
 def IoEUpdateState():
-    IoEClient.reportStates([MODE_CODE[Mode], getTemperature(), tMax, tMin])
+    publishStates([MODE_CODE[Mode], getTemperature(), tMax, tMin])
 
 
 def IoESetup():
     IoEClient.setup(CONFIG)
     IoEClient.onStateSet(onIoEStateSet)
+    setupStatePublisher(STATE_DEADBANDS)
     IoEUpdateState()
 
 
 # ==== web
-httpClient = RealHTTPClient()
 SERVER = 'http://localhost:5000/'
+# per-device settings: every thermostat running a copy of this script must get its own SENSOR_ID
+# (letters, digits, '_', '-' and '.'), otherwise their readings end up in one partition on the server;
+# ROOM is shown next to the sensor in the server's sensor list
+SENSOR_ID = 'thermostat-1'
+ROOM = 'living-room'
 
 
 def getISO8601Date():
@@ -136,16 +182,114 @@ def getISO8601Date():
     return iso_8601_date
 
 
-def onHTTPDone(status, data, replyHeader):
+def isRetryable(status):
+    # outages and overload are retried, a rejected payload would be rejected again
+    return status <= 0 or status == 408 or status == 429 or status >= 500
+
+
+def trimOutbox():
+    global outbox
+    global droppedCount
+
+    overflow = len(outbox) - OUTBOX_MAX_LEN
+
+    if overflow > 0:
+        outbox = outbox[overflow:]
+
+        droppedCount += overflow
+
+        print("Outbox full, dropped", droppedCount, "readings so far")
+
+
+def onSendFailed(status):
+    global outbox
+    global outboxSince
+    global inFlight
+    global retryDelay
+    global nextSendTime
+    global droppedCount
+
+    if isRetryable(status):
+        # the failed readings go back in front of the newer ones, so order is kept
+        outbox = inFlight + outbox
+
+        outboxSince = inFlightSince
+
+        trimOutbox()
+
+        retryDelay = min(max(retryDelay * 2, RETRY_MIN_DELAY), RETRY_MAX_DELAY)
+
+        nextSendTime = time() + retryDelay
+
+        print("Send failed, retrying in", retryDelay, "s")
+    else:
+        droppedCount += len(inFlight)
+
+        print("Server rejected", len(inFlight), "readings")
+
+    inFlight = []
+
+
+def updateSendBudget():
+    global roundTripTime
+    global sendLen
+    global sendAge
+
+    measured = time() - sentAt
+
+    if roundTripTime:
+        roundTripTime += (measured - roundTripTime) * RTT_SMOOTHING
+    else:
+        roundTripTime = measured
+
+    # requests this far apart keep the link waiting for answers at most LINK_BUSY_SHARE of the time
+    interval = roundTripTime / LINK_BUSY_SHARE
+
+    sendAge = min(max(interval, MIN_SEND_AGE), MAX_SEND_AGE)
+
+    # and carry the readings taken in that time, one per tick
+    sendLen = int(min(max(interval / TIMEOUT, MIN_SEND_LEN), MAX_SEND_LEN))
+
+
+def printHTTPStatus(status, data, replyHeader):
     print("Status", status)
     # print(data)
-    print("Reply header", replyHeader)
 
 
-httpClient.onDone(onHTTPDone)
+def onHTTPDone(sequence, status, data, replyHeader):
+    global inFlight
+    global inFlightClient
+    global retryDelay
+
+    printHTTPStatus(status, data, replyHeader)
+
+    # a late reply to a request that timed out must not settle the one sent after it
+    if sequence != sendSequence or not inFlight:
+        print("Ignoring reply to request", sequence)
+
+        return
+
+    inFlightClient = None
+
+    if 200 <= status < 300:
+        inFlight = []
+
+        retryDelay = 0
 
+        updateSendBudget()
+
+        # a backlog is sent as fast as the server answers, not one batch per tick
+        flushOutbox()
+    else:
+        onSendFailed(status)
+
+
+def sendToServer(route, data, onDone=printHTTPStatus):
+    # a client per request, so every reply arrives at the callback of its own request
+    httpClient = RealHTTPClient()
+
+    httpClient.onDone(onDone)
 
-def sendToServer(route, data):
     httpClient.postWithHeader(
         SERVER + route,
         data,
@@ -154,11 +298,15 @@ def sendToServer(route, data):
         }
     )
 
+    return httpClient
+
 
 def sendTemperatureDataToServer(t):
     temperature_data = {
         "temperature": t,
-        "time": getISO8601Date()
+        "time": getISO8601Date(),
+        "sensor_id": SENSOR_ID,
+        "room": ROOM
     }
 
     sendToServer({
@@ -166,28 +314,69 @@ def sendTemperatureDataToServer(t):
     })
 
 
+def flushOutbox():
+    global outbox
+    global inFlight
+    global inFlightSince
+    global inFlightClient
+    global sendSequence
+    global sentAt
+
+    # one request at a time; an unanswered one is given up after SEND_TIMEOUT
+    if inFlight:
+        if time() - sentAt < SEND_TIMEOUT:
+            return
+
+        onSendFailed(0)
+
+    if not outbox or time() < nextSendTime:
+        return
+
+    if len(outbox) < sendLen and time() - outboxSince < sendAge:
+        return
+
+    inFlight = outbox[:MAX_SEND_LEN]
+
+    # readings left behind keep the age of the oldest, so a backlog goes out without waiting
+    inFlightSince = outboxSince
+
+    outbox = outbox[MAX_SEND_LEN:]
+
+    sentAt = time()
+
+    sendSequence += 1
+
+    sequence = sendSequence
+
+    inFlightClient = sendToServer('batch', {
+        "temperatures_batch": inFlight
+    }, lambda status, data, replyHeader: onHTTPDone(sequence, status, data, replyHeader))
+
+
 def sendTemperaturesDataToServer(t):
-    global temperatures_batch
+    global outboxSince
 
     temperature_data = {
         "temperature": t,
-        "time": getISO8601Date()
+        "time": getISO8601Date(),
+        "sensor_id": SENSOR_ID,
+        "room": ROOM
     }
 
-    temperatures_batch.append(temperature_data)
+    if not outbox:
+        outboxSince = time()
+
+    outbox.append(temperature_data)
 
-    if len(temperatures_batch) == BATCH_LEN:
-        sendToServer('batch', {
-            "temperatures_batch": temperatures_batch
-        })
+    trimOutbox()
 
-        temperatures_batch = []
+    flushOutbox()
 
 # ==== iot
 
 
 def showMessage(message):
-    customWrite(DISPLAY_PIN, message)
+    writeDisplay(DISPLAY_PIN, message)
     print(message)
 
 
@@ -196,19 +385,19 @@ def temperatureToCelsius(t):
 
 
 def getTemperature():
-    t = analogRead(TEMPERATURE_PIN)
+    t = sampleAnalog(TEMPERATURE_PIN)
     return temperatureToCelsius(t)
 
 
 def turnOnHeating():
     global isHeating
-    digitalWrite(HAETING_PIN, HIGH)
+    writeDigital(HAETING_PIN, HIGH)
     isHeating = True
 
 
 def turnOffHeating():
     global isHeating
-    digitalWrite(HAETING_PIN, LOW)
+    writeDigital(HAETING_PIN, LOW)
     isHeating = False
 
 
@@ -223,13 +412,13 @@ def heatingControl(t):
 
 def turnOnCooling():
     global isCooling
-    digitalWrite(COOLING_PIN, HIGH)
+    writeDigital(COOLING_PIN, HIGH)
     isCooling = True
 
 
 def turnOffCooling():
     global isCooling
-    digitalWrite(COOLING_PIN, LOW)
+    writeDigital(COOLING_PIN, LOW)
     isCooling = False
 
 
@@ -250,6 +439,7 @@ def init():
 
 def main():
     while True:
+        startTick()
         t = getTemperature()
         if Mode == "Auto":
             showMessage(str(t)+" C")
@@ -257,6 +447,7 @@ def main():
             coolingControl(t)
         IoEUpdateState()
         sendTemperaturesDataToServer(t)
+        flushDisplays()
         sleep(TIMEOUT)
 
 
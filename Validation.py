@@ -0,0 +1,180 @@
+import math
+import os
+import re
+from rfc3339_validator import validate_rfc3339
+from typing import Any, Callable, Tuple, Union
+from jsonschema import validate, validators, FormatChecker, ValidationError
+from Storage import DEFAULT_SENSOR_ID, SENSOR_ID_PATTERN
+
+FAST_VALIDATION = os.environ.get('TEMPERATURE_FAST_VALIDATION', '1') == '1'
+
+ValidationResult = Tuple[bool, Union[str, None]]
+
+Validator = Callable[[Any], ValidationResult]
+
+sensor_id_matcher = re.compile(SENSOR_ID_PATTERN)
+
+
+def is_finite_number(value) -> bool:
+    # NaN and Infinity are valid JSON numbers to Python, but one of them would poison a sensor's statistics
+    try:
+        return math.isfinite(value)
+    except OverflowError:
+        return False
+
+
+format_checker = FormatChecker()
+
+format_checker.checks('finite')(
+    lambda value: type(value) is not float and type(value) is not int or is_finite_number(value))
+
+temperatureDataSchema = {
+    'type': 'object',
+    'properties': {
+            'temperature': {'type': 'number', 'format': 'finite'},
+            'time': {'type': 'string', 'format': 'date-time', "format_checker": validate_rfc3339},
+            'sensor_id': {'type': 'string', 'pattern': SENSOR_ID_PATTERN},
+            'room': {'type': 'string'}
+    },
+    'required': ['temperature', 'time']
+}
+
+temperatureDataRequestSchema = {
+    'type': 'object',
+    'properties': {
+        'temperature_data': temperatureDataSchema
+    },
+    'required': ['temperature_data']
+}
+
+temperatureDataBatchSchema = {
+    'type': 'object',
+    'properties': {
+        'temperatures_batch': {
+            'type': 'array',
+            'items': temperatureDataSchema
+        }
+    },
+    'required': ['temperatures_batch']
+}
+
+
+def validate_json(data, schema):
+    try:
+        validate(data, schema)
+
+        return True, None
+    except ValidationError as e:
+        return False, e.message
+
+
+def compile_schema(schema) -> Validator:
+    validator_class = validators.validator_for(schema)
+
+    validator_class.check_schema(schema)
+
+    validator = validator_class(schema, format_checker=format_checker)
+
+    def validate_compiled(data) -> ValidationResult:
+        error = next(validator.iter_errors(data), None)
+
+        return (True, None) if error is None else (False, error.message)
+
+    return validate_compiled
+
+
+def validate_temperature_data(data) -> ValidationResult:
+    # mirrors temperatureDataSchema; bool is excluded from numbers just like in JSON Schema
+    if type(data) is not dict:
+        return False, f'{data!r} is not of type \'object\''
+
+    if 'temperature' not in data:
+        return False, '\'temperature\' is a required property'
+
+    if 'time' not in data:
+        return False, '\'time\' is a required property'
+
+    temperature, time = data['temperature'], data['time']
+
+    if type(temperature) is not float and type(temperature) is not int:
+        return False, f'{temperature!r} is not of type \'number\''
+
+    if not is_finite_number(temperature):
+        return False, f'{temperature!r} is not a finite number'
+
+    if type(time) is not str:
+        return False, f'{time!r} is not of type \'string\''
+
+    if not validate_rfc3339(time):
+        return False, f'{time!r} is not a \'date-time\''
+
+    if 'sensor_id' in data:
+        sensor_id = data['sensor_id']
+
+        if type(sensor_id) is not str:
+            return False, f'{sensor_id!r} is not of type \'string\''
+
+        if not sensor_id_matcher.match(sensor_id):
+            return False, f'{sensor_id!r} does not match {SENSOR_ID_PATTERN!r}'
+
+    if 'room' in data and type(data['room']) is not str:
+        return False, f'{data["room"]!r} is not of type \'string\''
+
+    return True, None
+
+
+def validate_temperature_data_request(data) -> ValidationResult:
+    if type(data) is not dict:
+        return False, f'{data!r} is not of type \'object\''
+
+    if 'temperature_data' not in data:
+        return False, '\'temperature_data\' is a required property'
+
+    return validate_temperature_data(data['temperature_data'])
+
+
+def validate_temperature_data_batch(data) -> ValidationResult:
+    if type(data) is not dict:
+        return False, f'{data!r} is not of type \'object\''
+
+    if 'temperatures_batch' not in data:
+        return False, '\'temperatures_batch\' is a required property'
+
+    temperatures_batch = data['temperatures_batch']
+
+    if type(temperatures_batch) is not list:
+        return False, f'{temperatures_batch!r} is not of type \'array\''
+
+    for el in temperatures_batch:
+        # the common, valid case is handled inline without a function call per reading
+        if type(el) is dict:
+            temperature, time = el.get('temperature'), el.get('time')
+
+            sensor_id, room = el.get(
+                'sensor_id', DEFAULT_SENSOR_ID), el.get('room', '')
+
+            if (type(temperature) is float or type(temperature) is int) and is_finite_number(temperature) \
+                    and type(time) is str and validate_rfc3339(time) \
+                    and type(sensor_id) is str and sensor_id_matcher.match(sensor_id) and type(room) is str:
+                continue
+
+        is_valid, error_message = validate_temperature_data(el)
+
+        if not is_valid:
+            return is_valid, error_message
+
+    return True, None
+
+
+FAST_VALIDATORS = {
+    id(temperatureDataSchema): validate_temperature_data,
+    id(temperatureDataRequestSchema): validate_temperature_data_request,
+    id(temperatureDataBatchSchema): validate_temperature_data_batch
+}
+
+
+def get_validator(schema, fast: bool = FAST_VALIDATION) -> Validator:
+    if fast and id(schema) in FAST_VALIDATORS:
+        return FAST_VALIDATORS[id(schema)]
+
+    return compile_schema(schema)
@@ -0,0 +1,69 @@
+import json
+import sys
+import time
+from typing import List
+import numpy as np
+from Compression import COMPRESSORS, DECOMPRESSORS
+from Storage import MICROSECONDS_PER_SECOND, arrays_to_temperature_data, iter_array_chunks
+
+READINGS = (10 ** 4, 10 ** 6)
+LEVELS = {
+    'gzip': (1, 6, 9),
+    'zstd': (1, 3, 10)
+}
+REPEATS = 3
+
+
+def make_chunks(size: int) -> List[bytes]:
+    # one-second readings of a slowly drifting temperature, like a real sensor's history
+    times = (1_792_000_000 + np.arange(size, dtype=np.int64)) * MICROSECONDS_PER_SECOND
+
+    temperatures = (21 + np.round(np.sin(np.arange(size) / 600) * 2, 1)).astype(np.float32)
+
+    # the same chunking as a streamed GET / response
+    return [json.dumps(arrays_to_temperature_data(*chunk)).encode() for chunk in iter_array_chunks(times, temperatures)]
+
+
+def measure(chunks: List[bytes], encoding: str, level: int):
+    best_compress, best_decompress, compressed = float('inf'), float('inf'), b''
+
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+
+        compressor = COMPRESSORS[encoding](level)
+
+        compressed = b''.join([compressor.compress(chunk) for chunk in chunks] + [compressor.flush()])
+
+        best_compress = min(best_compress, time.perf_counter() - started)
+
+        started = time.perf_counter()
+
+        DECOMPRESSORS[encoding](compressed, 1 << 40)
+
+        best_decompress = min(best_decompress, time.perf_counter() - started)
+
+    return len(compressed), best_compress, best_decompress
+
+
+def main():
+    encodings = [encoding for encoding in LEVELS if encoding in COMPRESSORS]
+
+    print(f'{"readings":>10} {"encoding":>10} {"level":>6} {"bytes":>12} {"ratio":>7} {"compress":>12} {"decompress":>12}')
+
+    for size in READINGS:
+        chunks = make_chunks(size)
+
+        raw_size = sum(len(chunk) for chunk in chunks)
+
+        print(f'{size:>10} {"identity":>10} {"":>6} {raw_size:>12}')
+
+        for encoding in encodings:
+            for level in LEVELS[encoding]:
+                compressed_size, compress_time, decompress_time = measure(chunks, encoding, level)
+
+                print(f'{size:>10} {encoding:>10} {level:>6} {compressed_size:>12} {raw_size / compressed_size:>6.1f}x '
+                      f'{raw_size / compress_time / 1e6:>7.0f} MB/s {raw_size / decompress_time / 1e6:>7.0f} MB/s')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+import numpy as np
+from BatchFormat import BATCH_MIMETYPE, encode_batch
+from Storage import MICROSECONDS_PER_SECOND
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    'flask': ([sys.executable, os.path.join(ROOT, 'Server.py')], 5000),
+    'asgi': ([sys.executable, os.path.join(ROOT, 'AsyncServer.py')], 8000),
+    'multi': ([sys.executable, os.path.join(ROOT, 'MultiWorkerServer.py')], 8000)
+}
+
+BATCH_LEN = 10
+
+
+def make_batch(client: int, sequence: int, batch_format: str) -> Tuple[bytes, str]:
+    base = 1_700_000_000 + sequence * BATCH_LEN
+
+    if batch_format == 'binary':
+        return encode_batch((base + np.arange(BATCH_LEN, dtype=np.int64)) * MICROSECONDS_PER_SECOND, 20 + (np.arange(BATCH_LEN) % 5) * 0.1,
+                            f'device-{client}'), BATCH_MIMETYPE
+
+    return json.dumps({'temperatures_batch': [{
+        'temperature': 20 + (i % 5) * 0.1,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(base + i)),
+        'sensor_id': f'device-{client}'
+    } for i in range(BATCH_LEN)]}).encode(), 'application/json'
+
+
+def wait_for_port(port: int, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError(f'Server did not start on port {port}')
+
+
+def run_client(port: int, client: int, deadline: float, batch_format: str, latencies: List[float], errors: List[int]):
+    # one keep-alive connection per simulated device, like a long-running thermostat
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+
+    sequence = 0
+
+    while time.monotonic() < deadline:
+        body, content_type = make_batch(client, sequence, batch_format)
+
+        started = time.perf_counter()
+
+        try:
+            connection.request('POST', '/batch', body,
+                               {'Content-Type': content_type})
+
+            response = connection.getresponse()
+
+            response.read()
+
+            if response.status != 200:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException):
+            errors.append(0)
+
+            connection.close()
+
+            connection = http.client.HTTPConnection('127.0.0.1', port)
+
+            continue
+
+        latencies.append(time.perf_counter() - started)
+
+        sequence += 1
+
+    connection.close()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float('nan')
+
+
+def run_target(name: str, clients: int, duration: float, batch_format: str) -> Dict[str, float]:
+    command, port = TARGETS[name]
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = subprocess.Popen(command, cwd=directory, env=dict(os.environ, PYTHONPATH=ROOT),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        try:
+            wait_for_port(port)
+
+            latencies: List[float] = []
+
+            errors: List[int] = []
+
+            deadline = time.monotonic() + duration
+
+            threads = [threading.Thread(target=run_client, args=(port, client, deadline, batch_format, latencies, errors))
+                       for client in range(clients)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+        finally:
+            server.terminate()
+
+            server.wait()
+
+    return {
+        'requests_per_second': len(latencies) / duration,
+        'rows_per_second': len(latencies) * BATCH_LEN / duration,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': len(errors)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare /batch ingest throughput of the Flask, ASGI and multi-worker servers')
+
+    parser.add_argument('--target', choices=[*TARGETS, 'all'], default='all')
+
+    parser.add_argument('--clients', type=int, default=50)
+
+    parser.add_argument('--duration', type=float, default=10)
+
+    parser.add_argument('--format', choices=('json', 'binary'), default='json')
+
+    args = parser.parse_args()
+
+    targets = list(TARGETS) if args.target == 'all' else [args.target]
+
+    for target in targets:
+        result = run_target(target, args.clients, args.duration, args.format)
+
+        print(f'{target:>6}: {result["requests_per_second"]:.0f} req/s, {result["rows_per_second"]:.0f} rows/s, '
+              f'p50 {result["p50_ms"]:.1f} ms, p99 {result["p99_ms"]:.1f} ms, {result["errors"]} errors')
+
+
+if __name__ == "__main__":
+    main()
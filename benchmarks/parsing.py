@@ -0,0 +1,55 @@
+import sys
+import time
+from datetime import datetime
+from typing import Callable, List
+from Storage import format_time, format_times, parse_time, parse_times
+
+SIZES = (10, 10 ** 3, 10 ** 5)
+
+
+def legacy_parse_time(value: str) -> float:
+    # the float-seconds parse_time ingest used before times became integer microseconds
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def measure(function: Callable[[], object], repeats: int) -> float:
+    best = float('inf')
+
+    for _ in range(repeats):
+        started = time.perf_counter()
+
+        function()
+
+        best = min(best, time.perf_counter() - started)
+
+    return best
+
+
+def make_times(size: int) -> List[str]:
+    # the %Y-%m-%dT%H:%M:%SZ form getISO8601Date in Task2.py sends
+    return [time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1_792_000_000 + second)) for second in range(size)]
+
+
+def main():
+    print(f'{"readings":>10} {"legacy":>14} {"per value":>14} {"batch":>14} {"format each":>14} {"format batch":>14}')
+
+    for size in SIZES:
+        values = make_times(size)
+
+        timestamps = parse_times(values)
+
+        repeats = 5
+
+        timings = [
+            measure(lambda: [legacy_parse_time(value) for value in values], repeats),
+            measure(lambda: [parse_time(value) for value in values], repeats),
+            measure(lambda: parse_times(values), repeats),
+            measure(lambda: [format_time(timestamp) for timestamp in timestamps.tolist()], repeats),
+            measure(lambda: format_times(timestamps), repeats)
+        ]
+
+        print(f'{size:>10} ' + ' '.join(f'{timing * 1000:>11.2f} ms' for timing in timings))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+import sys
+import time
+from typing import Callable, List, Sequence
+import numpy as np
+from ArrayStatistics import as_float_array, grouped_median_sigma, grouped_moments, mean_variance, median_sigma
+
+SIZES = (10 ** 3, 10 ** 5, 10 ** 7)
+SENSORS = 100
+
+
+def legacy_sigma(data: Sequence[float]) -> float:
+    # the list-based mean, variance and sigma the server computed before the array statistics
+    mean = sum(data) / len(data)
+
+    variance = sum([(value - mean) ** 2 for value in data]) / len(data)
+
+    return variance ** 0.5
+
+
+def measure(function: Callable[[], object], repeats: int) -> float:
+    best = float('inf')
+
+    for _ in range(repeats):
+        started = time.perf_counter()
+
+        function()
+
+        best = min(best, time.perf_counter() - started)
+
+    return best
+
+
+def per_sensor(values: np.ndarray, groups: np.ndarray, statistic: Callable[[np.ndarray], object]) -> List[object]:
+    return [statistic(values[groups == group]) for group in range(SENSORS)]
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    print(f'{"readings":>10} {"legacy sigma":>14} {"from list":>14} {"from array":>14} {"median/MAD":>14} '
+          f'{"moments x" + str(SENSORS):>14} {"grouped":>14} {"MAD x" + str(SENSORS):>14} {"grouped":>14}')
+
+    for size in SIZES:
+        values = rng.normal(21, 0.5, size)
+
+        data = values.tolist()
+
+        groups = rng.integers(0, SENSORS, size)
+
+        repeats = 1 if size >= 10 ** 7 else 5
+
+        timings = [
+            measure(lambda: legacy_sigma(data), repeats),
+            measure(lambda: mean_variance(as_float_array(data))[1] ** 0.5, repeats),
+            measure(lambda: mean_variance(values)[1] ** 0.5, repeats),
+            measure(lambda: median_sigma(values), repeats),
+            measure(lambda: per_sensor(values, groups, mean_variance), repeats),
+            measure(lambda: grouped_moments(values, groups, SENSORS), repeats),
+            measure(lambda: per_sensor(values, groups, median_sigma), repeats),
+            measure(lambda: grouped_median_sigma(values, groups, SENSORS), repeats)
+        ]
+
+        print(f'{size:>10} ' + ' '.join(f'{timing * 1000:>11.2f} ms' for timing in timings))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Tuple, Union
+import numpy as np
+from benchmarks.load import BATCH_LEN, ROOT, TARGETS, percentile, wait_for_port
+from Storage import DATA_DIRECTORY, DEFAULT_SENSOR_ID, MICROSECONDS_PER_SECOND, BinaryTemperatureStorage, get_shard_filename
+
+MODES = ('inprocess', 'socket')
+
+# stored history sizes every scenario is measured at
+HISTORY_SIZES = (10 ** 3, 10 ** 5, 10 ** 7)
+PRELOAD_CHUNK = 10 ** 6
+
+# reading all of a larger history per request measures the response size, not the server
+FULL_READ_LIMIT = 10 ** 5
+
+PAGE_LIMIT = 1000
+RECENT_SECONDS = 5 * 60
+
+# method, path, body and content type
+Request = Tuple[str, str, Union[bytes, None], Union[str, None]]
+
+
+def get_iso_date(timestamp: float) -> str:
+    # the form getISO8601Date in Task2.py produces
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def make_reading(timestamp: float) -> dict:
+    return {'temperature': round(21 + np.sin(timestamp / 600) * 2, 1), 'time': get_iso_date(timestamp)}
+
+
+def post_single() -> Request:
+    body = json.dumps({'temperature_data': make_reading(time.time())}).encode()
+
+    return 'POST', '/', body, 'application/json'
+
+
+def post_batch() -> Request:
+    # what a Task2.py device sends once its batch of BATCH_LEN one-second readings is full
+    now = time.time()
+
+    body = json.dumps({'temperatures_batch': [make_reading(now - BATCH_LEN + 1 + i)
+                                              for i in range(BATCH_LEN)]}).encode()
+
+    return 'POST', '/batch', body, 'application/json'
+
+
+def get_recent() -> Request:
+    return 'GET', f'/?from={get_iso_date(time.time() - RECENT_SECONDS)}', None, None
+
+
+def get_page() -> Request:
+    return 'GET', f'/?limit={PAGE_LIMIT}', None, None
+
+
+def get_full() -> Request:
+    return 'GET', '/', None, None
+
+
+SCENARIOS: Dict[str, Callable[[], Request]] = {
+    'POST /': post_single,
+    'POST /batch': post_batch,
+    'GET / recent': get_recent,
+    'GET / page': get_page,
+    'GET / full': get_full
+}
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method: str, path: str, body: Union[bytes, None], content_type: Union[str, None]) -> Tuple[int, bytes]:
+        response = self.client.open(
+            path, method=method, data=body, content_type=content_type)
+
+        return response.status_code, response.get_data()
+
+    def close(self):
+        pass
+
+
+class SocketClient:
+    def __init__(self, port: int):
+        self.port = port
+
+        # one keep-alive connection per device, like a long-running thermostat
+        self.connection = http.client.HTTPConnection('127.0.0.1', port)
+
+    def request(self, method: str, path: str, body: Union[bytes, None], content_type: Union[str, None]) -> Tuple[int, bytes]:
+        try:
+            self.connection.request(method, path, body, {
+                                    'Content-Type': content_type} if content_type else {})
+
+            response = self.connection.getresponse()
+
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+
+            return 0, b''
+
+    def close(self):
+        self.connection.close()
+
+
+def preload(directory: str, history: int):
+    # one reading per second up to now, written straight to the default sensor's segment in time order
+    data_directory = os.path.join(directory, DATA_DIRECTORY)
+
+    os.makedirs(data_directory)
+
+    storage = BinaryTemperatureStorage(get_shard_filename(data_directory, DEFAULT_SENSOR_ID, None))
+
+    end = (int(time.time()) - RECENT_SECONDS) * MICROSECONDS_PER_SECOND
+
+    for chunk_start in range(0, history, PRELOAD_CHUNK):
+        seconds = np.arange(chunk_start, min(chunk_start + PRELOAD_CHUNK, history), dtype=np.int64)
+
+        times = end - (history - seconds) * MICROSECONDS_PER_SECOND
+
+        temperatures = (21 + np.sin(seconds / 600) * 2).astype(np.float32)
+
+        storage.append_arrays(times, temperatures)
+
+    storage.sync()
+
+    storage.writer.close()
+
+    storage.index_writer.close()
+
+
+def run_device(client, scenario: Callable[[], Request], deadline: float, rate: float,
+               latencies: List[float], rows: List[int], errors: List[int]):
+    interval = 1 / rate if rate else 0
+
+    next_send = time.monotonic()
+
+    while time.monotonic() < deadline:
+        if interval:
+            time.sleep(max(0.0, next_send - time.monotonic()))
+
+            next_send += interval
+
+        method, path, body, content_type = scenario()
+
+        started = time.perf_counter()
+
+        status, response_body = client.request(method, path, body, content_type)
+
+        elapsed = time.perf_counter() - started
+
+        if status != 200:
+            errors.append(status)
+
+            continue
+
+        latencies.append(elapsed)
+
+        # every route answers with the readings it accepted or served
+        rows.append(response_body.count(b'"time"'))
+
+    client.close()
+
+
+def run_scenario(make_client: Callable[[], object], name: str, history: int, devices: int, duration: float,
+                 rate: float) -> dict:
+    latencies: List[float] = []
+
+    rows: List[int] = []
+
+    errors: List[int] = []
+
+    deadline = time.monotonic() + duration
+
+    threads = [threading.Thread(target=run_device, args=(make_client(), SCENARIOS[name], deadline, rate,
+                                                         latencies, rows, errors))
+               for _ in range(devices)]
+
+    started = time.monotonic()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - started
+
+    return {
+        'scenario': name,
+        'history': history,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': len(latencies) / elapsed,
+        'rows_per_second': sum(rows) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000
+    }
+
+
+def warm_up(client):
+    # partitions are opened (and their history replayed) on first use, which is startup cost, not request latency
+    status, _ = client.request('GET', '/?limit=1', None, None)
+
+    client.close()
+
+    if status != 200:
+        raise RuntimeError(f'Warm-up request failed with status {status}')
+
+
+def get_scenarios(history: int) -> List[str]:
+    return [name for name in SCENARIOS if name != 'GET / full' or history <= FULL_READ_LIMIT]
+
+
+def run_in_process(directory: str, history: int, devices: int, duration: float, rate: float) -> List[dict]:
+    # runs in a fresh interpreter, so the module-level registry of Server opens this run's data directory
+    os.chdir(directory)
+
+    sys.path.insert(0, ROOT)
+
+    import Server
+
+    warm_up(InProcessClient(Server.app))
+
+    results = [run_scenario(lambda: InProcessClient(Server.app), name, history, devices, duration, rate)
+               for name in get_scenarios(history)]
+
+    Server.commit_queue.close()
+
+    return results
+
+
+def run_over_socket(directory: str, history: int, devices: int, duration: float, rate: float) -> List[dict]:
+    command, port = TARGETS['flask']
+
+    server = subprocess.Popen(command, cwd=directory, env=dict(os.environ, PYTHONPATH=ROOT),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        wait_for_port(port)
+
+        warm_up(SocketClient(port))
+
+        return [run_scenario(lambda: SocketClient(port), name, history, devices, duration, rate)
+                for name in get_scenarios(history)]
+    finally:
+        server.terminate()
+
+        server.wait()
+
+
+def run_mode(mode: str, history: int, devices: int, duration: float, rate: float) -> List[dict]:
+    with tempfile.TemporaryDirectory() as directory:
+        preload(directory, history)
+
+        if mode == 'socket':
+            results = run_over_socket(directory, history, devices, duration, rate)
+        else:
+            with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as executor:
+                results = executor.submit(run_in_process, directory, history, devices, duration, rate).result()
+
+    return [{'mode': mode, **result} for result in results]
+
+
+def get_commit() -> Union[str, None]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_result_key(result: dict) -> Tuple[str, int, str]:
+    return result['mode'], result['history'], result['scenario']
+
+
+def print_result(result: dict, baseline: Union[dict, None] = None):
+    line = (f'{result["mode"]:>10} {result["history"]:>10} {result["scenario"]:>14} {result["requests_per_second"]:>9.0f} '
+            f'{result["rows_per_second"]:>11.0f} {result["p50_ms"]:>9.2f} {result["p99_ms"]:>9.2f} {result["errors"]:>6}')
+
+    if baseline is not None:
+        changes = [(result[name] / baseline[name] - 1) * 100 if baseline[name] else float('nan')
+                   for name in ('rows_per_second', 'p50_ms', 'p99_ms')]
+
+        line += ' ' + ' '.join(f'{change:>+8.1f}%' for change in changes)
+
+    print(line, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure latency and throughput of Server.py as its stored history grows')
+
+    parser.add_argument('--mode', choices=[*MODES, 'all'], default='all')
+
+    parser.add_argument('--history', type=float, nargs='+', default=HISTORY_SIZES,
+                        help='stored readings before each run, e.g. 1e3 1e5 1e7')
+
+    parser.add_argument('--devices', type=int, default=10,
+                        help='simulated devices sending concurrently')
+
+    parser.add_argument('--rate', type=float, default=0,
+                        help='requests per second per device, 0 sends back to back')
+
+    parser.add_argument('--duration', type=float, default=5,
+                        help='seconds per scenario')
+
+    parser.add_argument('--output', default='benchmark-report.json')
+
+    parser.add_argument('--compare', help='an earlier report to print changes against')
+
+    args = parser.parse_args()
+
+    baselines = {}
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baselines = {get_result_key(result): result for result in json.load(baseline_file)['results']}
+
+    modes = list(MODES) if args.mode == 'all' else [args.mode]
+
+    print(f'{"mode":>10} {"history":>10} {"scenario":>14} {"req/s":>9} {"rows/s":>11} {"p50 ms":>9} {"p99 ms":>9} {"errors":>6}'
+          + (f' {"rows/s":>9} {"p50":>9} {"p99":>9}' if baselines else ''))
+
+    results = []
+
+    for history in [int(size) for size in args.history]:
+        for mode in modes:
+            for result in run_mode(mode, history, args.devices, args.duration, args.rate):
+                print_result(result, baselines.get(get_result_key(result)))
+
+                results.append(result)
+
+    report = {
+        'commit': get_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': {'devices': args.devices, 'rate': args.rate, 'duration': args.duration, 'batch_len': BATCH_LEN},
+        'results': results
+    }
+
+    with open(args.output, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
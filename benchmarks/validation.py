@@ -0,0 +1,51 @@
+import random
+import sys
+import time
+from Validation import compile_schema, validate_json, validate_temperature_data_batch, temperatureDataBatchSchema
+
+BATCH_SIZES = (10, 1000, 10000)
+REPEATS = 5
+
+
+def make_batch(size: int) -> dict:
+    return {'temperatures_batch': [{'temperature': round(random.uniform(15, 30), 2),
+                                    'time': '2026-10-18T10:%02d:%02dZ' % (i // 60 % 60, i % 60)} for i in range(size)]}
+
+
+def measure(validator, data) -> float:
+    best = float('inf')
+
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+
+        is_valid, error_message = validator(data)
+
+        best = min(best, time.perf_counter() - started)
+
+        assert is_valid, error_message
+
+    return best
+
+
+def main():
+    compiled = compile_schema(temperatureDataBatchSchema)
+
+    validators = [
+        ('jsonschema.validate', lambda data: validate_json(
+            data, temperatureDataBatchSchema)),
+        ('compiled', compiled),
+        ('fast path', validate_temperature_data_batch)
+    ]
+
+    print(f'{"batch":>8} ' + ' '.join(f'{name:>22}' for name, _ in validators))
+
+    for size in BATCH_SIZES:
+        data = make_batch(size)
+
+        timings = [measure(validator, data) for _, validator in validators]
+
+        print(f'{size:>8} ' + ' '.join(f'{timing * 1000:>19.3f} ms' for timing in timings))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
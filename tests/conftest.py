@@ -0,0 +1,44 @@
+import os
+import sys
+import numpy as np
+
+# the modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Compaction import DAY, ArchivedTemperatureStorage, get_archive_directory  # noqa: E402
+from Storage import MICROSECONDS_PER_SECOND, BinaryTemperatureStorage, ShardedTemperatureStorage, get_shard_filename  # noqa: E402
+
+
+def open_segment(directory) -> BinaryTemperatureStorage:
+    return BinaryTemperatureStorage(get_shard_filename(str(directory), 'sensor', None))
+
+
+def make_storage(directory) -> ArchivedTemperatureStorage:
+    return ArchivedTemperatureStorage(open_segment(directory))
+
+
+def make_worker_storage(directory, worker_id: str) -> ArchivedTemperatureStorage:
+    return ArchivedTemperatureStorage(ShardedTemperatureStorage(str(directory), 'sensor', worker_id),
+                                      get_archive_directory(get_shard_filename(str(directory), 'sensor', None)))
+
+
+def append_days(storage, days: np.ndarray, per_day: int = 4) -> np.ndarray:
+    seconds = np.tile(np.arange(per_day), len(days)) * MICROSECONDS_PER_SECOND
+
+    times = (np.repeat(days, per_day) * DAY + seconds).astype(np.int64)
+
+    storage.append_arrays(times, np.arange(len(times), dtype=np.float32))
+
+    return times
+
+
+def read_pages(storage, limit: int, **kwargs) -> np.ndarray:
+    pages, cursor = [], None
+
+    while True:
+        times, _, cursor = storage.query(limit=limit, cursor=cursor, **kwargs)
+
+        pages.append(times)
+
+        if cursor is None:
+            return np.concatenate(pages)
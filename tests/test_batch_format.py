@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from BatchFormat import BATCH_HEADER, BATCH_MAGIC, BATCH_VERSION, MAX_BASE, BatchFormatError, decode_batch, encode_batch
+from Storage import DEFAULT_SENSOR_ID
+
+TIMES = np.array([1_700_000_000_000_000, 1_700_000_001_500_000], dtype=np.int64)
+TEMPERATURES = np.array([20.5, 21], dtype=np.float32)
+
+
+def test_round_trip():
+    sensor_id, times, temperatures = decode_batch(encode_batch(TIMES, TEMPERATURES, 'kitchen'))
+
+    assert sensor_id == 'kitchen'
+
+    assert np.array_equal(times, TIMES)
+
+    assert np.array_equal(temperatures, TEMPERATURES)
+
+
+def test_empty_sensor_id_is_the_default_sensor():
+    assert decode_batch(encode_batch(TIMES, TEMPERATURES, ''))[0] == DEFAULT_SENSOR_ID
+
+
+def replace_header(body: bytes, **fields) -> bytes:
+    header = dict(zip(('magic', 'version', 'sensor_id_length', 'base', 'count'), BATCH_HEADER.unpack_from(body)))
+
+    header.update(fields)
+
+    return BATCH_HEADER.pack(*header.values()) + body[BATCH_HEADER.size:]
+
+
+@pytest.mark.parametrize('body, message', [
+    (b'TBAT', 'shorter than its header'),
+    (replace_header(encode_batch(TIMES, TEMPERATURES), magic=b'JSON'), 'Not a version'),
+    (replace_header(encode_batch(TIMES, TEMPERATURES), version=BATCH_VERSION + 1), 'Not a version'),
+    (encode_batch(TIMES, TEMPERATURES)[:-1], 'does not match its reading count'),
+    (encode_batch(TIMES, TEMPERATURES) + b'\0', 'does not match its reading count'),
+    (replace_header(encode_batch(TIMES, TEMPERATURES), count=3), 'does not match its reading count'),
+    (BATCH_HEADER.pack(BATCH_MAGIC, BATCH_VERSION, 1, 0, 0) + b'\xff', 'not valid UTF-8'),
+    (encode_batch(TIMES, np.array([20, np.nan], dtype=np.float32)), 'finite'),
+    (encode_batch(TIMES, np.array([np.inf, 20], dtype=np.float32)), 'finite'),
+    (replace_header(encode_batch(TIMES, TEMPERATURES), base=2 ** 62), 'Base time'),
+    (replace_header(encode_batch(TIMES, TEMPERATURES), base=10 ** 13), 'Base time'),
+    (replace_header(encode_batch(TIMES, TEMPERATURES), base=-10 ** 13), 'Base time'),
+    (replace_header(encode_batch(TIMES, TEMPERATURES), base=MAX_BASE), 'Times must lie')
+])
+def test_malformed_batches_are_rejected(body, message):
+    with pytest.raises(BatchFormatError, match=message):
+        decode_batch(body)
+
+
+def test_batch_spanning_too_long_is_not_encoded():
+    with pytest.raises(BatchFormatError):
+        encode_batch(np.array([0, 25 * 24 * 3600 * 1_000_000], dtype=np.int64), np.zeros(2, dtype=np.float32))
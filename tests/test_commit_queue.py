@@ -0,0 +1,21 @@
+import numpy as np
+from CommitQueue import ArrayBatch, CommitQueue
+from Partitions import SensorRegistry
+
+
+def test_group_commit_syncs_only_touched_partitions(tmp_path):
+    registry = SensorRegistry(str(tmp_path), 'binary', None)
+
+    synced = []
+
+    for sensor_id in ('a', 'b', 'c'):
+        registry.get(sensor_id, create=True).storage.sync = lambda sensor_id=sensor_id: synced.append(sensor_id)
+
+    queue = CommitQueue(registry, fsync_policy='batch')
+
+    try:
+        queue.submit(ArrayBatch('b', np.array([1], dtype=np.int64), np.array([20], dtype=np.float32))).result()
+
+        assert synced == ['b']
+    finally:
+        queue.close()
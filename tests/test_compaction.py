@@ -0,0 +1,184 @@
+import numpy as np
+import pytest
+import Compaction
+from Compaction import DAY
+from conftest import append_days, make_storage, make_worker_storage, read_pages
+from Partitions import SensorRegistry
+from Storage import MICROSECONDS_PER_SECOND, SegmentError, StaleCursorError
+
+
+def test_compaction_keeps_every_reading(tmp_path):
+    storage = make_storage(tmp_path)
+
+    times = append_days(storage, np.arange(10))
+
+    storage.compact(compact_before=7 * DAY)
+
+    assert storage.archive_days() == list(range(7))
+
+    assert len(storage.live.read_arrays()[0]) == 12
+
+    assert np.array_equal(storage.read_arrays()[0], times)
+
+
+def test_retention_drops_old_days(tmp_path):
+    storage = make_storage(tmp_path)
+
+    append_days(storage, np.arange(10))
+
+    storage.compact(compact_before=5 * DAY)
+
+    storage.compact(compact_before=5 * DAY, retain_after=3 * DAY)
+
+    assert storage.archive_days() == [3, 4]
+
+    assert (storage.read_arrays()[0] // DAY).min() == 3
+
+
+def test_retention_drops_live_readings_without_archiving_them(tmp_path):
+    storage = make_storage(tmp_path)
+
+    times = append_days(storage, np.arange(6))
+
+    storage.compact(compact_before=2 * DAY, retain_after=3 * DAY)
+
+    assert storage.archive_days() == []
+
+    assert np.array_equal(read_pages(storage, 3), times[times >= 3 * DAY])
+
+
+def test_late_readings_are_archived_by_the_next_compaction(tmp_path):
+    storage = make_storage(tmp_path)
+
+    times = append_days(storage, np.arange(6))
+
+    storage.compact(compact_before=3 * DAY)
+
+    late = DAY + np.array([10, 11], dtype=np.int64) * MICROSECONDS_PER_SECOND
+
+    storage.append_arrays(late, np.zeros(len(late), dtype=np.float32))
+
+    storage.compact(compact_before=3 * DAY)
+
+    assert len(storage.live.read_arrays()[0]) == 12
+
+    assert np.array_equal(read_pages(storage, 5), np.sort(np.concatenate((times, late))))
+
+
+def test_archive_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(Compaction, 'ARCHIVE_CACHE_DAYS', 3)
+
+    storage = make_storage(tmp_path)
+
+    times = append_days(storage, np.arange(10))
+
+    storage.compact(compact_before=8 * DAY)
+
+    assert np.array_equal(storage.read_arrays()[0], times)
+
+    assert len(storage._cache) == 3
+
+    # the most recently read days stay cached
+    assert np.array_equal(storage.query(start=7 * DAY, end=8 * DAY)[0], times[28:32])
+
+    assert len(storage._cache) == 3
+
+
+def test_downsampling_keeps_one_reading_per_bucket(tmp_path):
+    storage = make_storage(tmp_path)
+
+    append_days(storage, np.arange(3), per_day=120)
+
+    storage.compact(compact_before=2 * DAY, downsample_before=1 * DAY, downsample_width=60)
+
+    times = storage.read_arrays()[0]
+
+    # two minutes of one-second readings become one mean per minute
+    assert (times < DAY).sum() == 2
+
+    assert (times >= DAY).sum() == 240
+
+
+def test_pagination_spans_archives_and_live_segment(tmp_path):
+    storage = make_storage(tmp_path)
+
+    times = append_days(storage, np.arange(6))
+
+    storage.compact(compact_before=3 * DAY)
+
+    assert np.array_equal(read_pages(storage, 5), times)
+
+
+def test_cursor_from_before_a_compaction_is_rejected(tmp_path):
+    storage = make_storage(tmp_path)
+
+    append_days(storage, np.arange(6))
+
+    _, _, cursor = storage.query(limit=5)
+
+    storage.compact(compact_before=3 * DAY)
+
+    with pytest.raises(StaleCursorError):
+        storage.query(limit=5, cursor=cursor)
+
+
+def test_workers_read_the_archives(tmp_path):
+    storage = make_storage(tmp_path)
+
+    times = append_days(storage, np.arange(6))
+
+    storage.compact(compact_before=3 * DAY)
+
+    worker = make_worker_storage(tmp_path, 'w1')
+
+    later = append_days(worker, np.arange(6, 8))
+
+    expected = np.concatenate((times, later))
+
+    assert np.array_equal(worker.read_arrays()[0], expected)
+
+    assert np.array_equal(read_pages(worker, 7), expected)
+
+    # another worker's cursor is valid here, positions are shared through the files
+    _, _, cursor = worker.query(limit=7)
+
+    other = make_worker_storage(tmp_path, 'w2')
+
+    assert np.array_equal(other.query(cursor=cursor)[0], expected[7:])
+
+    with pytest.raises(SegmentError):
+        worker.compact(compact_before=7 * DAY)
+
+
+def test_worker_rollups_include_archived_history(tmp_path):
+    (tmp_path / 'temperature_data').mkdir()
+
+    storage = make_storage(tmp_path / 'temperature_data')
+
+    times = append_days(storage, np.arange(4))
+
+    storage.compact(compact_before=2 * DAY)
+
+    partition = SensorRegistry(str(tmp_path / 'temperature_data'), worker_id='w1').get('sensor')
+
+    counts = partition.rollups.query('1d', None, None)['count']
+
+    assert counts.sum() == len(times)
+
+
+def test_compactor_skips_worker_shards_and_says_so(tmp_path, capsys):
+    registry = SensorRegistry(str(tmp_path), 'binary', 'w1')
+
+    storage = registry.get('sensor', create=True).storage
+
+    times = append_days(storage, np.arange(3))
+
+    compactor = Compaction.Compactor(registry, interval=0)
+
+    compactor.run(now=3 * DAY)
+
+    compactor.run(now=3 * DAY)
+
+    assert capsys.readouterr().out.count('Compaction skipped for sensor') == 1
+
+    assert np.array_equal(storage.read_arrays()[0], times)
@@ -0,0 +1,21 @@
+import io
+import pytest
+from Compression import CompressionError, read_compressed_body
+
+
+def test_body_without_length_is_read_to_the_end():
+    body = bytes(range(256)) * 1000
+
+    assert read_compressed_body(io.BytesIO(body), None) == body
+
+
+def test_body_with_length_stops_there():
+    assert read_compressed_body(io.BytesIO(b'abcdef'), 3) == b'abc'
+
+
+@pytest.mark.parametrize('content_length', [None, 11])
+def test_oversized_body_is_rejected(content_length):
+    with pytest.raises(CompressionError) as error:
+        read_compressed_body(io.BytesIO(b'x' * 11), content_length, limit=10)
+
+    assert error.value.error_code == 413
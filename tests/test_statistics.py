@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from ArrayStatistics import as_float_array
+from Statistics import OUTLIER_FILTERS, RECENT_WINDOW, StatisticsFilter, filter_batch, load_running_statistics
+
+
+def post(statistics_filter: StatisticsFilter, *values: float) -> np.ndarray:
+    return filter_batch([statistics_filter], as_float_array(values), np.zeros(len(values), dtype=np.int64))
+
+
+@pytest.mark.parametrize('method', OUTLIER_FILTERS)
+def test_sustained_step_change_is_accepted(tmp_path, method):
+    statistics_filter = StatisticsFilter(str(tmp_path / 'sensor.stats.json'), method=method)
+
+    for _ in range(100):
+        post(statistics_filter, 20.0)
+
+    assert not post(statistics_filter, 25.0)[0]
+
+    accepted = [bool(post(statistics_filter, 25.0)[0]) for _ in range(RECENT_WINDOW)]
+
+    assert accepted[-1]
+
+    # once the new level is learnt, it stays accepted and a spike is still an outlier
+    assert all(accepted[accepted.index(True):])
+
+    assert not post(statistics_filter, 40.0)[0]
+
+
+@pytest.mark.parametrize('method', OUTLIER_FILTERS)
+def test_isolated_outlier_is_rejected(tmp_path, method):
+    statistics_filter = StatisticsFilter(str(tmp_path / 'sensor.stats.json'), method=method)
+
+    values = 20 + np.sin(np.arange(200) / 10) * 0.5
+
+    assert post(statistics_filter, *values).sum() >= len(values) - 1
+
+    accepted = post(statistics_filter, 20.1, 60.0, 20.2)
+
+    assert accepted.tolist() == [True, False, True]
+
+
+def test_statistics_survive_a_restart(tmp_path):
+    filename = str(tmp_path / 'sensor.stats.json')
+
+    statistics_filter = StatisticsFilter(filename)
+
+    post(statistics_filter, *np.linspace(19, 21, 50))
+
+    statistics_filter.save()
+
+    restored = load_running_statistics(filename)
+
+    assert restored.mean == pytest.approx(statistics_filter.statistics.mean)
+
+    assert restored.recent.tolist() == statistics_filter.statistics.recent.tolist()
+
+
+@pytest.mark.parametrize('method', OUTLIER_FILTERS)
+def test_non_finite_reading_leaves_the_statistics_alone(tmp_path, method):
+    statistics_filter = StatisticsFilter(str(tmp_path / 'sensor.stats.json'), method=method)
+
+    post(statistics_filter, *20 + np.sin(np.arange(50) / 10) * 0.5)
+
+    assert post(statistics_filter, float('inf'), 20.1, float('nan')).tolist() == [False, True, False]
+
+    assert np.isfinite(statistics_filter.statistics.mean) and np.isfinite(statistics_filter.statistics.m2)
+
+    assert np.isfinite(statistics_filter.statistics.recent).all()
+
+    assert post(statistics_filter, *[20.0] * 10).all()
+
+
+@pytest.mark.parametrize('method', OUTLIER_FILTERS)
+def test_one_sensor_step_is_accepted_in_a_steady_room(tmp_path, method):
+    statistics_filter = StatisticsFilter(str(tmp_path / 'sensor.stats.json'), method=method)
+
+    # the Packet Tracer thermostat reads 0..1023 over -100..100 degrees
+    step = 200 / 1023
+
+    steady = 600 * step - 100
+
+    post(statistics_filter, *[steady] * 300)
+
+    assert post(statistics_filter, steady + step, steady - step, steady).all()
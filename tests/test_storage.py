@@ -0,0 +1,190 @@
+import os
+import numpy as np
+import pytest
+import Storage
+from conftest import open_segment, read_pages
+from Storage import CursorError, SegmentError, ShardedTemperatureStorage, get_shard_filename
+
+
+def append_late_batches(storage) -> np.ndarray:
+    # every batch but the first is older than the one before, so each starts a new index run
+    batches = [np.array([50, 60, 60, 70]), np.array([10, 60, 20]), np.array([30, 30]), np.array([5, 65, 60])]
+
+    for batch in batches:
+        storage.append_arrays(batch.astype(np.int64), np.zeros(len(batch), dtype=np.float32))
+
+    return np.concatenate(batches)
+
+
+def expected_order(times: np.ndarray) -> np.ndarray:
+    return np.sort(times, kind='stable')
+
+
+@pytest.fixture(autouse=True)
+def no_background_merge(monkeypatch):
+    monkeypatch.setattr(Storage, 'MAX_INDEX_RUNS', 1000)
+
+
+def test_late_batches_append_runs(tmp_path):
+    storage = open_segment(tmp_path)
+
+    times = append_late_batches(storage)
+
+    index, _, runs = storage.snapshot()
+
+    assert len(index) == len(times)
+
+    assert runs.tolist() == [0, 4, 7, 9]
+
+    assert np.array_equal(storage.query()[0], expected_order(times))
+
+    assert np.array_equal(storage.query(20, 60)[0], [20, 30, 30, 50])
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 5])
+def test_pages_across_runs(tmp_path, limit):
+    storage = open_segment(tmp_path)
+
+    times = append_late_batches(storage)
+
+    assert np.array_equal(read_pages(storage, limit), expected_order(times))
+
+    assert np.array_equal(read_pages(storage, limit, start=30, end=60), [30, 30, 50])
+
+
+def test_merge_leaves_one_run(tmp_path):
+    storage = open_segment(tmp_path)
+
+    times = append_late_batches(storage)
+
+    storage.merge_index_runs()
+
+    index, _, runs = storage.snapshot()
+
+    assert runs.tolist() == [0]
+
+    assert np.array_equal(index['time'], expected_order(times))
+
+    assert np.array_equal(read_pages(storage, 2), expected_order(times))
+
+
+def test_runs_survive_reopen(tmp_path):
+    storage = open_segment(tmp_path)
+
+    times = append_late_batches(storage)
+
+    reopened = open_segment(tmp_path)
+
+    assert np.array_equal(reopened.query()[0], expected_order(times))
+
+    reopened.append_arrays(np.array([1], dtype=np.int64), np.zeros(1, dtype=np.float32))
+
+    assert reopened.query(limit=1)[0].tolist() == [1]
+
+
+def test_appends_survive_reopen(tmp_path):
+    storage = open_segment(tmp_path)
+
+    storage.append_arrays(np.array([1, 2], dtype=np.int64), np.array([20, 21], dtype=np.float32))
+
+    storage.append_arrays(np.array([3], dtype=np.int64), np.array([22], dtype=np.float32))
+
+    times, temperatures, _ = open_segment(tmp_path).query()
+
+    assert times.tolist() == [1, 2, 3]
+
+    assert temperatures.tolist() == [20, 21, 22]
+
+
+def test_reopen_drops_a_partial_record_and_rebuilds_the_index(tmp_path):
+    storage = open_segment(tmp_path)
+
+    storage.append_arrays(np.array([1, 2], dtype=np.int64), np.array([20, 21], dtype=np.float32))
+
+    with open(storage.filename, 'ab') as segment_file:
+        segment_file.write(b'\x01' * (Storage.RECORD_DTYPE.itemsize - 1))
+
+    os.remove(storage.index_filename)
+
+    reopened = open_segment(tmp_path)
+
+    assert os.path.getsize(storage.filename) == Storage.SEGMENT_HEADER_SIZE + 2 * Storage.RECORD_DTYPE.itemsize
+
+    assert reopened.query()[0].tolist() == [1, 2]
+
+    reopened.append_arrays(np.array([3], dtype=np.int64), np.array([22], dtype=np.float32))
+
+    assert open_segment(tmp_path).query()[0].tolist() == [1, 2, 3]
+
+
+def test_version_1_segment_is_migrated(tmp_path):
+    filename = get_shard_filename(str(tmp_path), 'sensor', None)
+
+    legacy_records = np.array([(2.5, 20), (1.0, 21)], dtype=Storage.LEGACY_RECORD_DTYPE)
+
+    with open(filename, 'wb') as segment_file:
+        segment_file.write(Storage.SEGMENT_HEADER.pack(Storage.SEGMENT_MAGIC, Storage.LEGACY_SEGMENT_VERSION,
+                                                       Storage.LEGACY_RECORD_DTYPE.itemsize).ljust(Storage.SEGMENT_HEADER_SIZE, b'\0'))
+
+        segment_file.write(legacy_records.tobytes())
+
+    times, temperatures, _ = open_segment(tmp_path).query()
+
+    assert times.tolist() == [1_000_000, 2_500_000]
+
+    assert temperatures.tolist() == [21, 20]
+
+    with open(filename, 'rb') as segment_file:
+        assert Storage.SEGMENT_HEADER.unpack(segment_file.read(Storage.SEGMENT_HEADER.size))[1] == Storage.SEGMENT_VERSION
+
+
+def test_foreign_file_is_rejected(tmp_path):
+    with open(get_shard_filename(str(tmp_path), 'sensor', None), 'wb') as segment_file:
+        segment_file.write(b'not a temperature segment')
+
+    with pytest.raises(SegmentError):
+        open_segment(tmp_path)
+
+
+def test_pages_split_equal_timestamps(tmp_path):
+    storage = open_segment(tmp_path)
+
+    storage.append_arrays(np.array([1, 2, 2, 2, 2, 3], dtype=np.int64), np.arange(6, dtype=np.float32))
+
+    temperatures, cursor = [], None
+
+    while True:
+        _, page, cursor = storage.query(limit=2, cursor=cursor)
+
+        temperatures.extend(page.tolist())
+
+        if cursor is None:
+            break
+
+    assert temperatures == list(range(6))
+
+
+def test_pages_across_shards(tmp_path):
+    first = ShardedTemperatureStorage(str(tmp_path), 'sensor', 'w1')
+
+    second = ShardedTemperatureStorage(str(tmp_path), 'sensor', 'w2')
+
+    first.append_arrays(np.array([1, 2, 2, 3], dtype=np.int64), np.zeros(4, dtype=np.float32))
+
+    second.append_arrays(np.array([2, 2, 3], dtype=np.int64), np.ones(3, dtype=np.float32))
+
+    first.refresh()
+
+    expected = [1, 2, 2, 2, 2, 3, 3]
+
+    for limit in (1, 2, 3):
+        assert read_pages(first, limit).tolist() == expected
+
+
+def test_malformed_cursor_is_rejected(tmp_path):
+    storage = open_segment(tmp_path)
+
+    storage.append_arrays(np.array([1], dtype=np.int64), np.zeros(1, dtype=np.float32))
+
+    with pytest.raises(CursorError):
+        storage.query(limit=1, cursor='not-a-cursor')
@@ -0,0 +1,53 @@
+import os
+import pytest
+from Partitions import SensorRegistry
+from Validation import compile_schema, temperatureDataBatchSchema, temperatureDataRequestSchema, validate_temperature_data_batch, \
+    validate_temperature_data_request
+
+VALIDATORS = {
+    'fast': (validate_temperature_data_request, validate_temperature_data_batch),
+    'schema': (compile_schema(temperatureDataRequestSchema), compile_schema(temperatureDataBatchSchema))
+}
+
+
+def reading(**fields) -> dict:
+    return {'temperature': 21.5, 'time': '2026-10-18T10:00:00Z', **fields}
+
+
+@pytest.mark.parametrize('kind', VALIDATORS)
+def test_valid_reading_is_accepted(kind):
+    validate_request, validate_batch = VALIDATORS[kind]
+
+    assert validate_request({'temperature_data': reading(sensor_id='kitchen-1')}) == (True, None)
+
+    assert validate_batch({'temperatures_batch': [reading(), reading(temperature=20)]}) == (True, None)
+
+
+@pytest.mark.parametrize('kind', VALIDATORS)
+@pytest.mark.parametrize('temperature', [float('inf'), float('-inf'), float('nan'), 10 ** 400])
+def test_non_finite_temperature_is_rejected(kind, temperature):
+    validate_request, validate_batch = VALIDATORS[kind]
+
+    assert not validate_request({'temperature_data': reading(temperature=temperature)})[0]
+
+    assert not validate_batch({'temperatures_batch': [reading(), reading(temperature=temperature)]})[0]
+
+
+@pytest.mark.parametrize('kind', VALIDATORS)
+@pytest.mark.parametrize('sensor_id', ['abc\n', '', '../abc', '.hidden', 'a' * 65])
+def test_unsafe_sensor_id_is_rejected(kind, sensor_id):
+    validate_request, validate_batch = VALIDATORS[kind]
+
+    assert not validate_request({'temperature_data': reading(sensor_id=sensor_id)})[0]
+
+    assert not validate_batch({'temperatures_batch': [reading(sensor_id=sensor_id)]})[0]
+
+
+@pytest.mark.parametrize('sensor_id', ['abc\n', 'abc\ndef'])
+def test_registry_refuses_unsafe_sensor_id(tmp_path, sensor_id):
+    registry = SensorRegistry(str(tmp_path), 'binary', None)
+
+    with pytest.raises(ValueError):
+        registry.get(sensor_id, create=True)
+
+    assert os.listdir(tmp_path) == []